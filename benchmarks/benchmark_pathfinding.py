@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+"""
+ Micro-benchmark of the pathfinding engines of dijkstra_algorithm.py.
+
+ It creates a random cost matrix with some No Data cells and an existing road
+ along the bottom of the raster, then searches the least cost path from random
+ cells to that road with every engine. The paths given by the engines are
+ compared to the ones of the original engine ("queue"). The engines are the
+ ones of the registry of pathfinding_engines.py, so a new engine is benchmarked
+ as soon as it is registered. A few regression cases (check_impassable_roads)
+ are compared to the original engine first.
+
+ It does not need QGIS; run it with a Python interpreter from anywhere :
+     python benchmarks/benchmark_pathfinding.py [size] [number of searches] [delta] [processes]
+ where delta is the width of the buckets of the delta-stepping engine and
+ processes its number of processes (0 for the default ones).
+"""
+
+import importlib
+import os
+import random
+import sys
+import time
+
+# The plugin folder is a package (its modules use relative imports), so we
+# import it from its parent folder.
+PLUGIN_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(PLUGIN_FOLDER))
+dijkstra_algorithm = importlib.import_module(os.path.basename(PLUGIN_FOLDER) + ".dijkstra_algorithm")
+pathfinding_engines = importlib.import_module(os.path.basename(PLUGIN_FOLDER) + ".pathfinding_engines")
+
+# Engines whose paths are close to the least cost paths, but can cost more.
+APPROXIMATE_ENGINES = ("hierarchical", "corridor")
+
+
+def make_matrix(size, seed=0):
+    """Random cost matrix (raster order, None for No Data) of size * size cells."""
+    generator = random.Random(seed)
+    matrix = []
+    for i in range(size):
+        row = []
+        for j in range(size):
+            if generator.random() < 0.03:
+                row.append(None)
+            else:
+                row.append(float(generator.randint(1, 20)))
+        matrix.append(row)
+    return matrix
+
+
+def run(size=200, searches=10, delta=0, workers=0):
+    matrix = make_matrix(size)
+    generator = random.Random(1)
+    # The existing road is the first row (bottom of the raster).
+    end_row_cols = [(0, col) for col in range(size)]
+    starts = [(generator.randint(size // 2, size - 2), generator.randint(0, size - 1)) for i in range(searches)]
+    punishers = {45: 1.25, 90: 2, 135: 5}
+
+    state = dijkstra_algorithm.SearchState(matrix)
+    # The engines of the registry are prepared once, as in the plugin.
+    engines = []
+    for name in pathfinding_engines.engine_names():
+        options = {"cluster_size": 32, "number_of_processes": workers or None}
+        if name == "delta":
+            options["bucket_width"] = delta or None
+        engine = pathfinding_engines.create_engine(name, state, end_row_cols, options)
+        begin = time.perf_counter()
+        engine.precompute()
+        print("%-13s prepared in %.3f s" % (name, time.perf_counter() - begin))
+        engines.append(engine)
+
+    for angle_considered in (False, True):
+        reference = None
+        print("Raster of %d * %d cells, %d searches, angles considered : %s"
+              % (size, size, searches, angle_considered))
+        # The engines of the dijkstra function that are not in the registry work on the
+        # matrix itself; the original one ("queue") is the reference.
+        for engine in ["queue", "heap"] + engines:
+            results = []
+            begin = time.perf_counter()
+            for start in starts:
+                if isinstance(engine, str):
+                    results.append(dijkstra_algorithm.dijkstra(start, end_row_cols, matrix, angle_considered,
+                                                               punishers, engine=engine))
+                else:
+                    results.append(engine.query([start], end_row_cols, angle_considered, punishers))
+            duration = time.perf_counter() - begin
+            if reference is None:
+                reference = results
+                same = "reference"
+            elif results == reference:
+                same = "same paths"
+            elif [result[1] and round(result[1][-1], 6) for result in results] == \
+                    [result[1] and round(result[1][-1], 6) for result in reference]:
+                same = "same costs"
+            else:
+                # Some engines (e.g. "hierarchical" or "corridor") give paths close to the
+                # least cost paths : we show how much more they cost at most.
+                # The "turns" engine gives cheaper paths when the angles are considered.
+                ratios = [(result[1][-1] / best[1][-1] - 1 if result[1] and best[1] and best[1][-1] else 0)
+                          for result, best in zip(results, reference)]
+                if max(ratios) > 0:
+                    same = "DIFFERENT COSTS, up to %+.2f %%" % (100 * max(ratios))
+                else:
+                    same = "cheaper costs, down to %+.2f %%" % (100 * min(ratios))
+            print("    %-13s %8.3f s   (%s)" % (engine if isinstance(engine, str) else engine.name, duration, same))
+    for engine in engines:
+        engine.close()
+
+
+def check_impassable_roads():
+    """Regression case : roads on cells that cannot be crossed (in the last row of the
+    raster, which is never searched, or on No Data cells) must not be reached, and
+    must not make an engine fail. The costs of every engine are compared to the ones
+    of the original engine ("queue"); the engines of APPROXIMATE_ENGINES must only
+    reach a road when it can be reached, at a cost that is not lower. Returns the
+    number of differences."""
+    differences = 0
+    for size, road_row_cols in ((16, [(15, 1)]), (40, [(39, 20), (10, 10), (30, 5)])):
+        matrix = make_matrix(size, seed=size)
+        # The road of (10, 10) is a No Data cell (the matrix is in raster order).
+        matrix[size - 1 - 10][10] = None
+        generator = random.Random(size)
+        starts = [(generator.randint(0, size - 2), generator.randint(0, size - 1)) for i in range(10)]
+        state = dijkstra_algorithm.SearchState(matrix)
+        for name in pathfinding_engines.engine_names():
+            engine = pathfinding_engines.create_engine(name, state, road_row_cols,
+                                                       {"cluster_size": 8, "number_of_processes": 1})
+            engine.precompute()
+            for start in starts:
+                reference = dijkstra_algorithm.dijkstra(start, road_row_cols, matrix, False, {}, engine="queue")
+                result = engine.query([start], engine.targets, False, {})
+                if name in APPROXIMATE_ENGINES and (reference[1] is None) == (result[1] is None):
+                    different = result[1] is not None and result[1][-1] < reference[1][-1] - 1e-6
+                else:
+                    different = (reference[1] and round(reference[1][-1], 6)) != (result[1]
+                                                                                  and round(result[1][-1], 6))
+                if different:
+                    differences += 1
+                    print("    %-13s from %s : cost %s instead of %s" % (name, start, result[1] and result[1][-1],
+                                                                       reference[1] and reference[1][-1]))
+            engine.close()
+    print("Roads on impassable cells : %d difference(s) with the original engine" % differences)
+    return differences
+
+
+if __name__ == "__main__":
+    arguments = [float(argument) if i == 2 else int(argument) for i, argument in enumerate(sys.argv[1:])]
+    check_impassable_roads()
+    run(*arguments)
@@ -0,0 +1,299 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ForestRoads
+                                 A QGIS plugin
+ Create a network of forest roads based on zones to access, roads to connect
+ them to, and a cost matrix.
+ The code of the plugin is based on the "LeastCostPath" plugin available on
+ https://github.com/Gooong/LeastCostPath. We thank their team for the template.
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 10-07-2019
+        copyright            : (C) 2019 by Clement Hardy
+        email                : clem.hardy@outlook.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ This script describes the delta-stepping search : the nodes of the frontier
+ are grouped in buckets of costs of a given width (delta), and all the nodes of
+ a bucket are expanded at the same time with NumPy. When a bucket is big, its
+ nodes are split between the processes of a pool, which read the costs and the
+ distances in shared memory.
+"""
+
+
+import multiprocessing
+import os
+import sys
+import weakref
+from math import sqrt
+import numpy as np
+from .dijkstra_algorithm import NEIGHBOURS_OFFSETS, SearchTargets
+
+# shared_memory only exists since Python 3.8; without it, the nodes are all
+# expanded in the main process.
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+
+# Smallest number of nodes of a bucket for which they are split between the
+# processes of the pool; smaller buckets are expanded in the main process, as
+# sending them to the pool would take longer.
+PARALLEL_MIN_NODES = 20000
+
+# Arrays of the shared memory, in the processes of the pool (see _init_worker).
+_worker_arrays = {}
+
+
+def _relax(keys, light, delta, h, w, costs, passable, dist):
+    """Returns the moves from the given nodes (array of flat indexes) that make the
+    distance of a neighbour smaller : the neighbours, their new distances, and the
+    nodes they come from. If light is True, only the moves that cost at most delta
+    are considered, otherwise only the others. The costs are computed in the same
+    way as in the other engines, so they are exactly the same."""
+    sqrt2 = sqrt(2)
+    rows, cols = np.divmod(keys, w)
+    next_keys_list = []
+    new_dists_list = []
+    from_keys_list = []
+    for d_row, d_col, diagonal in NEIGHBOURS_OFFSETS:
+        next_rows = rows + d_row
+        next_cols = cols + d_col
+        inside = (next_rows >= 0) & (next_rows < h) & (next_cols >= 0) & (next_cols < w)
+        from_keys = keys[inside]
+        next_keys = next_rows[inside] * w + next_cols[inside]
+        reachable = passable[next_keys]
+        from_keys = from_keys[reachable]
+        next_keys = next_keys[reachable]
+        if diagonal:
+            moves = sqrt2 * (costs[from_keys] + costs[next_keys]) / 2
+        else:
+            moves = (costs[from_keys] + costs[next_keys]) / 2
+        kept = moves <= delta if light else moves > delta
+        new_dists = dist[from_keys[kept]] + moves[kept]
+        next_keys = next_keys[kept]
+        better = new_dists < dist[next_keys]
+        next_keys_list.append(next_keys[better])
+        new_dists_list.append(new_dists[better])
+        from_keys_list.append(from_keys[kept][better])
+    return np.concatenate(next_keys_list), np.concatenate(new_dists_list), np.concatenate(from_keys_list)
+
+
+def _init_worker(names, h, w):
+    """Opens the shared memory in a process of the pool."""
+    n = h * w
+    _worker_arrays['blocks'] = [shared_memory.SharedMemory(name=name) for name in names]
+    costs_block, passable_block, dist_block = _worker_arrays['blocks']
+    _worker_arrays['costs'] = np.ndarray(n, dtype=np.float64, buffer=costs_block.buf)
+    _worker_arrays['passable'] = np.ndarray(n, dtype=np.bool_, buffer=passable_block.buf)
+    _worker_arrays['dist'] = np.ndarray(n, dtype=np.float64, buffer=dist_block.buf)
+    _worker_arrays['shape'] = (h, w)
+
+
+def _relax_in_worker(keys, light, delta):
+    h, w = _worker_arrays['shape']
+    return _relax(keys, light, delta, h, w, _worker_arrays['costs'], _worker_arrays['passable'],
+                  _worker_arrays['dist'])
+
+
+class DeltaStepping:
+    """Delta-stepping search on the costs of a SearchState (without the angles).
+
+    The frontier is made of buckets of width delta, as in the "bucket" engine, but
+    all the nodes of the first bucket are expanded at once : first through the
+    "light" moves (costing at most delta) until the bucket stays empty, as they can
+    put nodes back in it, and then through the "heavy" moves. When the first bucket
+    containing ending nodes has been expanded, their distances cannot decrease
+    anymore, so the path is exactly the least cost path, whatever the width.
+
+    A wide bucket gives few big steps, which are better expanded in parallel, but
+    expands nodes again more often; a narrow bucket the opposite.
+
+    The pool of processes is created with the "spawn" method, which works on every
+    system. In QGIS, sys.executable is QGIS itself, so the processes are started with
+    the Python interpreter next to it. The pool and the shared memory must be freed
+    with close()."""
+
+    def __init__(self, state, delta=None, workers=None):
+        self.h = state.h
+        self.w = state.w
+        n = self.h * self.w
+        if not delta:
+            # One bucket holds about the moves of 2 cells of the mean cost.
+            passable_costs = state.costs[state.passable]
+            delta = 2 * float(passable_costs.mean()) if len(passable_costs) and passable_costs.mean() > 0 else 1.0
+        self.delta = delta
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if shared_memory is None:
+            workers = 0
+        self.workers = workers if workers > 1 else 0
+
+        self.pool = None
+        self.blocks = []
+        if self.workers:
+            self.blocks = [shared_memory.SharedMemory(create=True, size=max(1, n * size))
+                           for size in (8, 1, 8)]
+            self.costs = np.ndarray(n, dtype=np.float64, buffer=self.blocks[0].buf)
+            self.passable = np.ndarray(n, dtype=np.bool_, buffer=self.blocks[1].buf)
+            self.dist = np.ndarray(n, dtype=np.float64, buffer=self.blocks[2].buf)
+            self.costs[:] = state.costs
+            self.passable[:] = state.passable
+            context = multiprocessing.get_context('spawn')
+            executable = _python_executable()
+            if executable is not None:
+                context.set_executable(executable)
+            self.pool = context.Pool(self.workers, _init_worker,
+                                     ([block.name for block in self.blocks], self.h, self.w))
+            # If close() is not called (e.g. after an exception), the pool and the shared
+            # memory are freed when the object is deleted.
+            weakref.finalize(self, _free, self.pool, self.blocks)
+        else:
+            self.costs = state.costs
+            self.passable = state.passable
+            self.dist = np.empty(n, dtype=np.float64)
+        self.dist.fill(np.inf)
+        self.pred = np.full(n, -1, dtype=np.int64)
+
+    def close(self):
+        """Stops the pool and frees the shared memory."""
+        # The arrays must not use the shared memory anymore when it is freed.
+        self.costs = self.passable = self.dist = None
+        _free(self.pool, self.blocks)
+        self.pool = None
+        self.blocks = []
+
+    def _relax(self, keys, light):
+        if self.pool is not None and len(keys) >= PARALLEL_MIN_NODES:
+            chunks = np.array_split(keys, self.workers)
+            results = self.pool.starmap(_relax_in_worker, [(chunk, light, self.delta) for chunk in chunks])
+            return tuple(np.concatenate(arrays) for arrays in zip(*results))
+        return _relax(keys, light, self.delta, self.h, self.w, self.costs, self.passable, self.dist)
+
+    def _apply(self, moves, buckets, touched):
+        """Keeps the best of the moves towards every neighbour, and puts the neighbours
+        whose distance decreases in their bucket."""
+        next_keys, new_dists, from_keys = moves
+        if len(next_keys) == 0:
+            return
+        order = np.lexsort((new_dists, next_keys))
+        next_keys = next_keys[order]
+        new_dists = new_dists[order]
+        from_keys = from_keys[order]
+        first = np.ones(len(next_keys), dtype=np.bool_)
+        first[1:] = next_keys[1:] != next_keys[:-1]
+        next_keys = next_keys[first]
+        new_dists = new_dists[first]
+        from_keys = from_keys[first]
+        better = new_dists < self.dist[next_keys]
+        next_keys = next_keys[better]
+        new_dists = new_dists[better]
+        self.dist[next_keys] = new_dists
+        self.pred[next_keys] = from_keys[better]
+        touched.append(next_keys)
+        bucket_numbers = (new_dists // self.delta).astype(np.int64)
+        for number in np.unique(bucket_numbers):
+            buckets.setdefault(int(number), []).append(next_keys[bucket_numbers == number])
+
+    def search(self, start_row_col, end_row_cols, feedback=None):
+        """Returns the path, the accumulated costs along the path and the ending cell
+        that was reached, or three None if no ending cell can be reached."""
+        h, w = self.h, self.w
+        row, col = start_row_col
+        if not (0 <= row < h and 0 <= col < w) or not self.passable[row * w + col]:
+            return None, None, None
+        start_key = row * w + col
+        # The mask of a SearchTargets is kept from one search to the next.
+        if isinstance(end_row_cols, SearchTargets) and len(end_row_cols.mask) == h * w:
+            is_end = end_row_cols.mask.view(np.bool_)
+        else:
+            is_end = np.zeros(h * w, dtype=np.bool_)
+            end_keys = [row * w + col for row, col in end_row_cols if 0 <= row < h and 0 <= col < w]
+            is_end[end_keys] = True
+        if is_end[start_key]:
+            return None, None, None
+
+        delta = self.delta
+        self.dist[start_key] = 0.0
+        touched = [np.array([start_key])]
+        buckets = {0: [touched[0]]}
+        best_end_key = -1
+        try:
+            while buckets:
+                if feedback is not None and feedback.isCanceled():
+                    return None, None, None
+                number = min(buckets)
+                expanded = []
+                # The light moves can put nodes back in the current bucket.
+                while number in buckets:
+                    keys = np.unique(np.concatenate(buckets.pop(number)))
+                    # Nodes whose distance has decreased since are in another bucket.
+                    keys = keys[(self.dist[keys] // delta) == number]
+                    if len(keys) == 0:
+                        continue
+                    expanded.append(keys)
+                    self._apply(self._relax(keys, True), buckets, touched)
+                if not expanded:
+                    continue
+                expanded = np.unique(np.concatenate(expanded))
+                # The distances of the nodes of the bucket are now the least costs : if some
+                # of them are ending nodes, the closest one is the end of the path.
+                ends_found = expanded[is_end[expanded]]
+                if len(ends_found):
+                    best_end_key = int(ends_found[np.argmin(self.dist[ends_found])])
+                    break
+                self._apply(self._relax(expanded, False), buckets, touched)
+
+            if best_end_key == -1:
+                return None, None, None
+            path = []
+            costs_of_path = []
+            key = best_end_key
+            while key != -1:
+                path.append(divmod(key, w))
+                costs_of_path.append(float(self.dist[key]))
+                key = int(self.pred[key])
+            path.reverse()
+            costs_of_path.reverse()
+            return path, costs_of_path, path[-1]
+        finally:
+            touched = np.concatenate(touched)
+            self.dist[touched] = np.inf
+            self.pred[touched] = -1
+
+
+def _free(pool, blocks):
+    """Stops a pool of processes and frees blocks of shared memory (once)."""
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+    while blocks:
+        block = blocks.pop()
+        try:
+            block.close()
+            block.unlink()
+        except (BufferError, FileNotFoundError):
+            pass
+
+
+def _python_executable():
+    """Returns the Python interpreter to start the processes of the pool with, if
+    sys.executable is not one (e.g. in QGIS), or None."""
+    if os.path.basename(sys.executable).lower().startswith('python'):
+        return None
+    for name in ('pythonw.exe', 'python.exe', 'python3', 'python'):
+        for folder in (sys.exec_prefix, os.path.join(sys.exec_prefix, 'bin'), os.path.dirname(sys.executable)):
+            candidate = os.path.join(folder, name)
+            if os.path.isfile(candidate):
+                return candidate
+    return None
@@ -30,121 +30,343 @@
 
 from math import sqrt
 import math
+import os
 import queue
-import random
-from qgis.core import (
-    QgsFeature,
-    QgsGeometry,
-    QgsPoint,
-    QgsPointXY,
-    QgsField,
-    QgsFields,
-    QgsWkbTypes,
-    QgsProcessing,
-    QgsFeatureSink,
-    QgsProcessingException,
-    QgsProcessingAlgorithm,
-    QgsProcessingParameterFeatureSource,
-    QgsProcessingParameterFeatureSink,
-    QgsProcessingParameterRasterLayer,
-    QgsProcessingParameterBand,
-    QgsProcessingParameterBoolean
-)
-
-
-def dijkstra(start_row_col, end_row_cols, block, angle_considered, punisherAngleDictionnary,feedback=None):
+import heapq
+import tempfile
+import time
+import numpy as np
+
+# Names of the frontier engines that can be given to the dijkstra function.
+# "heap" uses a binary heap (heapq) on flat integer keys and skips the stale
+# entries of the frontier; "array" does the same, but keeps the state of the
+# search in the preallocated NumPy arrays of a SearchState object that can be
+# reused from one search to the next; "astar" is the "array" engine guided by
+# a lower bound of the remaining cost towards the ending nodes (A* algorithm);
+# "alt" is the "astar" engine with tighter bounds made from the distances to
+# some landmark cells (see landmarks_algorithm.py); "bidirectional" grows two
+# searches at the same time, one from the start and one from the ending nodes,
+# until they meet; "queue" is the original engine based on queue.PriorityQueue,
+# kept to compare the results and the running times; "bucket" replaces the
+# binary heap by a circular array of buckets of costs (Dial's algorithm), see
+# _dijkstra_bucket for the precision of its results; "hierarchical" searches
+# first in a graph of clusters of cells (HPA*, see hierarchical_algorithm.py);
+# "corridor" searches first in aggregated matrices, then in corridors around
+# the paths found in them (see corridor_algorithm.py); "jump" jumps over the
+# regions of uniform cost (see _dijkstra_jump); "delta" expands whole buckets
+# of nodes at once, in parallel (see delta_stepping_algorithm.py); "sweep"
+# computes the costs from the ending nodes to every cell with NumPy sweeps,
+# repairs them around the new ending nodes, and follows them back from the
+# start (see sweep_algorithm.py); "turns" searches the cells together with the
+# move that entered them when the angles are considered (see _dijkstra_turns).
+# All engines give paths of the same cost (except "bucket" with a cost
+# quantization, and "hierarchical" and "corridor" whose paths are close to the
+# least cost paths); "heap", "array" and "queue" give the same paths. When the angles
+# are considered, only "turns" gives the least cost paths.
+ENGINES = ("heap", "array", "astar", "alt", "bidirectional", "bucket", "hierarchical", "corridor", "jump",
+           "delta", "sweep", "turns", "queue")
+
+# Maximal number of buckets of the "bucket" engine. If the costs need more, the
+# buckets are made wider.
+MAX_BUCKETS = 1 << 20
+
+
+def dijkstra(start_row_col, end_row_cols, block, angle_considered, punisherAngleDictionnary, feedback=None,
+             engine="heap", state=None, network_distance=None, landmark_bounds=None, bucket_width=None,
+             hierarchical_search=None, corridor_search=None, delta_stepping=None, sweep_field=None, max_cost=None,
+             statistics=None, cost_quantization=None):
+    """Function to find the least cost path between a starting cell and the closest
+    of the ending cells. Every cell is a (row, column) tuple, with rows counted from
+    the bottom of the raster. The engine parameter selects the frontier used by the
+    search (see ENGINES); the "array", "astar", "bidirectional", "bucket", "jump" and
+    "turns" engines use the given SearchState (made from the same matrix), or create
+    one if there is none. The "bucket" engine uses buckets of the given width, and
+    rounds the costs of the moves to multiples of cost_quantization if it is given
+    (see _dijkstra_bucket). When the angles are considered, the cost of a move depends on
+    the previous one, so the "bidirectional", "bucket", "jump", "hierarchical",
+    "delta" and "sweep" engines are replaced by the "array" engine; when they are
+    not, the "turns" engine is the "array" engine. The "astar" engine also uses the
+    given NetworkDistanceTransform, the "alt" engine the given LandmarkBounds (see
+    landmarks_algorithm.py), the "hierarchical" engine the given HierarchicalSearch
+    (see hierarchical_algorithm.py), the "corridor" engine the given CorridorSearch
+    (see corridor_algorithm.py), the "delta" engine the given DeltaStepping (see
+    delta_stepping_algorithm.py) and the "sweep" engine the given SweepField (see
+    sweep_algorithm.py); they must have been made from the same matrix, and all but
+    the "delta" one from the same ending cells. If max_cost is given, the "array",
+    "astar", "alt", "bucket" and "turns" engines (and the "array" engine when it
+    replaces another one) stop when every path left to explore costs more than it,
+    and set the capped flag of their SearchState; the other engines do not stop.
+    The "array", "astar", "alt", "bucket", "sweep" and "turns" engines (and the
+    "array" engine when it replaces another one) also take a list of starting
+    cells, and then give the least cost path from any of them (see
+    dijkstra_from_cells).
+    If a SearchStatistics is given, the counters and the time of the search are
+    added to it. Returns the path, the accumulated costs along the path and the
+    ending cell that was reached, or three None if no ending cell can be reached."""
+    if statistics is not None:
+        begin = time.perf_counter()
+        result = dijkstra(start_row_col, end_row_cols, block, angle_considered, punisherAngleDictionnary, feedback,
+                          engine, state, network_distance, landmark_bounds, bucket_width, hierarchical_search,
+                          corridor_search, delta_stepping, sweep_field, max_cost,
+                          cost_quantization=cost_quantization)
+        statistics.add(state.counters if state is not None else None, time.perf_counter() - begin)
+        return result
+    if state is not None:
+        state.capped = False
+        state.counters = None
+    if engine == "heap":
+        return _dijkstra_heap(start_row_col, end_row_cols, block, angle_considered, punisherAngleDictionnary,
+                              feedback)
+    elif engine == "array":
+        if state is None:
+            state = SearchState(block)
+        return _dijkstra_array(start_row_col, end_row_cols, state, angle_considered, punisherAngleDictionnary,
+                               feedback, max_cost=max_cost)
+    elif engine == "astar":
+        if state is None:
+            state = SearchState(block)
+        if network_distance is None:
+            network_distance = NetworkDistanceTransform(state, end_row_cols)
+        return _dijkstra_array(start_row_col, end_row_cols, state, angle_considered, punisherAngleDictionnary,
+                               feedback, network_distance.flat_bounds, max_cost=max_cost)
+    elif engine == "alt":
+        if landmark_bounds is None:
+            raise ValueError("The alt engine needs the bounds given by the landmarks of the cost raster.")
+        return _dijkstra_array(start_row_col, end_row_cols, landmark_bounds.state, angle_considered,
+                               punisherAngleDictionnary, feedback, landmark_bounds.bound, max_cost=max_cost)
+    elif engine == "bidirectional":
+        if state is None:
+            state = SearchState(block)
+        if angle_considered:
+            return _dijkstra_array(start_row_col, end_row_cols, state, angle_considered, punisherAngleDictionnary,
+                                   feedback, max_cost=max_cost)
+        return _dijkstra_bidirectional(start_row_col, end_row_cols, state, feedback)
+    elif engine == "bucket":
+        if state is None:
+            state = SearchState(block)
+        if angle_considered:
+            return _dijkstra_array(start_row_col, end_row_cols, state, angle_considered, punisherAngleDictionnary,
+                                   feedback, max_cost=max_cost)
+        return _dijkstra_bucket(start_row_col, end_row_cols, state, bucket_width, feedback, max_cost,
+                                cost_quantization)
+    elif engine == "jump":
+        if state is None:
+            state = SearchState(block)
+        if angle_considered:
+            return _dijkstra_array(start_row_col, end_row_cols, state, angle_considered, punisherAngleDictionnary,
+                                   feedback, max_cost=max_cost)
+        return _dijkstra_jump(start_row_col, end_row_cols, state, feedback)
+    elif engine == "hierarchical":
+        if hierarchical_search is None:
+            raise ValueError("The hierarchical engine needs the clusters of the cost raster.")
+        if angle_considered:
+            return _dijkstra_array(start_row_col, end_row_cols, hierarchical_search.state, angle_considered,
+                                   punisherAngleDictionnary, feedback, max_cost=max_cost)
+        return hierarchical_search.search(start_row_col, feedback)
+    elif engine == "corridor":
+        if corridor_search is None:
+            raise ValueError("The corridor engine needs the aggregated matrices of the cost raster.")
+        return corridor_search.search(start_row_col, angle_considered, punisherAngleDictionnary, feedback)
+    elif engine == "delta":
+        if delta_stepping is None:
+            raise ValueError("The delta engine needs the pool of processes of the delta-stepping search.")
+        if angle_considered:
+            if state is None:
+                state = SearchState(block)
+            return _dijkstra_array(start_row_col, end_row_cols, state, angle_considered, punisherAngleDictionnary,
+                                   feedback, max_cost=max_cost)
+        return delta_stepping.search(start_row_col, end_row_cols, feedback)
+    elif engine == "sweep":
+        if sweep_field is None:
+            raise ValueError("The sweep engine needs the cost-distance raster of the road network.")
+        if angle_considered:
+            return _dijkstra_array(start_row_col, end_row_cols, sweep_field.state, angle_considered,
+                                   punisherAngleDictionnary, feedback, max_cost=max_cost)
+        return sweep_field.search(start_row_col, feedback)
+    elif engine == "turns":
+        if state is None:
+            state = SearchState(block)
+        if angle_considered:
+            return _dijkstra_turns(start_row_col, end_row_cols, state, punisherAngleDictionnary, feedback,
+                                   max_cost)
+        return _dijkstra_array(start_row_col, end_row_cols, state, angle_considered, punisherAngleDictionnary,
+                               feedback, max_cost=max_cost)
+    elif engine == "queue":
+        return _dijkstra_queue(start_row_col, end_row_cols, block, angle_considered, punisherAngleDictionnary,
+                               feedback)
+    else:
+        raise ValueError("Unknown pathfinding engine : " + str(engine))
+
+
+def dijkstra_from_cells(start_row_cols, end_row_cols, block, angle_considered, punisherAngleDictionnary,
+                        feedback=None, state=None, max_cost=None, statistics=None):
+    """Function to find the least cost path between the closest pair of a starting
+    cell and an ending cell (e.g. between all the cells of a polygon that are still
+    too far from the roads, and the roads). The search starts from all the starting
+    cells at a cost of 0, so one search replaces one search from each of them, and
+    stops at the first ending cell it reaches. The starting cells that are also
+    ending cells are ignored. Uses the given SearchState (made from the same matrix),
+    or creates one if there is none, stops at max_cost and adds its counters to the
+    SearchStatistics as the dijkstra function. Returns the path (from the starting cell it comes from), the accumulated costs
+    along the path and the ending cell that was reached, or three None if no ending
+    cell can be reached."""
+    if state is None:
+        state = SearchState(block)
+    begin = time.perf_counter()
+    result = _dijkstra_array(list(start_row_cols), end_row_cols, state, angle_considered, punisherAngleDictionnary,
+                             feedback, max_cost=max_cost)
+    if statistics is not None:
+        statistics.add(state.counters, time.perf_counter() - begin)
+    return result
+
+
+class SearchStatistics:
+    """Counters of the searches given to the dijkstra function : number of searches,
+    nodes expanded, moves relaxed (that made the distance of a node smaller), stale
+    entries popped from the frontier, largest size of the frontier (looked at every
+    CANCEL_CHECK_INTERVAL expansions, and at the end of the search) and time. The
+    "array", "astar", "alt", "bucket", "corridor" and "turns" engines count (and
+    every engine replaced by "array"); the others only give the time. The engines
+    count with a few local integers, so the counting costs almost nothing.
+
+    The totals of all the searches are kept, as well as the totals of the searches
+    made since the last call to take_current (e.g. the searches of a road). If one
+    of the searches of a total was not counted, its counters are None (and not 0,
+    which would look like a measure)."""
+
+    COUNTERS = ("expanded", "relaxed", "stale", "peak_frontier")
+
+    def __init__(self):
+        self.searches = 0
+        self.totals = self._zeros()
+        self.current = self._zeros()
+        self.last = None
+
+    def _zeros(self):
+        totals = dict.fromkeys(self.COUNTERS, 0)
+        totals["time"] = 0.0
+        return totals
+
+    def add(self, counters, duration):
+        """Adds the counters (tuple in the order of COUNTERS, or None if the search was not
+        counted) and the time of a search."""
+        self.searches += 1
+        self.last = dict(zip(self.COUNTERS, counters if counters is not None else (None,) * len(self.COUNTERS)))
+        self.last["time"] = duration
+        for totals in (self.totals, self.current):
+            for name, value in zip(self.COUNTERS, counters if counters is not None else (None,) * len(self.COUNTERS)):
+                if value is None or totals[name] is None:
+                    totals[name] = None
+                elif name == "peak_frontier":
+                    totals[name] = max(totals[name], value)
+                else:
+                    totals[name] += value
+            totals["time"] += duration
+
+    def take_current(self):
+        """Returns the totals of the searches made since the last call, and starts new ones."""
+        current = self.current
+        self.current = self._zeros()
+        return current
+
+
+# The grid class is used to both contain the matrix of the values
+# of the cost raster, but also to have usefull function for the
+# pathfinding algorithm used here.
+class Grid:
     sqrt2 = sqrt(2)
 
-    # The grid class is used to both contain the matrix of the values
-    # of the cost raster, but also to have usefull function for the
-    # pathfinding algorithm used here.
-    class Grid:
-        def __init__(self, matrix):
-            self.map = matrix
-            # h is the height of the matrix/raster
-            self.h = len(matrix)
-            # w is the width of the matrix/raster
-            self.w = len(matrix[0])
-
-        # Function to test if a coordinate is in the bounds of the matrix/raster
-        # In the code, self.h is used to invert the y axis of the coordinates of rows
-        # because I used cartesian coordinates, and the raster have raster coordinates
-        # (inverted y axis). Self.h is diminished by one because it starts at 1, while
-        # the rows start at 0.
-        def _in_bounds(self, id):
-            row, col = id
-            return 0 <= col < self.w and 0 <= row < (self.h-1)
-
-        # Function to test if the raster value of this coordinate is not empty (has a cost to pass it)
-        def _passable(self, id):
-            row, col = id
-            return self.map[(self.h-1)-row][col] is not None
-
-        # Function to test a coordinate is both in bound and passable
-        def is_valid(self, id):
-            return self._in_bounds(id) and self._passable(id)
-
-        # Function to get the eight neighbours of a given cell. They are filtered to get only the valid ones.
-        def neighbors(self, id):
-            row, col = id
-            results = [(row + 1, col), (row, col - 1), (row - 1, col), (row, col + 1),
-                       (row + 1, col - 1), (row + 1, col + 1), (row - 1, col - 1), (row - 1, col + 1)]
-            results = filter(self.is_valid, results)
-            return results
-
-        # Static function to calculate the manhattan distance between two cells.
-        @staticmethod
-        def manhattan_distance(id1, id2):
-            x1, y1 = id1
-            x2, y2 = id2
-            return abs(x1 - x2) + abs(y1 - y2)
-
-        # Function to calculate the minimum manhattan distance between nodes that have been explored yet and the ending
-        # nodes for feedback purposes.
-        def min_manhattan(self, curr_node, end_nodes):
-            return min(map(lambda node: self.manhattan_distance(curr_node, node), end_nodes))
-
-        def getAngle(self, a, b, c):
-            """Function to get the angle between three coordinates."""
-            ang = math.degrees(math.atan2(c[1]-b[1], c[0]-b[0]) - math.atan2(a[1]-b[1], a[0]-b[0]))
-            return ang + 360 if ang < 0 else ang
-
-        # Function to get the cost associated for passing from a node to another (current, next)
-        def simple_cost(self, cur, nex, predecessorDictionnary, angle_considered, punisherAngleDictionnary):
-            # Coordinates of current
-            crow, ccol = cur
-            # Coordinates of next
-            nrow, ncol = nex
-            # Get the value associated with the current node
-            currV = self.map[(self.h-1) - crow][ccol]
-            # Get the value associated with the next node
-            offsetV = self.map[(self.h-1) - nrow][ncol]
-            # Check if the nodes are horizontal/vertical neighbours, or diagonals.
-            # Adjust the cost to go from one to the other accordingly.
-            if ccol == ncol or crow == nrow:
-                cost =  (currV + offsetV) / 2
-            else:
-                cost =  sqrt2 * (currV + offsetV) / 2
-            # Then, we adjust the cost according to the angle formed between the predecessor of current and next.
-            if angle_considered and predecessorDictionnary[cur] is not None:
-                pred = predecessorDictionnary[cur]
-                angle = self.getAngle(pred, cur, nex)
-                # Case of 45 degrees
-                if angle == 180 - 45 or angle == 180 + 45:
-                    cost = cost * punisherAngleDictionnary[45]
-                elif angle == 180 - 90 or angle == 180 + 90:
-                    cost = cost * punisherAngleDictionnary[90]
-                elif angle == 180 - 135 or angle == 180 + 135:
-                    cost = cost * punisherAngleDictionnary[135]
-                # Case of a flat angle (0 degrees) : we do nothing.
-                # Case of a full turn (180 degrees) : impossible with the dijkstra algorithm.
+    def __init__(self, matrix):
+        self.map = matrix
+        # h is the height of the matrix/raster
+        self.h = len(matrix)
+        # w is the width of the matrix/raster
+        self.w = len(matrix[0])
+
+    # Function to test if a coordinate is in the bounds of the matrix/raster
+    # In the code, self.h is used to invert the y axis of the coordinates of rows
+    # because I used cartesian coordinates, and the raster have raster coordinates
+    # (inverted y axis). Self.h is diminished by one because it starts at 1, while
+    # the rows start at 0.
+    def _in_bounds(self, id):
+        row, col = id
+        return 0 <= col < self.w and 0 <= row < (self.h-1)
+
+    # Function to test if the raster value of this coordinate is not empty (has a cost to pass it)
+    def _passable(self, id):
+        row, col = id
+        return self.map[(self.h-1)-row][col] is not None
+
+    # Function to test a coordinate is both in bound and passable
+    def is_valid(self, id):
+        return self._in_bounds(id) and self._passable(id)
+
+    # Function to get the eight neighbours of a given cell. They are filtered to get only the valid ones.
+    def neighbors(self, id):
+        row, col = id
+        results = [(row + 1, col), (row, col - 1), (row - 1, col), (row, col + 1),
+                   (row + 1, col - 1), (row + 1, col + 1), (row - 1, col - 1), (row - 1, col + 1)]
+        results = filter(self.is_valid, results)
+        return results
+
+    # Static function to calculate the manhattan distance between two cells.
+    @staticmethod
+    def manhattan_distance(id1, id2):
+        x1, y1 = id1
+        x2, y2 = id2
+        return abs(x1 - x2) + abs(y1 - y2)
+
+    # Function to calculate the minimum manhattan distance between nodes that have been explored yet and the ending
+    # nodes for feedback purposes.
+    def min_manhattan(self, curr_node, end_nodes):
+        return min(map(lambda node: self.manhattan_distance(curr_node, node), end_nodes))
 
-            return cost
+    def getAngle(self, a, b, c):
+        """Function to get the angle between three coordinates."""
+        ang = math.degrees(math.atan2(c[1]-b[1], c[0]-b[0]) - math.atan2(a[1]-b[1], a[0]-b[0]))
+        return ang + 360 if ang < 0 else ang
 
+    # Function to get the cost associated for passing from a node to another (current, next)
+    def simple_cost(self, cur, nex, predecessorDictionnary, angle_considered, punisherAngleDictionnary):
+        # Coordinates of current
+        crow, ccol = cur
+        # Coordinates of next
+        nrow, ncol = nex
+        # Get the value associated with the current node
+        currV = self.map[(self.h-1) - crow][ccol]
+        # Get the value associated with the next node
+        offsetV = self.map[(self.h-1) - nrow][ncol]
+        # Check if the nodes are horizontal/vertical neighbours, or diagonals.
+        # Adjust the cost to go from one to the other accordingly.
+        if ccol == ncol or crow == nrow:
+            cost =  (currV + offsetV) / 2
+        else:
+            cost =  self.sqrt2 * (currV + offsetV) / 2
+        # Then, we adjust the cost according to the angle formed between the predecessor of current and next.
+        if angle_considered and predecessorDictionnary[cur] is not None:
+            pred = predecessorDictionnary[cur]
+            angle = self.getAngle(pred, cur, nex)
+            # Case of 45 degrees
+            if angle == 180 - 45 or angle == 180 + 45:
+                cost = cost * punisherAngleDictionnary[45]
+            elif angle == 180 - 90 or angle == 180 + 90:
+                cost = cost * punisherAngleDictionnary[90]
+            elif angle == 180 - 135 or angle == 180 + 135:
+                cost = cost * punisherAngleDictionnary[135]
+            # Case of a flat angle (0 degrees) : we do nothing.
+            # Case of a full turn (180 degrees) : impossible with the dijkstra algorithm.
+
+        return cost
+
+
+def _dijkstra_queue(start_row_col, end_row_cols, block, angle_considered, punisherAngleDictionnary, feedback=None):
     # We create the grid object containing the values of the cost raster
     grid = Grid(block)
     # We create a set of nodes to reach (multiple goal possible)
-    end_row_cols = set(end_row_cols)
+    if isinstance(end_row_cols, SearchTargets):
+        end_row_cols = end_row_cols.row_cols
+    else:
+        end_row_cols = set(end_row_cols)
 
     # We create a priority Queue which contains the nodes that are opened but
     # not closed (see functioning of dijkstra algorithm; nodes are opened to
@@ -236,3 +458,1432 @@ def dijkstra(start_row_col, end_row_cols, block, angle_considered, punisherAngle
     # We return nothing.
     else:
         return None, None, None
+
+
+# Relative coordinates of the eight neighbours of a cell, in the same order as in
+# Grid.neighbors. The third value indicates if the move is a diagonal one.
+NEIGHBOURS_OFFSETS = ((1, 0, False), (0, -1, False), (-1, 0, False), (0, 1, False),
+                      (1, -1, True), (1, 1, True), (-1, -1, True), (-1, 1, True))
+
+# Number of nodes popped from the frontier between two checks of the cancellation
+# of the algorithm by the user.
+CANCEL_CHECK_INTERVAL = 1024
+
+# Number of cells of the arrays of a SearchState that are processed at once when
+# they are computed in parts (see SearchState.on_disk).
+CHUNK_CELLS = 1 << 22
+
+
+def _get_angle(a, b, c):
+    """Function to get the angle between three coordinates (same as Grid.getAngle)."""
+    ang = math.degrees(math.atan2(c[1]-b[1], c[0]-b[0]) - math.atan2(a[1]-b[1], a[0]-b[0]))
+    return ang + 360 if ang < 0 else ang
+
+
+def _dijkstra_heap(start_row_col, end_row_cols, matrix, angle_considered, punisherAngleDictionnary, feedback=None):
+    """Same search as _dijkstra_queue, but with a frontier made of a heapq list.
+    Nodes are identified by a flat integer key (row * width + column), which keeps
+    the order of the (row, column) tuples used to break ties in the original
+    engine, and thus gives the same paths. Entries of the frontier that have been
+    replaced by a cheaper one are skipped when they are popped instead of being
+    expanded again."""
+    sqrt2 = sqrt(2)
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+
+    # h is the height of the matrix/raster, w its width.
+    h = len(matrix)
+    w = len(matrix[0])
+    # As in Grid._in_bounds, the rows go from 0 to h-2 (the last row of the
+    # cartesian coordinates is not considered).
+    last_row = h - 1
+
+    start_row, start_col = start_row_col
+    # If the starting node is invalid, we return nothing
+    if not (0 <= start_col < w and 0 <= start_row < last_row) or matrix[last_row - start_row][start_col] is None:
+        return None, None, None
+
+    # We create a set of keys of the nodes to reach. Nodes outside of the raster
+    # cannot be reached, and would give wrong keys.
+    end_keys = set()
+    for row, col in end_row_cols:
+        if 0 <= col < w:
+            end_keys.add(row * w + col)
+
+    start_key = start_row * w + start_col
+    # If the starting node is also an ending node, we return nothing
+    if start_key in end_keys:
+        return None, None, None
+
+    # Relative keys of the neighbours, with the information needed to compute the costs.
+    neighbours = tuple((d_row, d_col, d_row * w + d_col, diagonal) for d_row, d_col, diagonal in NEIGHBOURS_OFFSETS)
+
+    frontier = [(0, start_key)]
+    came_from = {start_key: None}
+    cost_so_far = {start_key: 0}
+    current_key = None
+    popped = 0
+
+    while frontier:
+        current_cost, current_key = heappop(frontier)
+        # If a cheaper entry for this node has already been popped, this one is stale.
+        if current_cost > cost_so_far[current_key]:
+            continue
+
+        popped += 1
+        if feedback is not None and popped % CANCEL_CHECK_INTERVAL == 0:
+            # The algorithm is canceled if users told it to feedback.
+            if feedback.isCanceled():
+                return None, None, None
+
+        # We break the loop if the current node is a goal to reach
+        if current_key in end_keys:
+            break
+
+        row, col = divmod(current_key, w)
+        current_value = matrix[last_row - row][col]
+        if angle_considered and came_from[current_key] is not None:
+            predecessor = divmod(came_from[current_key], w)
+        else:
+            predecessor = None
+
+        for d_row, d_col, d_key, diagonal in neighbours:
+            next_row = row + d_row
+            next_col = col + d_col
+            if not (0 <= next_col < w and 0 <= next_row < last_row):
+                continue
+            next_value = matrix[last_row - next_row][next_col]
+            if next_value is None:
+                continue
+            # Same computation of the cost as in Grid.simple_cost.
+            if diagonal:
+                cost = sqrt2 * (current_value + next_value) / 2
+            else:
+                cost = (current_value + next_value) / 2
+            if predecessor is not None:
+                angle = _get_angle(predecessor, (row, col), (next_row, next_col))
+                if angle == 180 - 45 or angle == 180 + 45:
+                    cost = cost * punisherAngleDictionnary[45]
+                elif angle == 180 - 90 or angle == 180 + 90:
+                    cost = cost * punisherAngleDictionnary[90]
+                elif angle == 180 - 135 or angle == 180 + 135:
+                    cost = cost * punisherAngleDictionnary[135]
+
+            new_cost = current_cost + cost
+            next_key = current_key + d_key
+            if next_key not in cost_so_far or new_cost < cost_so_far[next_key]:
+                cost_so_far[next_key] = new_cost
+                heappush(frontier, (new_cost, next_key))
+                came_from[next_key] = current_key
+
+    # When the loop ends, if we did indeed found an end goal, we go back
+    # through the predecessors to make the path.
+    if current_key in end_keys:
+        end_node = divmod(current_key, w)
+        path = []
+        costs = []
+        while current_key is not None:
+            path.append(divmod(current_key, w))
+            costs.append(cost_so_far[current_key])
+            current_key = came_from[current_key]
+        path.reverse()
+        costs.reverse()
+        return path, costs, end_node
+    else:
+        return None, None, None
+
+
+# Straight directions (row, column) of the tables of SearchState.jump_tables.
+JUMP_DIRECTIONS = ((0, 1), (0, -1), (1, 0), (-1, 0))
+
+
+# Value of the back-directions of the "turns" engine for the moves that leave the start.
+NO_TURN_DIRECTION = 8
+
+
+def turn_multipliers(punisherAngleDictionnary):
+    """Returns the 8 x 8 table of the multipliers of the cost of a move, given the
+    index in NEIGHBOURS_OFFSETS of the move that entered the cell and of the move
+    that leaves it : 1 when going straight, and the punishers of the 45, 90 and 135
+    degrees turns. Going back to the previous cell is not possible (None). The
+    turns are counted in steps of 45 degrees between the two moves, so they do not
+    depend on the rounding of the angles as in _get_angle."""
+    octants = [round(math.degrees(math.atan2(d_col, d_row)) / 45) % 8 for d_row, d_col, diagonal in NEIGHBOURS_OFFSETS]
+    multipliers = {0: 1.0, 1: punisherAngleDictionnary[45], 2: punisherAngleDictionnary[90],
+                   3: punisherAngleDictionnary[135], 4: None}
+    table = []
+    for entering in octants:
+        row = []
+        for leaving in octants:
+            steps = abs(entering - leaving)
+            row.append(multipliers[min(steps, 8 - steps)])
+        table.append(tuple(row))
+    return tuple(table)
+
+
+def _steps_to_stops(stops, blocked, d_row, d_col):
+    """For every cell of 2D boolean arrays, returns the number of moves in the straight
+    direction (d_row, d_col) to the next "stop" cell, or 0 if a "blocked" cell or
+    the border of the arrays comes first."""
+    # We compute it towards the right, on flipped or transposed arrays.
+    if d_row != 0:
+        stops = stops.T
+        blocked = blocked.T
+    if d_row + d_col < 0:
+        stops = stops[:, ::-1]
+        blocked = blocked[:, ::-1]
+    h, w = stops.shape
+    indexes = np.broadcast_to(np.arange(w), (h, w))
+    events = np.where(stops | blocked, indexes, w)
+    # Index of the first event after every cell (w if there is none).
+    next_events = np.full((h, w), w)
+    next_events[:, :-1] = np.minimum.accumulate(events[:, :0:-1], axis=1)[:, ::-1]
+    rows = np.arange(h)[:, None]
+    clipped = np.minimum(next_events, w - 1)
+    found = (next_events < w) & stops[rows, clipped] & ~blocked[rows, clipped]
+    steps = np.where(found, next_events - indexes, 0).astype(np.int32)
+    if d_row + d_col < 0:
+        steps = steps[:, ::-1]
+    if d_row != 0:
+        steps = steps.T
+    return steps
+
+
+class TouchedRows:
+    """Cells touched by a search in a SearchState on disk, kept as the range of
+    columns touched in each row instead of a list of the cells : its size only
+    depends on the height of the raster, however many cells the search reaches.
+    It is filled as the list of the other states (append), and the ranges are put
+    back in their initial state by parts of rows (reset)."""
+
+    def __init__(self, h, w):
+        self.w = w
+        self._first_cols = np.full(h, w, dtype=np.int64)
+        self._last_cols = np.full(h, -1, dtype=np.int64)
+        self.first = memoryview(self._first_cols)
+        self.last = memoryview(self._last_cols)
+        self.empty = True
+
+    def append(self, key):
+        row, col = divmod(key, self.w)
+        if col < self.first[row]:
+            self.first[row] = col
+        if col > self.last[row]:
+            self.last[row] = col
+        self.empty = False
+
+    def reset(self, dist, pred, visited):
+        """Puts back the touched ranges of the arrays of a search, and forgets them."""
+        if self.empty:
+            return
+        for row in np.flatnonzero(self._last_cols >= 0):
+            start = int(row) * self.w + self.first[row]
+            end = int(row) * self.w + self.last[row] + 1
+            dist[start:end] = np.inf
+            pred[start:end] = -1
+            visited[start:end] = False
+        self._first_cols.fill(self.w)
+        self._last_cols.fill(-1)
+        self.empty = True
+
+
+class SearchState:
+    """Preallocated arrays containing the state of a search on a cost matrix, to be
+    used by the "array" engine. The arrays are indexed by the flat index of a cell
+    (row * width + column, with rows counted from the bottom of the raster as in the
+    rest of the search). They are created once for a given matrix, and are reset
+    after each search by only putting back the cells that the search has touched."""
+
+    def __init__(self, matrix):
+        # h is the height of the matrix/raster, w its width.
+        self.h = len(matrix)
+        self.w = len(matrix[0])
+        n = self.h * self.w
+        # The values of the matrix, with NaN for the No Data cells. The matrix is in
+        # raster order (first row at the top), so we flip it.
+        self.costs = np.ascontiguousarray(np.array(matrix, dtype=np.float64)[::-1]).ravel()
+        # A cell is passable if it has a value, and if it is not in the last row
+        # (as in Grid._in_bounds).
+        self.passable = ~np.isnan(self.costs)
+        self.passable[(self.h - 1) * self.w:] = False
+        # Distance from the start, predecessor and visited (closed) flag of every cell.
+        self.dist = np.full(n, np.inf, dtype=np.float64)
+        self.pred = np.full(n, -1, dtype=np.int32)
+        self.visited = np.zeros(n, dtype=np.bool_)
+        # Cells whose distance has been set during the current search.
+        self.touched = []
+        # True if the last search stopped at its maximum cost (see dijkstra).
+        self.capped = False
+        # Counters of the last search (see SearchStatistics), or None if its engine does
+        # not count.
+        self.counters = None
+        # SearchState on the same costs, used by the searches that need two of them.
+        self._sibling = None
+        # Smallest, smallest positive and largest cost of moves of length 1 (see move_costs).
+        self._move_costs = None
+        # Cells surrounded by cells of the same cost (see uniform_cells), and the ending
+        # cells and jump tables of the last "jump" search (see jump_tables).
+        self._uniform_cells = None
+        self._jump_tables = None
+        # Arrays of the "turns" engine (see turn_arrays).
+        self._turn_arrays = None
+        # Costs of the moves in each direction (see edge_weights).
+        self._edge_weights = None
+        # Folder of the memory-mapped files of the arrays (see on_disk).
+        self.directory = None
+
+    @classmethod
+    def on_disk(cls, costs, h, w, directory):
+        """Returns a SearchState whose arrays are memory-mapped files in a folder, for
+        the rasters that do not fit in memory : only the parts of the arrays that a
+        search goes through are loaded by the system. The costs are given as a flat
+        memory-mapped array (e.g. float32) in the order of the flat indexes of the
+        cells (rows counted from the bottom of the raster), with NaN for No Data. The
+        arrays are computed in parts, so they are never entirely in memory. The
+        "array" engine (and dijkstra_from_cells) can be used with it; the other
+        engines and preprocessings make arrays of the size of the raster in memory."""
+        state = cls.__new__(cls)
+        state.h = h
+        state.w = w
+        n = h * w
+        state.directory = directory
+        state.costs = costs
+        state.passable = np.memmap(os.path.join(directory, 'passable.bool'), dtype=np.bool_, mode='w+', shape=n)
+        state.dist = np.memmap(os.path.join(directory, 'dist.f64'), dtype=np.float64, mode='w+', shape=n)
+        state.pred = np.memmap(os.path.join(directory, 'pred.i32'), dtype=np.int32, mode='w+', shape=n)
+        # (a new memory-mapped file is filled with zeros, i.e. False)
+        state.visited = np.memmap(os.path.join(directory, 'visited.bool'), dtype=np.bool_, mode='w+', shape=n)
+        for start in range(0, n, CHUNK_CELLS):
+            end = min(n, start + CHUNK_CELLS)
+            state.passable[start:end] = ~np.isnan(costs[start:end])
+            state.dist[start:end] = np.inf
+            state.pred[start:end] = -1
+        state.passable[(h - 1) * w:] = False
+        # The cells touched by a search are kept by rows, so that a search through
+        # millions of cells does not make a list of millions of cells in memory.
+        state.touched = TouchedRows(h, w)
+        state.capped = False
+        state.counters = None
+        state._sibling = None
+        state._move_costs = None
+        state._uniform_cells = None
+        state._jump_tables = None
+        state._turn_arrays = None
+        state._edge_weights = None
+        return state
+
+    def index(self, row_col):
+        """Returns the flat index of a (row, column) cell, or None if it is out of the matrix."""
+        row, col = row_col
+        if 0 <= row < self.h and 0 <= col < self.w:
+            return row * self.w + col
+        return None
+
+    def row_col(self, index):
+        """Returns the (row, column) tuple of a flat index."""
+        return divmod(index, self.w)
+
+    def sibling(self):
+        """Returns a SearchState that shares the costs of this one, but has its own
+        distances, predecessors and visited flags. It is created only once."""
+        if self._sibling is None:
+            sibling = SearchState.__new__(SearchState)
+            sibling.h = self.h
+            sibling.w = self.w
+            sibling.costs = self.costs
+            sibling.passable = self.passable
+            sibling.dist = np.full_like(self.dist, np.inf)
+            sibling.pred = np.full_like(self.pred, -1)
+            sibling.visited = np.zeros_like(self.visited)
+            sibling.touched = []
+            sibling.capped = False
+            sibling.counters = None
+            sibling._sibling = self
+            sibling._move_costs = self._move_costs
+            sibling._uniform_cells = self._uniform_cells
+            sibling._jump_tables = None
+            sibling._turn_arrays = None
+            sibling._edge_weights = self._edge_weights
+            sibling.directory = None
+            self._sibling = sibling
+        return self._sibling
+
+    def edge_weights(self):
+        """Returns the costs of the moves from every cell towards each of its eight
+        neighbours, as an array of 8 rows (one per offset of NEIGHBOURS_OFFSETS)
+        indexed by the flat index of the cell. The moves from or to a cell that is
+        not passable, or out of the raster, cost inf. They are computed at once with
+        NumPy in the same way as in Grid.simple_cost, so the searches give exactly the
+        same costs as when they compute them one by one. They are computed only once
+        (by bands of rows), and shared with the sibling. If the state is on disk (see
+        on_disk), they are a memory-mapped float32 file of its folder."""
+        if self._edge_weights is None and self._sibling is not None:
+            self._edge_weights = self._sibling._edge_weights
+        if self._edge_weights is None:
+            sqrt2 = sqrt(2)
+            h, w = self.h, self.w
+            if self.directory is None:
+                weights = np.empty((8, h * w), dtype=np.float64)
+            else:
+                weights = np.memmap(os.path.join(self.directory, 'edge_weights.f32'), dtype=np.float32, mode='w+',
+                                    shape=(8, h * w))
+            rows = max(1, CHUNK_CELLS // w)
+            for row_min in range(0, h, rows):
+                row_max = min(h, row_min + rows)
+                # The costs of the rows of the band, and of the rows around it.
+                low, high = max(0, row_min - 1), min(h, row_max + 1)
+                padded = np.full((row_max - row_min + 2, w + 2), np.nan)
+                padded[1 + low - row_min:1 + high - row_min, 1:-1] = \
+                    np.where(self.passable[low * w:high * w], self.costs[low * w:high * w], np.nan).reshape(-1, w)
+                costs = padded[1:-1, 1:-1]
+                for direction, (d_row, d_col, diagonal) in enumerate(NEIGHBOURS_OFFSETS):
+                    neighbour_costs = padded[1 + d_row:row_max - row_min + 1 + d_row, 1 + d_col:w + 1 + d_col]
+                    if diagonal:
+                        plane = sqrt2 * (costs + neighbour_costs) / 2
+                    else:
+                        plane = (costs + neighbour_costs) / 2
+                    plane[np.isnan(plane)] = np.inf
+                    weights[direction, row_min * w:row_max * w] = plane.ravel()
+            self._edge_weights = weights
+        return self._edge_weights
+
+    def move_costs(self):
+        """Returns the smallest, the smallest positive and the largest cost of a move of
+        length 1 between two neighbouring passable cells (i.e. of their mean cost).
+        Horizontal and vertical moves cost this, and diagonal moves sqrt(2) times this.
+        They are None if no move is possible. They are computed only once."""
+        if self._move_costs is None:
+            costs = np.where(self.passable, self.costs, np.nan).reshape(self.h, self.w)
+            mean_costs = np.concatenate([((costs[:, :-1] + costs[:, 1:]) / 2).ravel(),
+                                         ((costs[:-1, :] + costs[1:, :]) / 2).ravel(),
+                                         ((costs[:-1, :-1] + costs[1:, 1:]) / 2).ravel(),
+                                         ((costs[:-1, 1:] + costs[1:, :-1]) / 2).ravel()])
+            mean_costs = mean_costs[~np.isnan(mean_costs)]
+            if len(mean_costs) == 0:
+                self._move_costs = (None, None, None)
+            else:
+                positive_costs = mean_costs[mean_costs > 0]
+                self._move_costs = (float(mean_costs.min()),
+                                    float(positive_costs.min()) if len(positive_costs) else None,
+                                    float(mean_costs.max()))
+        return self._move_costs
+
+    def uniform_cells(self):
+        """Returns a flat boolean array of the passable cells whose neighbours (inside
+        the raster) are passable and have the same cost as them, used by the "jump"
+        engine. It is computed only once."""
+        if self._uniform_cells is None:
+            costs = np.where(self.passable, self.costs, np.nan).reshape(self.h, self.w)
+            padded = np.full((self.h + 2, self.w + 2), np.nan)
+            padded[1:-1, 1:-1] = costs
+            inside = np.zeros((self.h + 2, self.w + 2), dtype=np.bool_)
+            inside[1:-1, 1:-1] = True
+            # The last row can never be reached (see Grid._in_bounds) : it is the same as
+            # being out of the raster.
+            inside[self.h, :] = False
+            # (NaN is never equal to anything, so the cells next to a No Data cell are not
+            # uniform; the neighbours out of the raster do not count)
+            uniform = self.passable.reshape(self.h, self.w).copy()
+            for d_row, d_col, diagonal in NEIGHBOURS_OFFSETS:
+                window = (slice(1 + d_row, self.h + 1 + d_row), slice(1 + d_col, self.w + 1 + d_col))
+                uniform &= (padded[window] == costs) | ~inside[window]
+            self._uniform_cells = uniform.ravel()
+        return self._uniform_cells
+
+    def jump_tables(self, targets):
+        """Returns the tables used by the "jump" engine to follow the straight directions
+        in one step, for the ending cells of a SearchTargets : a flat boolean array of
+        the cells where the jumps stop (cells that are not uniform, and ending cells),
+        and an array of shape (4, number of cells) giving, for the directions
+        JUMP_DIRECTIONS, the number of moves from every cell to the next cell where the
+        jumps stop (0 if an impassable cell or the border of the raster comes first).
+        When ending cells are added from one search to the next (e.g. a new road), only
+        their rows and columns are computed again."""
+        h, w = self.h, self.w
+        stops = None
+        if self._jump_tables is not None:
+            known_targets, known_count, stops, steps = self._jump_tables
+            if known_targets is targets:
+                # The ending cells added since the last search are at the end of the list.
+                new_keys = set(targets.key_list[known_count:])
+            else:
+                known_keys = set(known_targets.key_list[:known_count])
+                if known_keys <= targets.keys:
+                    new_keys = targets.keys - known_keys
+                else:
+                    stops = None
+        if stops is not None:
+            rows = sorted(set(key // w for key in new_keys))
+            cols = sorted(set(key % w for key in new_keys))
+            # If the new ending cells are on too many rows and columns, we compute everything.
+            if len(rows) * w + len(cols) * h > h * w:
+                stops = None
+        blocked = ~self.passable.reshape(h, w)
+        if stops is None:
+            stops = ~self.uniform_cells()
+            stops |= targets.mask.view(np.bool_)
+            stops2d = stops.reshape(h, w)
+            steps = np.empty((4, h, w), dtype=np.int32)
+            for direction, (d_row, d_col) in enumerate(JUMP_DIRECTIONS):
+                steps[direction] = _steps_to_stops(stops2d, blocked, d_row, d_col)
+        elif new_keys:
+            stops[np.fromiter(new_keys, dtype=np.int64, count=len(new_keys))] = True
+            stops2d = stops.reshape(h, w)
+            for direction, (d_row, d_col) in enumerate(JUMP_DIRECTIONS):
+                if d_row == 0:
+                    steps[direction][rows] = _steps_to_stops(stops2d[rows], blocked[rows], d_row, d_col)
+                else:
+                    steps[direction][:, cols] = _steps_to_stops(stops2d[:, cols], blocked[:, cols], d_row, d_col)
+        self._jump_tables = (targets, len(targets.key_list), stops, steps)
+        return stops, steps.reshape(4, h * w)
+
+    def turn_arrays(self):
+        """Returns the arrays used by the "turns" engine, indexed by the flat index of
+        a cell times 8 plus the index in NEIGHBOURS_OFFSETS of the move that entered
+        the cell : the distances from the start, the visited flags, and the index of
+        the move that entered the previous cell (or NO_TURN_DIRECTION if the previous
+        cell is the start). They are created only once, and put back in their initial
+        state by the search itself."""
+        if self._turn_arrays is None:
+            n = self.h * self.w * 8
+            self._turn_arrays = (np.full(n, np.inf, dtype=np.float64), np.zeros(n, dtype=np.bool_),
+                                 np.full(n, NO_TURN_DIRECTION, dtype=np.uint8))
+        return self._turn_arrays
+
+    def reset(self):
+        """Puts the state back as it was before the last search."""
+        if isinstance(self.touched, TouchedRows):
+            self.touched.reset(self.dist, self.pred, self.visited)
+            return
+        if len(self.touched) > len(self.dist) // 8:
+            self.dist.fill(np.inf)
+            self.pred.fill(-1)
+            self.visited.fill(False)
+        elif self.touched:
+            touched = np.array(self.touched, dtype=np.int64)
+            self.dist[touched] = np.inf
+            self.pred[touched] = -1
+            self.visited[touched] = False
+        self.touched = []
+
+
+class SearchTargets:
+    """Ending cells of the searches made in a SearchState (e.g. the road network),
+    kept from one search to the next : the (row, column) cells, their flat indexes
+    (as a set, and as a list in the order in which they were added) and a flat
+    uint8 mask of them, with 1 for the ending cells, that the engines read to know
+    if a cell is an ending cell. It is made once, and add_cells only adds the cells
+    of a new road, so the searches do not go through the whole network to find
+    their ending cells. It can be given as the ending cells of the dijkstra
+    function, as it can be iterated on like a list of cells. If the SearchState is
+    on disk, the mask is a memory-mapped temporary file in its folder."""
+
+    def __init__(self, state, row_cols=()):
+        self.state = state
+        self.row_cols = set()
+        self.keys = set()
+        self.key_list = []
+        n = state.h * state.w
+        if state.directory is not None:
+            self.mask = np.memmap(tempfile.TemporaryFile(dir=state.directory), dtype=np.uint8, mode='w+',
+                                  shape=max(1, n))
+        else:
+            self.mask = np.zeros(n, dtype=np.uint8)
+        self.add_cells(row_cols)
+
+    def add_cells(self, row_cols):
+        """Adds new ending cells (e.g. the cells of a new road)."""
+        for row_col in row_cols:
+            row_col = tuple(row_col)
+            if row_col not in self.row_cols:
+                self.row_cols.add(row_col)
+                key = self.state.index(row_col)
+                if key is not None:
+                    self.keys.add(key)
+                    self.key_list.append(key)
+                    self.mask[key] = 1
+
+    def __iter__(self):
+        return iter(self.row_cols)
+
+    def __len__(self):
+        return len(self.row_cols)
+
+    def __contains__(self, row_col):
+        return tuple(row_col) in self.row_cols
+
+
+def _search_targets(state, end_row_cols):
+    """Returns the SearchTargets of the ending cells of a search : the given one if it
+    is made for the SearchState, or a new one made from the given cells."""
+    if isinstance(end_row_cols, SearchTargets) and end_row_cols.state is state:
+        return end_row_cols
+    return SearchTargets(state, end_row_cols)
+
+
+def _start_keys(state, start_row_col, is_end):
+    """Returns the flat indexes of the starting cells of a search, given as a cell or
+    as a list of cells, without the ones that are not passable or are ending cells
+    (given by the mask of their SearchTargets), and without duplicates."""
+    if isinstance(start_row_col, list):
+        start_keys = [state.index(row_col) for row_col in start_row_col]
+    else:
+        start_keys = [state.index(start_row_col)]
+    return [start_key for start_key in dict.fromkeys(start_keys)
+            if start_key is not None and state.passable[start_key] and not is_end[start_key]]
+
+
+def _dijkstra_array(start_row_col, end_row_cols, state, angle_considered, punisherAngleDictionnary, feedback=None,
+                    heuristic=None, passable=None, max_cost=None):
+    """Same search as _dijkstra_heap, but the distances, predecessors and visited
+    flags are kept in the arrays of a SearchState instead of dictionaries. The
+    arrays are read and written through memoryviews, which return Python floats
+    and integers and are much faster than indexing the NumPy arrays directly.
+    If a heuristic is given (flat array of lower bounds of the cost from each cell
+    to the closest ending node, such as NetworkDistanceTransform.flat_bounds, or a
+    function giving this lower bound for the flat index of a cell), the frontier is
+    ordered by the distance from the start plus this lower bound (A*).
+    If a flat boolean array "passable" is given, it replaces state.passable (e.g. to
+    restrict the search to a corridor).
+    The start can also be a list of cells : the search then starts from all of them
+    at a cost of 0 (see dijkstra_from_cells), and the path starts at the one it
+    comes from.
+    The costs of the moves are read in the edge weights of the SearchState.
+    If max_cost is given, the search stops when every path left to explore costs
+    more than it (at least according to the heuristic), and sets state.capped."""
+    inf = math.inf
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    w = state.w
+    state.capped = False
+
+    if passable is None:
+        passable = state.passable
+    if isinstance(start_row_col, list):
+        start_keys = [state.index(row_col) for row_col in start_row_col]
+    else:
+        start_keys = [state.index(start_row_col)]
+    # If the starting node is invalid, we return nothing
+    start_keys = [start_key for start_key in start_keys if start_key is not None and passable[start_key]]
+    if not start_keys:
+        return None, None, None
+
+    # The ending cells are read in the mask of their SearchTargets.
+    targets = _search_targets(state, end_row_cols)
+    is_end = memoryview(targets.mask)
+    # If the starting node is also an ending node, we return nothing
+    start_keys = [start_key for start_key in dict.fromkeys(start_keys) if not is_end[start_key]]
+    if not start_keys:
+        return None, None, None
+
+    # The moves to the cells that are not passable cost inf, but the cells outside of
+    # a given corridor must also be avoided.
+    restricted = passable is not state.passable
+    passable = memoryview(passable)
+    dist = memoryview(state.dist)
+    pred = memoryview(state.pred)
+    visited = memoryview(state.visited)
+    if heuristic is None or callable(heuristic):
+        bounds = None
+        bound_function = heuristic
+    else:
+        bounds = memoryview(heuristic)
+        bound_function = None
+    touched = state.touched
+    neighbours = tuple((d_row * w + d_col, memoryview(weights))
+                       for (d_row, d_col, diagonal), weights in zip(NEIGHBOURS_OFFSETS, state.edge_weights()))
+
+    frontier = []
+    for start_key in start_keys:
+        frontier.append((0.0, start_key))
+        dist[start_key] = 0.0
+        touched.append(start_key)
+    current_key = None
+    found = False
+    popped = 0
+    stale = 0
+    peak_frontier = 0
+
+    try:
+        while frontier:
+            priority, current_key = heappop(frontier)
+            # If this node has already been expanded, this entry is stale.
+            if visited[current_key]:
+                stale += 1
+                continue
+            if max_cost is not None and priority > max_cost:
+                state.capped = True
+                return None, None, None
+            visited[current_key] = True
+            current_cost = dist[current_key]
+
+            popped += 1
+            if popped % CANCEL_CHECK_INTERVAL == 0:
+                if len(frontier) > peak_frontier:
+                    peak_frontier = len(frontier)
+                if feedback is not None and feedback.isCanceled():
+                    return None, None, None
+
+            if is_end[current_key]:
+                found = True
+                break
+
+            if angle_considered and pred[current_key] != -1:
+                predecessor = divmod(pred[current_key], w)
+                current_row_col = divmod(current_key, w)
+            else:
+                predecessor = None
+
+            for d_key, weights in neighbours:
+                # The moves out of the raster (including from one side of the raster to
+                # the other) or to the cells that are not passable cost inf.
+                cost = weights[current_key]
+                if cost == inf:
+                    continue
+                next_key = current_key + d_key
+                if visited[next_key] or (restricted and not passable[next_key]):
+                    continue
+                if predecessor is not None:
+                    angle = _get_angle(predecessor, current_row_col, divmod(next_key, w))
+                    if angle == 180 - 45 or angle == 180 + 45:
+                        cost = cost * punisherAngleDictionnary[45]
+                    elif angle == 180 - 90 or angle == 180 + 90:
+                        cost = cost * punisherAngleDictionnary[90]
+                    elif angle == 180 - 135 or angle == 180 + 135:
+                        cost = cost * punisherAngleDictionnary[135]
+
+                new_cost = current_cost + cost
+                old_cost = dist[next_key]
+                if new_cost < old_cost:
+                    if old_cost == inf:
+                        touched.append(next_key)
+                    dist[next_key] = new_cost
+                    pred[next_key] = current_key
+                    if bounds is not None:
+                        heappush(frontier, (new_cost + bounds[next_key], next_key))
+                    elif bound_function is not None:
+                        heappush(frontier, (new_cost + bound_function(next_key), next_key))
+                    else:
+                        heappush(frontier, (new_cost, next_key))
+
+        if not found:
+            return None, None, None
+
+        end_node = divmod(current_key, w)
+        path = []
+        costs_of_path = []
+        while current_key != -1:
+            path.append(divmod(current_key, w))
+            costs_of_path.append(dist[current_key])
+            current_key = pred[current_key]
+        path.reverse()
+        costs_of_path.reverse()
+        return path, costs_of_path, end_node
+    finally:
+        # Every entry of the frontier but the starting ones comes from a relaxed move.
+        state.counters = (popped, popped + stale + state.capped + len(frontier) - len(start_keys), stale,
+                          max(peak_frontier, len(frontier)))
+        # The arrays are put back in their initial state for the next search.
+        state.reset()
+
+
+def _dijkstra_bidirectional(start_row_col, end_row_cols, state, feedback=None):
+    """Bidirectional version of _dijkstra_array (without the angles). A forward search
+    grows from the start in the SearchState, and a backward search grows from all of
+    the ending nodes at once in its sibling. As the cost of a move is the same in
+    both directions, the backward search gives the cost from every cell it reaches
+    to the closest ending node. At each step, the search whose next node is the
+    closest to its origin is expanded. Every time a cell has been reached by both
+    searches, the cost of the path going through it is compared to the best one
+    found; the searches stop when the sum of the costs of their next nodes is not
+    lower than this best cost, as no path can be cheaper."""
+    inf = math.inf
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    backward_state = state.sibling()
+    w = state.w
+
+    start_key = state.index(start_row_col)
+    if start_key is None or not state.passable[start_key]:
+        return None, None, None
+    end_keys = {end_key for end_key in _search_targets(state, end_row_cols).keys if state.passable[end_key]}
+    if start_key in end_keys or not end_keys:
+        return None, None, None
+
+    neighbours = tuple((d_row * w + d_col, memoryview(weights))
+                       for (d_row, d_col, diagonal), weights in zip(NEIGHBOURS_OFFSETS, state.edge_weights()))
+    # Everything needed for each direction : frontier, distances, predecessors,
+    # visited flags and touched cells of its own state, and distances of the other.
+    forward = ([(0.0, start_key)], memoryview(state.dist), memoryview(state.pred), memoryview(state.visited),
+               state.touched, memoryview(backward_state.dist))
+    backward = ([(0.0, key) for key in end_keys], memoryview(backward_state.dist), memoryview(backward_state.pred),
+                memoryview(backward_state.visited), backward_state.touched, memoryview(state.dist))
+    heapq.heapify(backward[0])
+    forward[1][start_key] = 0.0
+    state.touched.append(start_key)
+    for key in end_keys:
+        backward[1][key] = 0.0
+        backward_state.touched.append(key)
+    # Best path found : its cost, and the cell where the two searches meet on it.
+    best = [inf, -1]
+
+    def expand(direction):
+        frontier, dist, pred, visited, touched, other_dist = direction
+        current_cost, current_key = heappop(frontier)
+        visited[current_key] = True
+        for d_key, weights in neighbours:
+            cost = weights[current_key]
+            next_key = current_key + d_key
+            if cost == inf or visited[next_key]:
+                continue
+            new_cost = current_cost + cost
+            old_cost = dist[next_key]
+            if new_cost < old_cost:
+                if old_cost == inf:
+                    touched.append(next_key)
+                dist[next_key] = new_cost
+                pred[next_key] = current_key
+                heappush(frontier, (new_cost, next_key))
+                if new_cost + other_dist[next_key] < best[0]:
+                    best[0] = new_cost + other_dist[next_key]
+                    best[1] = next_key
+
+    try:
+        popped = 0
+        while True:
+            # We remove the stale entries at the top of the frontiers.
+            for frontier, dist, pred, visited, touched, other_dist in (forward, backward):
+                while frontier and visited[frontier[0][1]]:
+                    heappop(frontier)
+            if not forward[0] or not backward[0] or forward[0][0][0] + backward[0][0][0] >= best[0]:
+                break
+
+            popped += 1
+            if feedback is not None and popped % CANCEL_CHECK_INTERVAL == 0 and feedback.isCanceled():
+                return None, None, None
+
+            if forward[0][0][0] <= backward[0][0][0]:
+                expand(forward)
+            else:
+                expand(backward)
+
+        if best[1] == -1:
+            return None, None, None
+
+        # The path goes from the start to the meeting cell with the predecessors of the
+        # forward search, then to an ending node with the ones of the backward search.
+        meeting_key = best[1]
+        forward_dist, forward_pred = forward[1], forward[2]
+        backward_dist, backward_pred = backward[1], backward[2]
+        path = []
+        costs_of_path = []
+        current_key = meeting_key
+        while current_key != -1:
+            path.append(divmod(current_key, w))
+            costs_of_path.append(forward_dist[current_key])
+            current_key = forward_pred[current_key]
+        path.reverse()
+        costs_of_path.reverse()
+        meeting_cost = forward_dist[meeting_key]
+        current_key = backward_pred[meeting_key]
+        while current_key != -1:
+            path.append(divmod(current_key, w))
+            costs_of_path.append(meeting_cost + backward_dist[meeting_key] - backward_dist[current_key])
+            current_key = backward_pred[current_key]
+        return path, costs_of_path, path[-1]
+    finally:
+        state.reset()
+        backward_state.reset()
+
+
+def _dijkstra_bucket(start_row_col, end_row_cols, state, bucket_width=None, feedback=None, max_cost=None,
+                     cost_quantization=None):
+    """Version of _dijkstra_array (without the angles) where the frontier is a circular
+    array of buckets (Dial's algorithm) : a node at a distance d from the start is put
+    in the bucket number int(d / bucket_width), and the nodes are taken from the first
+    bucket that is not empty, in any order. Putting and taking a node costs the same
+    whatever the size of the frontier. As a move costs at most the largest cost of the
+    raster times sqrt(2), the nodes of the frontier are never in more than
+    (largest move cost / bucket width) + 2 consecutive buckets, which are reused in a
+    circular way.
+
+    The bucket width only changes the order in which the nodes are expanded, not the
+    path : a node whose distance decreases after it has been expanded is put in a
+    bucket and expanded again, and the search goes on until the bucket in which the
+    first ending node has been found is empty. The path is then exactly the least
+    cost path, whatever the width. The default width is the smallest positive cost
+    of a move, with which the nodes are rarely expanded twice.
+
+    If cost_quantization (q) is given, the cost of every move is rounded to the
+    closest multiple of q, and the default width is q : the nodes of a bucket are
+    then all at the same distance, and are never expanded twice. The path is the
+    least cost path for the rounded costs; as each move is changed by at most q / 2,
+    its cost is higher than the least cost by at most q / 2 per move of this path
+    and of the least cost path. The accumulated costs returned along the path are
+    the exact ones. If max_cost is given, the search stops as in _dijkstra_array
+    (with the rounded costs).
+    The start can also be a list of cells, as in _dijkstra_array.
+    """
+    sqrt2 = sqrt(2)
+    inf = math.inf
+    w = state.w
+    state.capped = False
+
+    targets = _search_targets(state, end_row_cols)
+    is_end = memoryview(targets.mask)
+    start_keys = _start_keys(state, start_row_col, is_end)
+    if not start_keys:
+        return None, None, None
+
+    smallest_cost, smallest_positive_cost, largest_cost = state.move_costs()
+    if largest_cost is None:
+        return None, None, None
+    if not cost_quantization:
+        cost_quantization = None
+    if not bucket_width:
+        bucket_width = cost_quantization or smallest_positive_cost or 1.0
+    largest_move = largest_cost * sqrt2
+    if cost_quantization is not None:
+        largest_move += cost_quantization
+    number_of_buckets = int(largest_move / bucket_width) + 2
+    if number_of_buckets > MAX_BUCKETS:
+        bucket_width = largest_move / (MAX_BUCKETS - 2)
+        number_of_buckets = MAX_BUCKETS
+    buckets = [[] for i in range(number_of_buckets)]
+
+    dist = memoryview(state.dist)
+    pred = memoryview(state.pred)
+    visited = memoryview(state.visited)
+    touched = state.touched
+    neighbours = tuple((d_row * w + d_col, memoryview(weights))
+                       for (d_row, d_col, diagonal), weights in zip(NEIGHBOURS_OFFSETS, state.edge_weights()))
+
+    for start_key in start_keys:
+        dist[start_key] = 0.0
+        touched.append(start_key)
+        buckets[0].append(start_key)
+    pending = len(start_keys)
+    # Absolute number of the current bucket (its place in the array is this number
+    # modulo the number of buckets).
+    current = 0
+    best_end_key = -1
+    popped = 0
+    stale = 0
+    peak_frontier = 0
+
+    try:
+        while pending:
+            bucket = buckets[current % number_of_buckets]
+            if not bucket:
+                # When the bucket of the first ending node found is empty, no other
+                # ending node can be found closer than one bucket width from it.
+                if best_end_key != -1:
+                    break
+                current += 1
+                # The next buckets only contain paths that cost more than max_cost.
+                if max_cost is not None and current * bucket_width > max_cost:
+                    state.capped = True
+                    return None, None, None
+                continue
+            current_key = bucket.pop()
+            pending -= 1
+            # The buckets only contain the nodes. A node is put in a new bucket each time
+            # its distance decreases, and is marked as visited when it is expanded : it is
+            # not expanded again unless its distance decreases again.
+            if visited[current_key]:
+                stale += 1
+                continue
+            visited[current_key] = True
+            current_cost = dist[current_key]
+
+            popped += 1
+            if popped % CANCEL_CHECK_INTERVAL == 0:
+                if pending > peak_frontier:
+                    peak_frontier = pending
+                if feedback is not None and feedback.isCanceled():
+                    return None, None, None
+
+            if is_end[current_key]:
+                if best_end_key == -1 or current_cost < dist[best_end_key]:
+                    best_end_key = current_key
+                continue
+
+            for d_key, weights in neighbours:
+                cost = weights[current_key]
+                if cost == inf:
+                    continue
+                if cost_quantization is not None:
+                    cost = round(cost / cost_quantization) * cost_quantization
+                next_key = current_key + d_key
+                new_cost = current_cost + cost
+                old_cost = dist[next_key]
+                if new_cost < old_cost:
+                    if old_cost == inf:
+                        touched.append(next_key)
+                    dist[next_key] = new_cost
+                    pred[next_key] = current_key
+                    visited[next_key] = False
+                    buckets[int(new_cost / bucket_width) % number_of_buckets].append(next_key)
+                    pending += 1
+
+        if best_end_key == -1:
+            return None, None, None
+
+        current_key = best_end_key
+        path = []
+        costs_of_path = []
+        while current_key != -1:
+            path.append(divmod(current_key, w))
+            costs_of_path.append(dist[current_key])
+            current_key = pred[current_key]
+        path.reverse()
+        costs_of_path.reverse()
+        if cost_quantization is not None:
+            # The distances are the rounded ones : the costs along the path are computed again with the
+            # exact costs of its moves.
+            weights_of_offsets = dict(neighbours)
+            costs_of_path = [0.0]
+            for (row, col), (next_row, next_col) in zip(path, path[1:]):
+                key = row * w + col
+                costs_of_path.append(costs_of_path[-1]
+                                     + weights_of_offsets[(next_row - row) * w + next_col - col][key])
+        return path, costs_of_path, path[-1]
+    finally:
+        # Every node put in a bucket but the starts comes from a relaxed move.
+        state.counters = (popped, popped + stale + pending - len(start_keys), stale, max(peak_frontier, pending))
+        state.reset()
+
+
+def _dijkstra_jump(start_row_col, end_row_cols, state, feedback=None):
+    """Version of _dijkstra_array (without the angles) that jumps over the regions of
+    uniform cost, in the manner of the Jump Point Search. From a node, the search
+    follows each direction of move as long as the cells are uniform (see
+    SearchState.uniform_cells) : in such a region, every path between two cells has
+    an equivalent path made of diagonal moves first and straight moves then, so the
+    cells in between do not need to be put in the frontier. Only the cells where the
+    cost changes around (cost boundaries, No Data, ending cells) are put in it, and
+    they are expanded in every direction as in the normal search. Going diagonally,
+    the search also follows the two straight directions from every cell, and stops
+    where they find such a cell. The straight directions are followed in one step
+    with the tables of SearchState.jump_tables. The paths have the same cost as the
+    ones of the other engines.
+
+    The uniform regions are usually the cells of the existing roads (of cost 0) and
+    the cells where only the basic distance cost is counted."""
+    sqrt2 = sqrt(2)
+    inf = math.inf
+    h = state.h
+    w = state.w
+
+    start_key = state.index(start_row_col)
+    if start_key is None or not state.passable[start_key]:
+        return None, None, None
+    targets = _search_targets(state, end_row_cols)
+    is_end = memoryview(targets.mask)
+    if is_end[start_key]:
+        return None, None, None
+
+    costs = memoryview(state.costs)
+    passable = memoryview(state.passable)
+    uniform = memoryview(state.uniform_cells())
+    stops, steps = state.jump_tables(targets)
+    stops = memoryview(stops)
+    steps = [memoryview(direction_steps) for direction_steps in steps]
+    straight_steps = {direction: steps[index] for index, direction in enumerate(JUMP_DIRECTIONS)}
+    dist = memoryview(state.dist)
+    pred = memoryview(state.pred)
+    visited = memoryview(state.visited)
+    touched = state.touched
+
+    def jump(key, row, col, d_row, d_col):
+        # Follows a direction from a cell, and returns the first cell that must be put in
+        # the frontier with the cost to reach it, or None if there is none. The cells
+        # between are uniform and have the same cost as the cell we start from.
+        if d_row == 0 or d_col == 0:
+            number_of_steps = straight_steps[(d_row, d_col)][key]
+            if number_of_steps == 0:
+                return None
+            next_key = key + number_of_steps * (d_row * w + d_col)
+            return next_key, number_of_steps * (costs[key] + costs[next_key]) / 2
+        d_key = d_row * w + d_col
+        row_steps = straight_steps[(d_row, 0)]
+        col_steps = straight_steps[(0, d_col)]
+        value = costs[key]
+        cost = 0.0
+        while True:
+            row += d_row
+            col += d_col
+            if not (0 <= row < h and 0 <= col < w):
+                return None
+            key += d_key
+            if not passable[key]:
+                return None
+            next_value = costs[key]
+            cost += sqrt2 * (value + next_value) / 2
+            value = next_value
+            # We stop where the two straight directions find a cell to stop at.
+            if stops[key] or row_steps[key] or col_steps[key]:
+                return key, cost
+
+    all_directions = tuple((d_row, d_col) for d_row, d_col, diagonal in NEIGHBOURS_OFFSETS)
+    frontier = [(0.0, start_key)]
+    dist[start_key] = 0.0
+    touched.append(start_key)
+    found = False
+    popped = 0
+
+    try:
+        while frontier:
+            current_cost, current_key = heapq.heappop(frontier)
+            if visited[current_key]:
+                continue
+            visited[current_key] = True
+
+            popped += 1
+            if feedback is not None and popped % CANCEL_CHECK_INTERVAL == 0 and feedback.isCanceled():
+                return None, None, None
+
+            if is_end[current_key]:
+                found = True
+                break
+
+            row, col = divmod(current_key, w)
+            # In a uniform region, we only follow the direction we came from (and its two
+            # straight components if it is diagonal).
+            parent_key = pred[current_key]
+            if parent_key == -1 or not uniform[current_key]:
+                directions = all_directions
+            else:
+                parent_row, parent_col = divmod(parent_key, w)
+                d_row = (row > parent_row) - (row < parent_row)
+                d_col = (col > parent_col) - (col < parent_col)
+                if d_row and d_col:
+                    directions = ((d_row, d_col), (d_row, 0), (0, d_col))
+                else:
+                    directions = ((d_row, d_col),)
+
+            for d_row, d_col in directions:
+                jump_point = jump(current_key, row, col, d_row, d_col)
+                if jump_point is None:
+                    continue
+                next_key, cost = jump_point
+                new_cost = current_cost + cost
+                old_cost = dist[next_key]
+                if new_cost < old_cost:
+                    if old_cost == inf:
+                        touched.append(next_key)
+                    dist[next_key] = new_cost
+                    pred[next_key] = current_key
+                    heapq.heappush(frontier, (new_cost, next_key))
+
+        if not found:
+            return None, None, None
+
+        # The predecessors are jump points : we add the cells in between them, which are
+        # on straight or diagonal lines.
+        keys = [current_key]
+        while pred[keys[-1]] != -1:
+            key = keys[-1]
+            parent_key = pred[key]
+            row, col = divmod(key, w)
+            parent_row, parent_col = divmod(parent_key, w)
+            d_key = ((parent_row > row) - (parent_row < row)) * w + (parent_col > col) - (parent_col < col)
+            while key != parent_key:
+                key += d_key
+                keys.append(key)
+        keys.reverse()
+        path = [divmod(key, w) for key in keys]
+        costs_of_path = [0.0]
+        for (row, col), (next_row, next_col), key, next_key in zip(path, path[1:], keys, keys[1:]):
+            if row != next_row and col != next_col:
+                costs_of_path.append(costs_of_path[-1] + sqrt2 * (costs[key] + costs[next_key]) / 2)
+            else:
+                costs_of_path.append(costs_of_path[-1] + (costs[key] + costs[next_key]) / 2)
+        return path, costs_of_path, path[-1]
+    finally:
+        state.reset()
+
+
+def _dijkstra_turns(start_row_col, end_row_cols, state, punisherAngleDictionnary, feedback=None, max_cost=None):
+    """Search with the angles considered, where a node of the search is a cell and the
+    move that entered it (see SearchState.turn_arrays) instead of a cell only. In the
+    other engines, a cell is expanded only once, with the move of its cheapest path
+    from the start, so a path that enters it with a cheaper turn towards the next
+    cells is never found, and the paths are not always the least cost ones. Here,
+    each of the 8 ways to enter a cell is expanded, and the cost of a turn is read
+    in the table of turn_multipliers instead of being computed with the angles, so
+    the paths are the least cost paths with the punishers of the angles. Going back
+    to the previous cell is not possible, but a path can go through a cell twice if
+    this avoids costly turns. If max_cost is given, the search stops as in
+    _dijkstra_array; the start can also be a list of cells, as in _dijkstra_array.
+    Returns the path, the accumulated costs along the path and the ending cell that
+    was reached, or three None if no ending cell can be reached."""
+    inf = math.inf
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    w = state.w
+    state.capped = False
+
+    targets = _search_targets(state, end_row_cols)
+    is_end = memoryview(targets.mask)
+    start_keys = _start_keys(state, start_row_col, is_end)
+    if not start_keys:
+        return None, None, None
+
+    dist_array, visited_array, back_array = state.turn_arrays()
+    dist = memoryview(dist_array)
+    visited = memoryview(visited_array)
+    back = memoryview(back_array)
+    offsets = tuple(d_row * w + d_col for d_row, d_col, diagonal in NEIGHBOURS_OFFSETS)
+    # For each move entering a cell (and for the start, whose moves are not
+    # punished), the possible moves leaving it, with their multipliers.
+    table = turn_multipliers(punisherAngleDictionnary) + ((1.0,) * 8,)
+    planes = [memoryview(weights) for weights in state.edge_weights()]
+    moves = tuple(tuple((direction, offsets[direction], planes[direction], multipliers[direction])
+                        for direction in range(8) if multipliers[direction] is not None)
+                  for multipliers in table)
+    touched = []
+
+    # The starts are the nodes -1, -2... of the frontier, as they have not been entered
+    # by a move.
+    frontier = [(0.0, -1 - index) for index in range(len(start_keys))]
+    heapq.heapify(frontier)
+    found_node = None
+    popped = 0
+    stale = 0
+    peak_frontier = 0
+
+    try:
+        while frontier:
+            current_cost, node = heappop(frontier)
+            if node < 0:
+                current_key = start_keys[-1 - node]
+                entering = NO_TURN_DIRECTION
+            else:
+                # If this node has already been expanded, this entry is stale.
+                if visited[node]:
+                    stale += 1
+                    continue
+                if max_cost is not None and current_cost > max_cost:
+                    state.capped = True
+                    return None, None, None
+                visited[node] = True
+                current_key = node >> 3
+                entering = node & 7
+
+                popped += 1
+                if popped % CANCEL_CHECK_INTERVAL == 0:
+                    if len(frontier) > peak_frontier:
+                        peak_frontier = len(frontier)
+                    if feedback is not None and feedback.isCanceled():
+                        return None, None, None
+
+                if is_end[current_key]:
+                    found_node = node
+                    break
+
+            for direction, d_key, weights, multiplier in moves[entering]:
+                cost = weights[current_key]
+                if cost == inf:
+                    continue
+                next_node = ((current_key + d_key) << 3) | direction
+                if visited[next_node]:
+                    continue
+                new_cost = current_cost + cost * multiplier
+                old_cost = dist[next_node]
+                if new_cost < old_cost:
+                    if old_cost == inf:
+                        touched.append(next_node)
+                    dist[next_node] = new_cost
+                    back[next_node] = entering
+                    heappush(frontier, (new_cost, next_node))
+
+        if found_node is None:
+            return None, None, None
+
+        end_node = divmod(found_node >> 3, w)
+        path = []
+        costs_of_path = []
+        node = found_node
+        while True:
+            key = node >> 3
+            path.append(divmod(key, w))
+            costs_of_path.append(dist[node])
+            previous_key = key - offsets[node & 7]
+            previous_entering = back[node]
+            if previous_entering == NO_TURN_DIRECTION:
+                break
+            node = (previous_key << 3) | previous_entering
+        path.append(divmod(previous_key, w))
+        costs_of_path.append(0.0)
+        path.reverse()
+        costs_of_path.reverse()
+        return path, costs_of_path, end_node
+    finally:
+        # Every entry of the frontier but the starts comes from a relaxed move (the
+        # starts are taken from it first).
+        state.counters = (popped, popped + stale + state.capped + len(frontier), stale,
+                          max(peak_frontier, len(frontier)))
+        # The arrays are put back in their initial state for the next search.
+        if touched:
+            touched = np.array(touched, dtype=np.int64)
+            dist_array[touched] = np.inf
+            visited_array[touched] = False
+
+
+def cost_distances(state, source_keys, feedback=None):
+    """Returns a copy of the distances from the closest source cell (given by their
+    flat indexes) to every cell of the SearchState, computed with a search that
+    does not stop before every reachable cell has been visited. The angles are not
+    considered. Unreachable cells are at an infinite distance."""
+    inf = math.inf
+    heappush = heapq.heappush
+    heappop = heapq.heappop
+    w = state.w
+    n = state.h * w
+    passable = memoryview(state.passable)
+    visited = np.zeros(n, dtype=np.bool_)
+    distances = np.full(n, np.inf, dtype=np.float64)
+    dist = memoryview(distances)
+    visited_view = memoryview(visited)
+    neighbours = tuple((d_row * w + d_col, memoryview(weights))
+                       for (d_row, d_col, diagonal), weights in zip(NEIGHBOURS_OFFSETS, state.edge_weights()))
+
+    frontier = []
+    for key in source_keys:
+        if passable[key]:
+            dist[key] = 0.0
+            frontier.append((0.0, key))
+    heapq.heapify(frontier)
+    popped = 0
+
+    while frontier:
+        current_cost, current_key = heappop(frontier)
+        if visited_view[current_key]:
+            continue
+        visited_view[current_key] = True
+        popped += 1
+        if feedback is not None and popped % CANCEL_CHECK_INTERVAL == 0 and feedback.isCanceled():
+            break
+        for d_key, weights in neighbours:
+            cost = weights[current_key]
+            next_key = current_key + d_key
+            if cost == inf or visited_view[next_key]:
+                continue
+            new_cost = current_cost + cost
+            if new_cost < dist[next_key]:
+                dist[next_key] = new_cost
+                heappush(frontier, (new_cost, next_key))
+
+    return distances
+
+
+def octile_distance_transform(sources):
+    """Returns the distance (in cells) from every cell of a 2D array to the closest
+    True cell of the boolean array "sources", when moving through the eight
+    neighbours of the cells (1 for horizontal/vertical moves, sqrt(2) for diagonal
+    ones). It is the chamfer distance transform, made with two passes on the rows;
+    the propagation inside a row is vectorized with a cumulative minimum.
+    Cells are at an infinite distance if there is no source."""
+    sqrt2 = sqrt(2)
+    distance = np.where(sources, 0.0, np.inf)
+    h, w = distance.shape
+    columns = np.arange(w, dtype=np.float64)
+
+    # First pass : from the first row to the last, and from left to right.
+    for i in range(h):
+        row = distance[i]
+        if i > 0:
+            previous = distance[i - 1]
+            np.minimum(row, previous + 1, out=row)
+            np.minimum(row[1:], previous[:-1] + sqrt2, out=row[1:])
+            np.minimum(row[:-1], previous[1:] + sqrt2, out=row[:-1])
+        # row[j] = min over k <= j of row[k] + (j - k)
+        np.minimum(row, np.minimum.accumulate(row - columns) + columns, out=row)
+
+    # Second pass : from the last row to the first, and from right to left.
+    for i in range(h - 1, -1, -1):
+        row = distance[i]
+        if i < h - 1:
+            following = distance[i + 1]
+            np.minimum(row, following + 1, out=row)
+            np.minimum(row[1:], following[:-1] + sqrt2, out=row[1:])
+            np.minimum(row[:-1], following[1:] + sqrt2, out=row[:-1])
+        # row[j] = min over k >= j of row[k] + (k - j)
+        np.minimum(row, np.minimum.accumulate((row + columns)[::-1])[::-1] - columns, out=row)
+
+    return distance
+
+
+class NetworkDistanceTransform:
+    """Lower bound of the cost to go from every cell of a SearchState to the closest
+    cell of the road network, used as the heuristic of the "astar" engine.
+
+    Moving from a cell to one of its neighbours costs at least the length of the
+    move (1 or sqrt(2) cells) times the smallest mean cost of two neighbouring
+    passable cells (which is the smallest positive cost of the raster when it has
+    no zero cost cells). The bound is thus the octile distance to the network
+    (which is never shorter than the euclidean distance) times this smallest cost.
+    It is slightly reduced to stay below the true cost despite rounding errors.
+
+    When roads are added to the network, add_cells updates the distance transform
+    only in a window around the new cells, that grows until the cells on its
+    border are not closer to the new cells than to the rest of the network."""
+
+    # Margin (in cells) around the new cells of the first window used by add_cells.
+    FIRST_MARGIN = 32
+
+    def __init__(self, state, network_row_cols):
+        self.h = state.h
+        self.w = state.w
+        # Smallest cost of a move of length 1 between two passable cells.
+        smallest_cost = state.move_costs()[0] or 0.0
+        self.scale = smallest_cost * (1 - 1e-9)
+
+        self.network = np.zeros((self.h, self.w), dtype=np.bool_)
+        for row, col in network_row_cols:
+            if 0 <= row < self.h and 0 <= col < self.w:
+                self.network[row, col] = True
+        if self.scale > 0:
+            self.bounds = octile_distance_transform(self.network) * self.scale
+        else:
+            self.bounds = np.zeros((self.h, self.w), dtype=np.float64)
+        # Flat view of the bounds, indexed like the arrays of the SearchState.
+        self.flat_bounds = self.bounds.ravel()
+
+    def add_cells(self, row_cols):
+        """Updates the bounds after new cells have been added to the network."""
+        new_cells = [(row, col) for row, col in row_cols
+                     if 0 <= row < self.h and 0 <= col < self.w and not self.network[row, col]]
+        if not new_cells:
+            return
+        rows = [row for row, col in new_cells]
+        cols = [col for row, col in new_cells]
+        self.network[rows, cols] = True
+        if self.scale == 0:
+            return
+
+        margin = self.FIRST_MARGIN
+        while True:
+            row_min = max(min(rows) - margin, 0)
+            row_max = min(max(rows) + margin + 1, self.h)
+            col_min = max(min(cols) - margin, 0)
+            col_max = min(max(cols) + margin + 1, self.w)
+            sources = np.zeros((row_max - row_min, col_max - col_min), dtype=np.bool_)
+            sources[np.array(rows) - row_min, np.array(cols) - col_min] = True
+            window_bounds = octile_distance_transform(sources) * self.scale
+            current_bounds = self.bounds[row_min:row_max, col_min:col_max]
+            improved = window_bounds < current_bounds
+
+            whole_raster = row_min == 0 and col_min == 0 and row_max == self.h and col_max == self.w
+            # If a cell on the border of the window (that is not on the border of
+            # the raster) is now closer to the network, cells outside of the window
+            # might be too : we try again with a bigger window.
+            border_improved = (row_min > 0 and improved[0, :].any()) \
+                or (row_max < self.h and improved[-1, :].any()) \
+                or (col_min > 0 and improved[:, 0].any()) \
+                or (col_max < self.w and improved[:, -1].any())
+            if whole_raster or not border_improved:
+                np.minimum(current_bounds, window_bounds, out=current_bounds)
+                return
+            margin *= 2
@@ -31,16 +31,27 @@ __date__ = 'Currently in work'
 __copyright__ = '(C) 2019 by Clement Hardy'
 
 # We load every function necessary from the QIS packages.
+import json
+import os
 import random
+import tempfile
 from .kdtree import KDTree
 import numpy as np
+# The k-d tree of SciPy is much faster, but SciPy is not installed with every QGIS; without it, the
+# k-d tree of kdtree.py is used.
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
 from PyQt5.QtCore import QCoreApplication, QVariant
 from PyQt5.QtGui import QIcon
 from qgis.core import (
+    Qgis,
     QgsFeature,
     QgsGeometry,
     QgsPoint,
     QgsPointXY,
+    QgsRectangle,
     QgsField,
     QgsFields,
     QgsWkbTypes,
@@ -54,13 +65,17 @@ from qgis.core import (
     QgsProcessingParameterField,
     QgsProcessingParameterBand,
     QgsProcessingParameterBoolean,
+    QgsProcessingParameterFileDestination,
     QgsProcessingParameterNumber,
     QgsProcessingParameterEnum
 )
 # We import the algorithm used for processing a road.
-from .dijkstra_algorithm import dijkstra
+from .dijkstra_algorithm import SearchState, SearchStatistics, CHUNK_CELLS
+from .pathfinding_engines import create_engine, engine_labels, engine_names
+from .skidding_algorithm import SkiddingDistance
+from .raster_mask import RasterMask
 # We import mathematical functions needed for the algorithm.
-from math import floor, sqrt
+from math import floor
 
 # The algorithm class heritates from the algorithm class of QGIS.
 # There, it can register different parameter during initialization
@@ -98,6 +113,8 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
 
     HEURISTIC_IN_POLYGONS = 'HEURISTIC_IN_POLYGONS'
 
+    SEARCH_FROM = 'SEARCH_FROM'
+
     ANGLES_CONSIDERED = 'ANGLES_CONSIDERED'
 
     PUNISHER_45DEGREES = 'PUNISHER_45DEGREES'
@@ -106,8 +123,41 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
 
     PUNISHER_135DEGREES = 'PUNISHER_135DEGREES'
 
+    PATHFINDING_ENGINE = 'PATHFINDING_ENGINE'
+
+    NUMBER_OF_LANDMARKS = 'NUMBER_OF_LANDMARKS'
+
+    SAVE_PREPROCESSING = 'SAVE_PREPROCESSING'
+
+    BUCKET_WIDTH = 'BUCKET_WIDTH'
+
+    COST_QUANTIZATION = 'COST_QUANTIZATION'
+
+    CLUSTER_SIZE = 'CLUSTER_SIZE'
+
+    CORRIDOR_BUFFER = 'CORRIDOR_BUFFER'
+
+    NUMBER_OF_PROCESSES = 'NUMBER_OF_PROCESSES'
+
+    MAXIMUM_SEARCH_COST = 'MAXIMUM_SEARCH_COST'
+
+    OUT_OF_CORE = 'OUT_OF_CORE'
+
+    SEARCH_STATISTICS = 'SEARCH_STATISTICS'
+
+    SEARCH_TRACE = 'SEARCH_TRACE'
+
     OUTPUT = 'OUTPUT'
 
+    # When a search reaches the maximum cost, it is done again with a maximum cost
+    # multiplied by this factor, this number of times at most.
+    SEARCH_COST_WIDENING_FACTOR = 2
+    SEARCH_COST_WIDENINGS = 3
+
+    # Engines that can be chosen with the PATHFINDING_ENGINE parameter, in the order of
+    # the options of the parameter (see pathfinding_engines.py).
+    PATHFINDING_ENGINES = engine_names()
+
     def initAlgorithm(self, config):
         """
         Here we define the inputs and output of the algorithm, along
@@ -175,6 +225,16 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.SEARCH_FROM,
+                self.tr('Search each road from'),
+                ['Each cell to reach', 'Each polygon (all its cells at once)',
+                 'Each group of polygons with the same order attribute (all their cells at once)'],
+                defaultValue=0
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterEnum(
                 self.ANGLES_CONSIDERED,
@@ -217,6 +277,129 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
             )
         )
 
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.PATHFINDING_ENGINE,
+                self.tr('Pathfinding algorithm'),
+                [self.tr(label) for label in engine_labels()],
+                defaultValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.NUMBER_OF_LANDMARKS,
+                self.tr('Number of landmarks (for the ALT algorithm)'),
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=8,
+                optional=True,
+                minValue=1
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.SAVE_PREPROCESSING,
+                self.tr('Save the preprocessing next to the cost raster to reuse it (for the ALT and hierarchical algorithms)'),
+                defaultValue=False,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.BUCKET_WIDTH,
+                self.tr('Width of the buckets (for the bucket queue and delta-stepping; 0 for the default width)'),
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=0,
+                optional=True,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.COST_QUANTIZATION,
+                self.tr('Step to which the costs of the moves are rounded (for the bucket queue; 0 to keep the exact costs)'),
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=0,
+                optional=True,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CLUSTER_SIZE,
+                self.tr('Size of the clusters in cells (for the hierarchical algorithm)'),
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=64,
+                optional=True,
+                minValue=4
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CORRIDOR_BUFFER,
+                self.tr('Width of the corridors around the coarse roads, in coarse cells (for the coarse-to-fine algorithm)'),
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=2,
+                optional=True,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.NUMBER_OF_PROCESSES,
+                self.tr('Number of processes (for delta-stepping; 0 for the number of processors)'),
+                type=QgsProcessingParameterNumber.Integer,
+                defaultValue=0,
+                optional=True,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.MAXIMUM_SEARCH_COST,
+                self.tr('Maximum cost of a road before its search is widened, then abandoned (0 for no maximum)'),
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=0,
+                optional=True,
+                minValue=0
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.OUT_OF_CORE,
+                self.tr('Keep the cost raster and the search on disk (for rasters bigger than the memory; uses Dijkstra)'),
+                defaultValue=False,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.SEARCH_STATISTICS,
+                self.tr('Add the statistics of the searches to the attributes of the roads'),
+                defaultValue=False,
+                optional=True
+            )
+        )
+
+        self.addParameter(
+            QgsProcessingParameterFileDestination(
+                self.SEARCH_TRACE,
+                self.tr('Trace of the searches (one JSON line per search)'),
+                fileFilter='JSON lines (*.jsonl)',
+                optional=True,
+                createByDefault=False
+            )
+        )
+
         self.addParameter(
             QgsProcessingParameterFeatureSink(
                 self.OUTPUT,
@@ -278,6 +461,12 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
         else:
             heuristic_in_polygons_index = None
 
+        search_from = self.parameterAsEnum(
+            parameters,
+            self.SEARCH_FROM,
+            context
+        )
+
         if self.parameterAsString(
             parameters,
             self.ANGLES_CONSIDERED,
@@ -307,6 +496,82 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
             context
         )
 
+        pathfinding_engine = self.PATHFINDING_ENGINES[self.parameterAsEnum(
+            parameters,
+            self.PATHFINDING_ENGINE,
+            context
+        )]
+
+        number_of_landmarks = self.parameterAsInt(
+            parameters,
+            self.NUMBER_OF_LANDMARKS,
+            context
+        )
+
+        save_preprocessing = self.parameterAsBool(
+            parameters,
+            self.SAVE_PREPROCESSING,
+            context
+        )
+
+        bucket_width = self.parameterAsDouble(
+            parameters,
+            self.BUCKET_WIDTH,
+            context
+        )
+
+        cost_quantization = self.parameterAsDouble(
+            parameters,
+            self.COST_QUANTIZATION,
+            context
+        )
+
+        cluster_size = self.parameterAsInt(
+            parameters,
+            self.CLUSTER_SIZE,
+            context
+        )
+
+        corridor_buffer = self.parameterAsInt(
+            parameters,
+            self.CORRIDOR_BUFFER,
+            context
+        )
+
+        number_of_processes = self.parameterAsInt(
+            parameters,
+            self.NUMBER_OF_PROCESSES,
+            context
+        )
+
+        maximum_search_cost = self.parameterAsDouble(
+            parameters,
+            self.MAXIMUM_SEARCH_COST,
+            context
+        )
+
+        out_of_core = self.parameterAsBool(
+            parameters,
+            self.OUT_OF_CORE,
+            context
+        )
+        search_statistics = self.parameterAsBool(
+            parameters,
+            self.SEARCH_STATISTICS,
+            context
+        )
+
+        search_trace = self.parameterAsFileOutput(
+            parameters,
+            self.SEARCH_TRACE,
+            context
+        )
+
+        # The other algorithms make arrays of the size of the raster in memory.
+        if out_of_core and pathfinding_engine != 'array':
+            feedback.pushInfo(self.tr("The search is kept on disk : the pathfinding algorithm is Dijkstra."))
+            pathfinding_engine = 'array'
+
         # If source was not found, throw an exception to indicate that the algorithm
         # encountered a fatal error. The exception text can be any string, but in this
         # case we use the pre-built invalidSourceError method to return a standard
@@ -336,7 +601,7 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
         # We initialize the "sink", an object that will make use able to create an output.
         # First, we create the fields for the attributes of our lines as outputs.
         # They will only have one field :
-        sink_fields = MinCostPathHelper.create_fields()
+        sink_fields = MinCostPathHelper.create_fields(search_statistics)
         # We indicate that our output will be a line, stored in WBK format.
         output_geometry_type = QgsWkbTypes.LineString
         # Finally, we create the field object and register the destination ID of it.
@@ -360,20 +625,36 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
 
         # We check if the raster has been read correctly
         feedback.pushInfo(self.tr("The extent of the raster is : " + cost_raster.dataProvider().extent().asWktCoordinates()))
-        # We put the data of the raster into a variable that we will send to the algorithm.
-        block = MinCostPathHelper.get_all_block(cost_raster, cost_raster_band)
-        # We transform the raster data into a matrix and check if the matrix contains negative values
-        # CAREFUL : The matrix is created in a raster coordinate systems; rows (y axis) start at the top
-        # and go to the bottom. This implies a transformation when getting back the values from a cartesian
-        # system (rows go from bottom to top)
-        matrix, contains_negative = MinCostPathHelper.block2matrix(block)
+        if out_of_core:
+            # The raster is written by parts into a file of a temporary folder, which is read by the
+            # search through the system (memory mapping) : it never has to be entirely in memory.
+            # The arrays of the search are files of the same folder. The folder is deleted with the object
+            # that made it, when the algorithm ends, even if it stops with an error before the search.
+            temporaryDirectory = tempfile.TemporaryDirectory(prefix='forest_roads_')
+            directory = temporaryDirectory.name
+            feedback.pushInfo(self.tr("Writing the cost raster on disk in " + directory + "..."))
+            costFile, height, width, contains_negative = MinCostPathHelper.raster_to_cost_file(cost_raster,
+                                                                                              cost_raster_band,
+                                                                                              os.path.join(directory,
+                                                                                                           'costs.f32'),
+                                                                                              feedback)
+            matrix = None
+        else:
+            # We put the data of the raster into a variable that we will send to the algorithm.
+            block = MinCostPathHelper.get_all_block(cost_raster, cost_raster_band)
+            # We transform the raster data into a matrix and check if the matrix contains negative values
+            # CAREFUL : The matrix is created in a raster coordinate systems; rows (y axis) start at the top
+            # and go to the bottom. This implies a transformation when getting back the values from a cartesian
+            # system (rows go from bottom to top)
+            matrix, contains_negative = MinCostPathHelper.block2matrix(block)
+            height, width = block.height(), block.width()
         # We display a feedback on the loading of the raster, or we display an error if needed
-        if block.height() == 0 or block.width() == 0:
+        if height == 0 or width == 0:
             raise QgsProcessingException(self.tr("ERROR: The raster couldn't be read properly (0 rows or 0 columns). "
                                                  "This is often due to the raster being too big. "
                                                  "Try to lower the resolution of your raster, and/or limit it to the"
-                                                 "extent of your data."))
-        feedback.pushInfo(self.tr("The size of the cost raster is: %d * %d pixels") % (block.height(), block.width()))
+                                                 "extent of your data, or keep the search on disk."))
+        feedback.pushInfo(self.tr("The size of the cost raster is: %d * %d pixels") % (height, width))
 
         # If there are negative values in the raster, we make an issue.
         if contains_negative:
@@ -385,9 +666,8 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
         polygons_to_reach_features = list(polygons_to_connect.getFeatures())
         # feedback.pushInfo(str(len(start_features)))
         # We make a set of nodes to reach.
-        set_of_nodes_to_reach, heuristicDictionnary = MinCostPathHelper.features_to_row_cols(polygons_to_reach_features,
-                                                                                            heuristic_in_polygons_index,
-                                                                                            cost_raster)
+        set_of_nodes_to_reach, heuristicDictionnary, polygonDictionnary = \
+            MinCostPathHelper.features_to_row_cols(polygons_to_reach_features, heuristic_in_polygons_index, cost_raster)
         # If there are no nodes to reach (e.g. all polygons are out of the raster)
         if len(set_of_nodes_to_reach) == 0:
             raise QgsProcessingException(self.tr("ERROR: There is no polygon to reach in this raster. Check if some"
@@ -398,9 +678,8 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
         # We do another set concerning the nodes that contains roads to connect to
         roads_to_connect_to_features = list(current_roads.getFeatures())
         # feedback.pushInfo(str(len(end_features)))
-        set_of_nodes_to_connect_to, uselessHeuristicDictionary = MinCostPathHelper.features_to_row_cols(roads_to_connect_to_features,
-                                                                                                        None,
-                                                                                                        cost_raster)
+        set_of_nodes_to_connect_to, uselessHeuristicDictionary, uselessPolygonDictionary = \
+            MinCostPathHelper.features_to_row_cols(roads_to_connect_to_features, None, cost_raster)
         # If there is no nodes to connect to, throw an exception
         if len(set_of_nodes_to_connect_to) == 0:
             raise QgsProcessingException(self.tr("ERROR: There is no road to connect to in this raster. Check if some"
@@ -411,9 +690,27 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
                                                  "to connect to given this resolution."))
         feedback.pushInfo("Roads scanned !")
 
+        # This is the road matrix. It's use to quickly know if there are roads at two given coordinates.
+        # It only holds one bit per cell.
+        roadMatrix = RasterMask(cost_raster.height(), cost_raster.width(), True,
+                                directory if out_of_core else None, 'roads')
+        # A set bit means that there is a road at the given coordinate.
+        roadMatrix.set_cells(list(set_of_nodes_to_connect_to))
+
+        # Now, we have to initialize the distances to the roads, to know which cells are at skidding
+        # distance of a road. They are then updated around every new road.
+        skiddingDistance = SkiddingDistance(roadMatrix, skidding_distance, cost_raster.rasterUnitsPerPixelX(),
+                                            cost_raster.rasterUnitsPerPixelY(), directory if out_of_core else None)
+        feedback.pushInfo(self.tr("Size of the skidding neighborhood : " + str(skiddingDistance.neighborhood_size())))
+
+        # The cells that are already at skidding distance of the roads, or on them, do not need a road :
+        # they are all removed at once.
+        list_of_nodes_to_reach = skiddingDistance.uncovered(list(set_of_nodes_to_reach), roadMatrix)
+        feedback.pushInfo(self.tr("Cells already at skidding distance of a road : "
+                                  + str(len(set_of_nodes_to_reach) - len(list_of_nodes_to_reach))))
+
         # Before we start, we need to order the nodes with the chosen heuristic.
-        # We create a list that we are going to order.
-        list_of_nodes_to_reach = list(set_of_nodes_to_reach)
+        # The list of the nodes left to reach is the one that we are going to order.
 
         # If the method of generation asks for a random order, we shuffle the list randomly and it's over.
         if method_of_generation == '0':
@@ -422,66 +719,56 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
         # If not, we create a list that will contain the minimal distance between the given node and the nodes to
         # connect to.
         else:
-            list_of_nodes_to_reach_with_order = list()
-
-            feedback.pushInfo("Computing distances between polygons and roads...(This can take some time !)")
-            feedbackProgress = 0
+            # Without SciPy, the k-d tree of kdtree.py is still queried point by point.
+            if cKDTree is None:
+                feedback.pushInfo("Computing distances between polygons and roads...(This can take some time !)")
+            else:
+                feedback.pushInfo("Computing distances between polygons and roads...")
 
             # To quickly calculate the distance from the existing roads to each node in our polygons, we will use
-            # the k-d tree function from Scipy.
-            # For that, we need to make an Numpy array containing our road nodes
-            pointsToReach = list()
-            for node in set_of_nodes_to_connect_to:
-                nodeToPoint = MinCostPathHelper._row_col_to_point(node, cost_raster)
-                pointsToReach.append(nodeToPoint)
-            numpyArrayOfRoadPoints = np.array(pointsToReach)
-            spatialKDTREEForDistanceSearch = KDTree(numpyArrayOfRoadPoints, leafsize=20)
-
-            # Then, we search and find the distance from current roads for each point.
-            for node in list_of_nodes_to_reach:
-                # feedback.pushInfo("For node " + str(node) + "...")
-
-                # Obsolete with the use of the k-d tree.
-                # minimalDistance = MinCostPathHelper.minimum_distance_to_a_node(node,
-                                                                               # set_of_nodes_to_connect_to,
-                                                                               # cost_raster)
-                # feedback.pushInfo("Brute force gives minimal distance : " + str(minimalDistance))
-
-                # We now make a query to the tree to find the closest node of the tree to the given node.
-                nodeAsPoint = MinCostPathHelper._row_col_to_point(node, cost_raster)
-                minimalDistance = spatialKDTREEForDistanceSearch.query(nodeAsPoint)[0]
-                # feedback.pushInfo("K-D Tree gives minimal distance : " + str(minimalDistance))
-
-                # We add the distance to a tuple, so that we can classify the node afterward.
-                list_of_nodes_to_reach_with_order.append((minimalDistance, node))
-                feedbackProgress += 1
-                feedback.setProgress(100 * (feedbackProgress / len(list_of_nodes_to_reach)))
-                if feedback.isCanceled():
-                    raise QgsProcessingException(self.tr("ERROR: Operation was cancelled."))
+            # a k-d tree of the centres of the road cells, queried once with the centres of all the nodes.
+            # Obsolete with the use of the k-d tree : MinCostPathHelper.minimum_distance_to_a_node.
+            roadPoints = MinCostPathHelper.row_cols_to_coordinates(list(set_of_nodes_to_connect_to), cost_raster)
+            nodePoints = MinCostPathHelper.row_cols_to_coordinates(list_of_nodes_to_reach, cost_raster)
+            minimalDistances = MinCostPathHelper.distances_to_closest_points(nodePoints, roadPoints, feedback)
+            if feedback.isCanceled():
+                raise QgsProcessingException(self.tr("ERROR: Operation was cancelled."))
 
             feedback.pushInfo("Computing distances is done !")
 
-            # We then sort according to this distance, in increasing or decreasing order.
+            # We then sort according to the heuristic inside the polygons, AND this distance, in increasing or
+            # decreasing order. The values of the heuristic are replaced by their rank, so that all the nodes are
+            # sorted at once.
+            heuristicValues = sorted(set(heuristicDictionnary[node] for node in list_of_nodes_to_reach))
+            heuristicRanks = {value: rank for rank, value in enumerate(heuristicValues)}
+            heuristics = np.array([heuristicRanks[heuristicDictionnary[node]] for node in list_of_nodes_to_reach],
+                                  dtype=np.int64)
             if method_of_generation == '1':
-                # We sort the list by the heuristic inside the polygons, AND the main heuristic.
-                list_of_nodes_to_reach_with_order = sorted(list_of_nodes_to_reach_with_order,
-                                                           key=lambda tuple: (heuristicDictionnary[tuple[1]],
-                                                                              tuple[0]))
-                # list_of_nodes_to_reach_with_order.sort()
+                order = np.lexsort((minimalDistances, heuristics))
                 feedback.pushInfo("Ordering towards closest cells to visit...")
             else:
                 feedback.pushInfo("Ordering towards farthest cells to visit...")
                 # Here, we take the opposite of the distance so that it respects the "smallest first" sorting, but
                 # in the opposite way to select the farthest first.
-                list_of_nodes_to_reach_with_order = sorted(list_of_nodes_to_reach_with_order,
-                                                           key=lambda tuple: (heuristicDictionnary[tuple[1]],
-                                                                              -tuple[0]))
-                # list_of_nodes_to_reach_with_order.sort(reverse=True)
+                order = np.lexsort((-minimalDistances, heuristics))
 
             feedback.pushInfo("Ordering is done !")
 
-            # We put the result in the list of nodes to reach back again, removing the distance.
-            list_of_nodes_to_reach = [i[1] for i in list_of_nodes_to_reach_with_order]
+            # We put the result in the list of nodes to reach back again.
+            list_of_nodes_to_reach = [list_of_nodes_to_reach[index] for index in order]
+
+        # The roads are searched from each cell to reach, or from all the cells of a polygon (or of a group
+        # of polygons with the same heuristic) at once : the search then starts from all of them and gives the
+        # cheapest road from the polygon to the roads. The groups are taken in the order of their first cell.
+        groups_of_nodes_to_reach = dict()
+        for node in list_of_nodes_to_reach:
+            if search_from == 1:
+                groupOfNode = polygonDictionnary[node]
+            elif search_from == 2:
+                groupOfNode = heuristicDictionnary[node]
+            else:
+                groupOfNode = node
+            groups_of_nodes_to_reach.setdefault(groupOfNode, []).append(node)
 
         # Now, time to launch the algorithm properly !
         feedback.pushInfo(self.tr("Generating the road network...(This can take some time !)"))
@@ -489,86 +776,144 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
         # First, we have to initialize some things.
         feedbackProgress = 0
         errorMessages = 0
+        # Number of searches that reached the maximum cost and were widened, and of
+        # searches that were abandoned because they reached it after every widening.
+        cappedSearches = 0
+        abandonedSearches = 0
+        # The searches are counted if their statistics are saved with the roads or in the trace.
+        if search_statistics or search_trace:
+            statistics = SearchStatistics()
+        else:
+            statistics = None
         listOfResults = list()
-        pointsToReach = set()
-        for node in set_of_nodes_to_connect_to:
-            nodeToPoint = MinCostPathHelper._row_col_to_point(node, cost_raster)
-            pointsToReach.add(nodeToPoint)
 
-        # This is the road matrix. It's use to quickly know if there are roads at two given coordinates.
-        roadMatrix = np.zeros( (cost_raster.height(), cost_raster.width()) )
-        # A "1" means that there is a road at the given coordinate.
-        for node in set_of_nodes_to_connect_to:
-            roadMatrix[node[0]][node[1]] = 1
-
-        # Now, we have to initialize the circle neighborhood.
-        skiddingDistanceCircleNeighborhood = MinCostPathHelper.createRelativeCircleNeighborhood(skidding_distance,
-                                                                                                cost_raster)
-        feedback.pushInfo(self.tr("Size of the skidding neighborhood : " + str(len(skiddingDistanceCircleNeighborhood))))
-
-        for nodeToReach in list_of_nodes_to_reach:
-            feedbackProgress += 1
-
-            # If the node to reach is inside a no-value pixel, no need to look at it.
-            if matrix[(len(matrix)-1)-nodeToReach[0]][nodeToReach[1]] is not None:
-                # First, we check the distance between the node and the nodes to connect to,
-                # to see if it's not at a skidding distance of it.
-
-                # Obsolete with the k-d tree.
-                # minimalDistanceToNodesToConnect = MinCostPathHelper.minimum_distance_to_a_node(nodeToReach,
-                                                                                               # set_of_nodes_to_connect_to,
-                                                                                               # cost_raster)
-
-                # To quickly calculate the distance from the existing roads to each node in our polygons, we will use
-                # the k-d tree function from SciPy.
-                # Now obsolete with the circle neighborhood method.
-                # For that, we need to make an Numpy array containing our road nodes
-                # spatialKDTREEForDistanceSearch = KDTree(np.array(list(pointsToReach)), leafsize=20)
-                # nodeAsPoint = MinCostPathHelper._row_col_to_point(nodeToReach, cost_raster)
-                # minimalDistanceToNodesToConnect = spatialKDTREEForDistanceSearch.query(nodeAsPoint)[0]
-
-                # If it's superior, we create a road to this node
-                # if minimalDistanceToNodesToConnect > skidding_distance:
-
-                # New method : using a relative neighborhood.
-                foundRoadInSkiddingDistance = MinCostPathHelper.checkRelativeCircleNeighborhoodForRoads(skiddingDistanceCircleNeighborhood,
-                                                                                                        nodeToReach,
-                                                                                                        roadMatrix)
-
-                if not foundRoadInSkiddingDistance :
-                    start_row_col = nodeToReach
-                    end_row_cols = list(set_of_nodes_to_connect_to)
-                    min_cost_path, costs, selected_end = dijkstra(start_row_col, end_row_cols, matrix,
-                                                                  angles_considered, punisherAngleDictionnary, feedback)
-                    # If there was a problem, we indicate if it's because the search was cancelled by the user
-                    # or if there was no end point that could be reached.
+        # The arrays used by the pathfinding are allocated once, and reused for every road.
+        if out_of_core:
+            searchState = SearchState.on_disk(costFile, height, width, directory)
+        else:
+            searchState = SearchState(matrix)
+        # The engine prepares what its searches need once (e.g. the landmarks of the ALT algorithm,
+        # computed or loaded if they have been saved before with the same cost raster).
+        engine = create_engine(pathfinding_engine, searchState, set_of_nodes_to_connect_to,
+                               {"number_of_landmarks": number_of_landmarks,
+                                "save_preprocessing": save_preprocessing,
+                                "raster_path": cost_raster.source(),
+                                "bucket_width": bucket_width,
+                                "cost_quantization": cost_quantization,
+                                "cluster_size": cluster_size,
+                                "corridor_buffer": corridor_buffer,
+                                "number_of_processes": number_of_processes})
+        engine.precompute(feedback)
+        if feedback.isCanceled():
+            engine.close()
+            raise QgsProcessingException(self.tr("ERROR: Operation was cancelled."))
+
+        # The trace is written while the roads are searched; the engine and the trace are closed when the
+        # loop ends, even if it stops with an error.
+        traceFile = open(search_trace, 'w') if search_trace else None
+        try:
+            for nodesToReach in groups_of_nodes_to_reach.values():
+                feedbackProgress += len(nodesToReach)
+
+                # If a node to reach is inside a no-value pixel, no need to look at it.
+                if matrix is not None:
+                    nodesToReach = [nodeToReach for nodeToReach in nodesToReach
+                                    if matrix[(len(matrix)-1)-nodeToReach[0]][nodeToReach[1]] is not None]
+                else:
+                    nodesToReach = [nodeToReach for nodeToReach in nodesToReach
+                                    if searchState.index(nodeToReach) is not None
+                                    and not np.isnan(searchState.costs[searchState.index(nodeToReach)])]
+
+                # A road is searched until every node of the group is at a skidding distance of a road.
+                while nodesToReach:
+                    # First, we check the distance between the nodes and the nodes to connect to,
+                    # to see if they're not at a skidding distance of them.
+
+                    # Obsolete with the k-d tree.
+                    # minimalDistanceToNodesToConnect = MinCostPathHelper.minimum_distance_to_a_node(nodeToReach,
+                                                                                                   # set_of_nodes_to_connect_to,
+                                                                                                   # cost_raster)
+
+                    # To quickly calculate the distance from the existing roads to each node in our polygons, we will
+                    # use the k-d tree function from SciPy.
+                    # Now obsolete with the circle neighborhood method.
+                    # For that, we need to make an Numpy array containing our road nodes
+                    # spatialKDTREEForDistanceSearch = KDTree(np.array(list(pointsToReach)), leafsize=20)
+                    # nodeAsPoint = MinCostPathHelper._row_col_to_point(nodeToReach, cost_raster)
+                    # minimalDistanceToNodesToConnect = spatialKDTREEForDistanceSearch.query(nodeAsPoint)[0]
+
+                    # If it's superior, we create a road to this node
+                    # if minimalDistanceToNodesToConnect > skidding_distance:
+
+                    # New method : using a relative neighborhood.
+                    # Now replaced by the distances to the roads, which give the same result with a single look-up
+                    # for all the nodes of the group. The nodes that are now on a road are also removed.
+                    nodesToReach = skiddingDistance.uncovered(nodesToReach, roadMatrix)
+                    if not nodesToReach:
+                        break
+
+                    # If the search reaches the maximum cost without finding a road (e.g. because the nodes are
+                    # surrounded by No Data pixels), it is done again with a higher maximum cost, a few times.
+                    max_cost = maximum_search_cost or None
+                    widenings = 0
+                    while True:
+                        # A search from all the nodes of the group gives the cheapest road from any of them.
+                        min_cost_path, costs, selected_end = engine.query(nodesToReach, engine.targets,
+                                                                          angles_considered, punisherAngleDictionnary,
+                                                                          feedback, max_cost=max_cost,
+                                                                          statistics=statistics)
+                        if traceFile is not None:
+                            trace = {"search": statistics.searches, "cells": len(nodesToReach),
+                                     "start": list(nodesToReach[0]), "max_cost": max_cost,
+                                     "cost": costs[-1] if min_cost_path is not None else None}
+                            trace.update(statistics.last)
+                            traceFile.write(json.dumps(trace) + "\n")
+                        if min_cost_path is not None or not searchState.capped \
+                                or widenings == self.SEARCH_COST_WIDENINGS:
+                            break
+                        if widenings == 0:
+                            cappedSearches += 1
+                        widenings += 1
+                        max_cost *= self.SEARCH_COST_WIDENING_FACTOR
+
+                    # If there was a problem, we indicate if it's because the search was cancelled by the user,
+                    # if it reached the maximum cost, or if there was no end point that could be reached.
                     if min_cost_path is None:
+                        if statistics is not None:
+                            statistics.take_current()
                         if feedback.isCanceled():
                             raise QgsProcessingException(self.tr("ERROR: Search canceled."))
+                        elif searchState.capped:
+                            abandonedSearches += 1
                         else:
                             errorMessages += 1
+                        break
 
                     # If there wasn't a problem, we save the results
-                    else:
-                        # When the road is done by the Dijkstra algorithm, we put the path and the cost
-                        # in the list of results
-                        listOfResults.append((min_cost_path, costs[-1]))
-                        # We also add the nodes of the created path to the set of nodes that can be reached now
-                        set_of_nodes_to_connect_to.update(min_cost_path)
-                        for node in min_cost_path:
-                            nodeToPoint = MinCostPathHelper._row_col_to_point(node, cost_raster)
-                            pointsToReach.add(nodeToPoint)
-                            roadMatrix[node[0]][node[1]] = 1
-
-            feedback.setProgress(100 * (feedbackProgress / len(list_of_nodes_to_reach)))
-
-        # When the loop is done..
+                    # When the road is done by the Dijkstra algorithm, we put the path and the cost
+                    # in the list of results
+                    listOfResults.append((min_cost_path, costs[-1],
+                                          statistics.take_current() if search_statistics else None))
+                    # We also add the nodes of the created path to the set of nodes that can be reached now
+                    set_of_nodes_to_connect_to.update(min_cost_path)
+                    roadMatrix.set_cells(min_cost_path)
+                    skiddingDistance.add_cells(min_cost_path)
+                    engine.commit(min_cost_path)
+
+                feedback.setProgress(100 * (feedbackProgress / len(list_of_nodes_to_reach)))
+        finally:
+            engine.close()
+            if traceFile is not None:
+                traceFile.close()
+
+        # The files on disk are not needed anymore (the temporary folder is deleted when the algorithm ends).
+        searchState = roadMatrix = costFile = skiddingDistance = None
         feedback.setProgress(100)
         feedback.pushInfo(self.tr("Network created ! Saving network..."))
 
         # For every path we create, we save it as a line and put it into the sink !
         ID = 1
-        for (path, cost) in listOfResults:
+        for (path, cost, roadStatistics) in listOfResults:
             # feedback.pushInfo("Cost of feature saved : " + str(cost))
             # Time to save the path as a vector.
             # We take the starting and ending points as pointXY
@@ -578,12 +923,26 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
             path_points = MinCostPathHelper.create_points_from_path(cost_raster, path, start_point, end_point)
             # With the total cost which is the last item in our accumulated cost list,
             # we create the PolyLine that will be returned as a vector.
-            path_feature = MinCostPathHelper.create_path_feature_from_points(path_points, cost, ID, sink_fields)
+            path_feature = MinCostPathHelper.create_path_feature_from_points(path_points, cost, ID, sink_fields,
+                                                                            roadStatistics)
             # Into the sink that serves as our output, we put the PolyLines from the list of lines we created
             # one by one
             sink.addFeature(path_feature, QgsFeatureSink.FastInsert)
             ID += 1
 
+        # We display the statistics of the searches
+        if statistics is not None:
+            feedback.pushInfo("Statistics of the " + str(statistics.searches) + " searches : "
+                              + ", ".join(name + " " + (str(round(value, 3)) if value is not None else "not counted")
+                                          for name, value in statistics.totals.items()))
+
+        # We display how many searches reached the maximum cost
+        if cappedSearches > 0:
+            feedback.pushInfo("During the pathfinding, " + str(cappedSearches) + " searches reached the maximum cost"
+                              " of a road and were widened; " + str(abandonedSearches) + " of them were abandoned, as"
+                              " no road was found under " + str(maximum_search_cost * self.SEARCH_COST_WIDENING_FACTOR
+                                                                ** self.SEARCH_COST_WIDENINGS) + ".")
+
         # We display the error messages if there was some
         if errorMessages > 0:
             feedback.pushInfo("WARNING : During the pathfinding, there was " + str(errorMessages) + " cases were a road could not"
@@ -660,12 +1019,22 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
           
           - Skidding distance. Maximum distance that a cell can be to not need a road going up to it.
           
-          - Method of generation : a parameter indicating what type of heuristic is used to generate the network. Random cell order, farther cells from current roads first, closer cells from curent roads first.
+          - Method of generation : a parameter indicating what type of heuristic is used to generate the network. Random cell order, farther cells from current roads first, closer cells from curent roads first. To sort the cells by distance, the distance from each cell to reach to the closest road is computed first : SciPy does this much faster, but it is not installed with every QGIS, and without it this takes about 5 to 10 seconds per 100 000 cells to reach (1 to 2 minutes per million). On big rasters, install SciPy (e.g. with pip in the OSGeo4W shell) or use the random cell order.
           
           - Attribute containing an heuristic : An attribute field of the polygons that contains an heuristic that describe in which order the algorithm should reach them. The lower the value, the higher the priority; this way, the heuristic can be a date or a time. It is combined with the heuristic chosen before by the user to determine the order in which pixels are accessed a single polygon.
          
+          - Search each road from : By default, a road is searched from each cell to reach that is not at skidding distance of a road yet. The roads can also be searched from all the cells of a polygon (or of all the polygons with the same value of the attribute containing an heuristic) at once : a single search then gives the cheapest road between the polygon and the current roads, which is much faster when the polygons are big, and which is repeated until all the cells of the polygon are at skidding distance of a road. The polygons are taken in the order of their first cell in the order given by the method of generation. These searches use the chosen pathfinding algorithm, except the bidirectional Dijkstra, the hierarchical algorithm, the coarse-to-fine corridors, Dijkstra with jumps and the parallel delta-stepping, which cannot start from several cells : Dijkstra is then used (with a warning), except when a single cell is left.
+         
+          - Statistics of the searches : The number of cells expanded by the searches of each road, of moves that made a cell closer to the start, of outdated cells taken from the queue, the largest size of the queue and the time of the searches can be added to the attributes of the roads, and written in a trace with one JSON line per search. Their totals are shown at the end. Only Dijkstra, A*, ALT, the bucket queue, the coarse-to-fine corridors and the exact punishment of the angles count the cells; the other algorithms only give the time, and their counts are left empty.
+         
+          - Keep the cost raster and the search on disk : The cost raster is written by parts into a temporary file, and the arrays of the search are also temporary files, which the system reads when the search goes through them; the raster never has to be entirely in memory, so it can be bigger than the memory. It needs about 50 bytes of free disk space per pixel, and uses Dijkstra whatever the pathfinding algorithm. The temporary files are deleted at the end.
+         
+          - Maximum cost of a road : When a cell cannot be reached from the roads (e.g. because it is surrounded by No Data pixels), the search of its road explores the whole raster before giving up. With a maximum cost, the search stops when every road left to explore would cost more; it is then done again with a maximum cost 2, 4 and 8 times higher, and abandoned if there is still no road. The number of widened and abandoned searches is reported at the end. It is only used by Dijkstra, A*, ALT, the bucket queue and the exact punishment of the angles (and by all algorithms when they are replaced by Dijkstra).
+         
           - Punishment of angles : The algorithm can "punish" the use of steep angle between a pixel and another by increasing the cost when it is used to allow for smoother lines. Remember that this does not affect the angle of connection between the roads, but only the zigzags in each road.
          
+          - Pathfinding algorithm : Dijkstra explores the cost raster in every direction around the cell to reach until it finds a road. A* finds roads of the same cost, but explores the raster towards the closest roads first, which is much faster when the roads are far away. ALT is A* with better estimates of the costs to reach the roads, given by the costs from a few "landmark" cells to every cell; computing them takes a few full explorations of the raster, but they can be saved next to the cost raster to be reused by the next runs with the same raster. Bidirectional Dijkstra explores the raster from the cell to reach and from the roads at the same time, which roughly halves the explored area when the roads are few and far away; it is replaced by Dijkstra when the angles are considered. Dijkstra with a bucket queue sorts the cells to explore by ranges of costs of a given width instead of sorting them exactly; whatever the width, the roads cost the same as with Dijkstra (the default width is the smallest cost to go from a cell to its neighbour). The costs of the moves can also be rounded to multiples of a given value, so that the cells of a range are never explored twice; a road can then cost more than the best one by up to half this value per cell of the two roads. It is also replaced by Dijkstra when the angles are considered. The hierarchical algorithm (HPA*) cuts the raster into square clusters, and first searches the road in a small graph of the costs to cross the clusters; the road is then drawn inside the clusters that this search went through, and their neighbours. The roads are close to the best ones (within a few percents), and the time of a search grows much slower with the size of the raster, but computing the graph takes about one exploration of every cluster per crossing of its borders; it can be saved next to the cost raster, and only the clusters whose costs have changed are then computed again. It is replaced by Dijkstra when the angles are considered. The coarse-to-fine corridors algorithm aggregates the cost raster 2, 4 and 8 times, searches the road in the coarsest raster first, and then in each finer raster but only inside a corridor around the road found in the coarser one; the time of a search then depends on the size of the corridors rather than on the size of the raster, which makes very fine rasters (e.g. made from LiDAR data) usable. The roads follow the coarse roads, so they can cost more than the best ones, and there is no bound to this difference : on rasters of random costs (with corridors of 2 cells), a third to a half of the roads cost more than the best ones, by about 3 % in the median, but up to 35 %. Wider corridors make this less likely, but the searches slower. Dijkstra with jumps over uniform costs gives the same roads as Dijkstra, but goes through the regions where all cells have the same cost (e.g. where only the basic distance cost counts) in straight or diagonal lines without exploring every cell; it is faster when such regions are large, and is replaced by Dijkstra when the angles are considered. Parallel delta-stepping gives roads of the same cost as Dijkstra, but explores all the cells within a range of costs (the width of the buckets) at once, and shares this work between several processes when there are many cells; it is faster on big rasters, and is replaced by Dijkstra when the angles are considered. Cost-distance sweeps compute the costs from the roads to every cell of the raster at once with fast array operations, and then draw the road from each cell to reach by following these costs back; after each new road, the costs are only updated around it. The first computation takes longer on very irregular cost rasters, but the next roads are then found almost at once, which is much faster when there are many cells to reach. They give roads of the same cost as Dijkstra, and are replaced by Dijkstra when the angles are considered. When the angles are considered, the other algorithms only keep the cheapest way to reach each cell, even if another way would need a less punished angle to go on, so their roads are not always the cheapest ones. Dijkstra with exact punishment of the angles keeps the cheapest way to reach each cell from each of the 8 directions, and gives the cheapest roads with the punishment of the angles; it explores more, so it is a few times slower. It is the same as Dijkstra when the angles are not considered.
+         
         """)
 
     def shortDescription(self):
@@ -681,6 +1050,10 @@ class ForestRoadNetworkAlgorithm(QgsProcessingAlgorithm):
 # Methods to help the algorithm; all static, do not need to initialize an object of this class.
 class MinCostPathHelper:
 
+    # Names of the statistics of the searches (see SearchStatistics) and of their fields in the output.
+    STATISTICS_FIELDS = (("expanded", "Expanded nodes"), ("relaxed", "Relaxed moves"), ("stale", "Stale pops"),
+                         ("peak_frontier", "Peak frontier"), ("time", "Search time (s)"))
+
     # Function to transform a given row/column into a QGIS point with a x,y
     # coordinates based on the resolution of the raster layer we're considering
     # (calculated with its extent and number of cells)
@@ -823,7 +1196,7 @@ class MinCostPathHelper:
         return path_points
 
     @staticmethod
-    def create_fields():
+    def create_fields(search_statistics=False):
         # Create an ID field to know in which order the roads have been constructed
         id_field = QgsField("Construction order", QVariant.Int, "integer", 10, 3)
         # Create the field of "total cost" by indicating name, type, typeName,
@@ -834,12 +1207,19 @@ class MinCostPathHelper:
         # We add the fields to the container
         fields.append(id_field)
         fields.append(cost_field)
+        # If asked, we add the statistics of the searches of each road.
+        if search_statistics:
+            for name, label in MinCostPathHelper.STATISTICS_FIELDS:
+                if name == "time":
+                    fields.append(QgsField(label, QVariant.Double, "double", 15, 6))
+                else:
+                    fields.append(QgsField(label, QVariant.LongLong, "integer64", 20))
         # We return the container with our fields.
         return fields
 
     # Function to create a polyline with the list of qgs.pointXY
     @staticmethod
-    def create_path_feature_from_points(path_points, total_cost, ID, fields):
+    def create_path_feature_from_points(path_points, total_cost, ID, fields, search_statistics=None):
         # We create the geometry of the polyline
         polyline = QgsGeometry.fromPolylineXY(path_points)
         # We retrieve the fields and add them to the feature
@@ -848,6 +1228,9 @@ class MinCostPathHelper:
         feature.setAttribute(cost_index, total_cost)  # cost
         id_index = feature.fieldNameIndex("Construction order")
         feature.setAttribute(id_index, ID) # id
+        if search_statistics is not None:
+            for name, label in MinCostPathHelper.STATISTICS_FIELDS:
+                feature.setAttribute(feature.fieldNameIndex(label), search_statistics[name])
         # We add the geometry to the feature
         feature.setGeometry(polyline)
         return feature
@@ -856,12 +1239,14 @@ class MinCostPathHelper:
     # nodes (row + column) on the raster.
     # Features have to be lines or polygons.
     # Also return a dictionary containing the heuristic read in the polygon or line
-    # for use in ordering the nodes to reach.
+    # for use in ordering the nodes to reach, and a dictionary containing the ID of
+    # the feature of each node, to search the roads from all the nodes of a polygon.
     @staticmethod
     def features_to_row_cols(given_features, heuristic_index, raster_layer):
 
         row_cols = set()
         heuristic_dictionary = dict()
+        feature_dictionary = dict()
         # extent = raster_layer.dataProvider().extent()
         # if extent.isNull() or extent.isEmpty:
         #     return list(col_rows)
@@ -884,6 +1269,7 @@ class MinCostPathHelper:
                         row_cols.update(row_cols_for_this_polygon)
                         for row_col in row_cols_for_this_polygon:
                             heuristic_dictionary[row_col] = heuristic
+                            feature_dictionary[row_col] = given_feature.id()
 
                 # Case of polygons
                 elif given_feature_geom.wkbType() == QgsWkbTypes.Polygon:
@@ -892,6 +1278,7 @@ class MinCostPathHelper:
                     row_cols.update(row_cols_for_this_polygon)
                     for row_col in row_cols_for_this_polygon:
                         heuristic_dictionary[row_col] = heuristic
+                        feature_dictionary[row_col] = given_feature.id()
 
                 # Case of multi lines
                 elif given_feature_geom.wkbType() == QgsWkbTypes.MultiLineString:
@@ -901,6 +1288,7 @@ class MinCostPathHelper:
                         row_cols.update(row_cols_for_this_line)
                         for row_col in row_cols_for_this_line:
                             heuristic_dictionary[row_col] = heuristic
+                            feature_dictionary[row_col] = given_feature.id()
 
                 # Case of lines
                 elif given_feature_geom.wkbType() == QgsWkbTypes.LineString:
@@ -909,8 +1297,9 @@ class MinCostPathHelper:
                     row_cols.update(row_cols_for_this_line)
                     for row_col in row_cols_for_this_line:
                         heuristic_dictionary[row_col] = heuristic
+                        feature_dictionary[row_col] = given_feature.id()
 
-        return row_cols, heuristic_dictionary
+        return row_cols, heuristic_dictionary, feature_dictionary
 
     # Function that get the data block from a entire raster for a given band
     @staticmethod
@@ -924,6 +1313,55 @@ class MinCostPathHelper:
         height = floor((extent.yMaximum() - extent.yMinimum()) / yres)
         return provider.block(band_num, extent, width, height)
 
+    # Function that writes the values of an entire raster for a given band into a memory-mapped
+    # float32 file, with NaN for No Data. The file is in the order of the flat indexes of a SearchState :
+    # CAREFUL, rows go from bottom to top. The raster is read by bands of rows, so it never has to be
+    # entirely in memory. Returns the memory-mapped array, the height and width of the raster, and if
+    # it contains negative values.
+    @staticmethod
+    def raster_to_cost_file(raster_layer, band_num, path, feedback=None):
+        provider = raster_layer.dataProvider()
+        extent = provider.extent()
+
+        xres = raster_layer.rasterUnitsPerPixelX()
+        yres = raster_layer.rasterUnitsPerPixelY()
+        width = floor((extent.xMaximum() - extent.xMinimum()) / xres)
+        height = floor((extent.yMaximum() - extent.yMinimum()) / yres)
+        costs = np.memmap(path, dtype=np.float32, mode='w+', shape=max(1, width * height))
+        contains_negative = False
+
+        rows = max(1, CHUNK_CELLS // max(1, width))
+        for row_min in range(0, height, rows):
+            row_max = min(height, row_min + rows)
+            band_extent = QgsRectangle(extent.xMinimum(), extent.yMaximum() - row_max * yres,
+                                       extent.xMinimum() + width * xres, extent.yMaximum() - row_min * yres)
+            values = MinCostPathHelper.block2array(provider.block(band_num, band_extent, width, row_max - row_min))
+            if (values < 0).any():
+                contains_negative = True
+            # The rows of the block start at the top.
+            costs[(height - row_max) * width:(height - row_min) * width] = values[::-1].ravel()
+            if feedback is not None:
+                feedback.setProgress(100 * row_max / height)
+
+        costs.flush()
+        return costs, height, width, contains_negative
+
+    # Function that transforms a block into a 2D float32 NumPy array (rows start at the top), with
+    # NaN for No Data. The values are read directly from the data of the block when their type is known.
+    @staticmethod
+    def block2array(block):
+        numpy_types = {Qgis.Byte: np.uint8, Qgis.UInt16: np.uint16, Qgis.Int16: np.int16, Qgis.UInt32: np.uint32,
+                       Qgis.Int32: np.int32, Qgis.Float32: np.float32, Qgis.Float64: np.float64}
+        numpy_type = numpy_types.get(block.dataType())
+        if numpy_type is None:
+            return np.array([[np.nan if block.isNoData(i, j) else block.value(i, j) for j in range(block.width())]
+                             for i in range(block.height())], dtype=np.float32).reshape(block.height(), block.width())
+        raw_values = np.frombuffer(bytes(block.data()), dtype=numpy_type).reshape(block.height(), block.width())
+        values = raw_values.astype(np.float32)
+        if block.hasNoDataValue():
+            values[raw_values == block.noDataValue()] = np.nan
+        return values
+
     # Function that transforms
     @staticmethod
     def block2matrix(block):
@@ -939,6 +1377,42 @@ class MinCostPathHelper:
 
         return matrix, contains_negative
 
+    # Number of points given at once to the k-d tree of kdtree.py by distances_to_closest_points, between two
+    # updates of the progress.
+    QUERY_CHUNK_POINTS = 65536
+
+    @staticmethod
+    def row_cols_to_coordinates(row_cols, raster_layer):
+        """Returns the coordinates of the centres of a list of (row, column) cells, as an array of shape
+        (number of cells, 2), computed as in _row_col_to_point."""
+        xres = raster_layer.rasterUnitsPerPixelX()
+        yres = raster_layer.rasterUnitsPerPixelY()
+        extent = raster_layer.dataProvider().extent()
+        if not row_cols:
+            return np.empty((0, 2), dtype=np.float64)
+        rows, cols = np.array(row_cols, dtype=np.int64).reshape(-1, 2).T
+        return np.column_stack(((cols + 0.5) * xres + extent.xMinimum(), (rows + 0.5) * yres + extent.yMinimum()))
+
+    @staticmethod
+    def distances_to_closest_points(points, other_points, feedback=None):
+        """Returns the euclidean distance from each point (array of coordinates) to the closest of the other points,
+        with a k-d tree of the other points : the one of SciPy if it is installed, queried with all the points at
+        once, or the one of kdtree.py, queried with chunks of points."""
+        if len(points) == 0:
+            return np.empty(0, dtype=np.float64)
+        if cKDTree is not None:
+            return cKDTree(other_points, leafsize=20).query(points)[0]
+        tree = KDTree(other_points, leafsize=20)
+        distances = np.empty(len(points), dtype=np.float64)
+        for first in range(0, len(points), MinCostPathHelper.QUERY_CHUNK_POINTS):
+            last = min(len(points), first + MinCostPathHelper.QUERY_CHUNK_POINTS)
+            distances[first:last] = tree.query(points[first:last])[0]
+            if feedback is not None:
+                feedback.setProgress(100 * last / len(points))
+                if feedback.isCanceled():
+                    break
+        return distances
+
     # This function return the minimum distance between a given node, and the nodes in a set or list of nodes.
     @staticmethod
     def minimum_distance_to_a_node(node, listOrSetOfNodes, raster_layer):
@@ -955,49 +1429,4 @@ class MinCostPathHelper:
 
         return minimumDistance
 
-    @staticmethod
-    def createRelativeCircleNeighborhood(skiddingDistance, raster_layer):
-        """"This method initialize a relative circle neighborhood based on the size of the pixels and on the
-        skidding distance inputted by the user, in order to check rapidly if an existing road is at skidding distance
-        from a given node."""
-
-        xres = raster_layer.rasterUnitsPerPixelX()
-        yres = raster_layer.rasterUnitsPerPixelY()
-
-        widthOfNeighborhood = floor(skiddingDistance / xres) + 1
-        heightOfNeighborhood = floor(skiddingDistance / yres) + 1
-
-        relativeCircleNeighborhood = set()
-
-        for col in range(-widthOfNeighborhood, widthOfNeighborhood+1):
-            for row in range(-heightOfNeighborhood, heightOfNeighborhood+1):
-                # If the euclidian distance between a relative coordinate and the "origin" cell is superior to the
-                # skidding distance, this cell won't be part of the neighborhood.
-                if sqrt((row*yres)**2 + (col*xres)**2) <= skiddingDistance:
-                    relativeCircleNeighborhood.add((row, col))
-
-        return relativeCircleNeighborhood
-
-    @staticmethod
-    def checkRelativeCircleNeighborhoodForRoads(relativeCircleNeighborhood, nodeAsRowCol, roadMatrix):
-        """"This function uses the relative circle neighborhood to check if a road is at skidding distance from a
-        node."""
-
-        rowOfNode = nodeAsRowCol[0]
-        colOfNode = nodeAsRowCol[1]
-        foundARoad = False
-
-        for relativeNeighbour in relativeCircleNeighborhood:
-            relativeRow = rowOfNode + relativeNeighbour[0]
-            relativeColumn = colOfNode + relativeNeighbour[1]
-            # We check if the relative row index is correct; same for the column.
-            if relativeRow > 0 and relativeRow < len(roadMatrix):
-                if relativeColumn > 0 and relativeColumn < len(roadMatrix[0]):
-                    if roadMatrix[relativeRow][relativeColumn] == 1:
-                        foundARoad = True
-                        break
-
-        return foundARoad
-
-
 
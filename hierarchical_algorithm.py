@@ -0,0 +1,486 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ForestRoads
+                                 A QGIS plugin
+ Create a network of forest roads based on zones to access, roads to connect
+ them to, and a cost matrix.
+ The code of the plugin is based on the "LeastCostPath" plugin available on
+ https://github.com/Gooong/LeastCostPath. We thank their team for the template.
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 10-07-2019
+        copyright            : (C) 2019 by Clement Hardy
+        email                : clem.hardy@outlook.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ This script describes the hierarchical pathfinding (HPA*) used for very big
+ cost rasters. The raster is cut into square clusters; the cells on both sides
+ of the borders between clusters that can be crossed are the nodes of a small
+ abstract graph, whose edges are the costs to cross a border or to go from
+ one node to another inside a cluster. A path is first searched in this graph,
+ and is then refined inside the clusters that it goes through.
+"""
+
+
+import hashlib
+import heapq
+import math
+import os
+from math import sqrt
+import numpy as np
+from .dijkstra_algorithm import NEIGHBOURS_OFFSETS, CANCEL_CHECK_INTERVAL
+
+
+def _local_search(state, source_keys, bounds, goal_keys=None, cluster_size=None, clusters=None):
+    """Searches the least cost paths from the given cells (flat indexes of the
+    SearchState) without leaving the given bounds (row_min, row_max, col_min,
+    col_max; maximums excluded), nor the given clusters ((row, column) of the
+    clusters of cluster_size * cluster_size cells) if there are some. The search
+    stops at the first cell of goal_keys, or when every reachable cell has been
+    visited if there is none.
+    Returns the distances and predecessors (dictionaries) and the goal reached."""
+    sqrt2 = sqrt(2)
+    row_min, row_max, col_min, col_max = bounds
+    w = state.w
+    costs = memoryview(state.costs)
+    passable = memoryview(state.passable)
+    dist = {}
+    pred = {}
+    frontier = []
+    for key in source_keys:
+        dist[key] = 0.0
+        pred[key] = -1
+        frontier.append((0.0, key))
+    heapq.heapify(frontier)
+    visited = set()
+
+    while frontier:
+        current_cost, current_key = heapq.heappop(frontier)
+        if current_key in visited:
+            continue
+        visited.add(current_key)
+        if goal_keys is not None and current_key in goal_keys:
+            return dist, pred, current_key
+        row, col = divmod(current_key, w)
+        current_value = costs[current_key]
+        for d_row, d_col, diagonal in NEIGHBOURS_OFFSETS:
+            next_row = row + d_row
+            next_col = col + d_col
+            if not (row_min <= next_row < row_max and col_min <= next_col < col_max):
+                continue
+            if clusters is not None and (next_row // cluster_size, next_col // cluster_size) not in clusters:
+                continue
+            next_key = next_row * w + next_col
+            if not passable[next_key] or next_key in visited:
+                continue
+            if diagonal:
+                new_cost = current_cost + sqrt2 * (current_value + costs[next_key]) / 2
+            else:
+                new_cost = current_cost + (current_value + costs[next_key]) / 2
+            if new_cost < dist.get(next_key, math.inf):
+                dist[next_key] = new_cost
+                pred[next_key] = current_key
+                heapq.heappush(frontier, (new_cost, next_key))
+
+    return dist, pred, None
+
+
+class ClusterGraph:
+    """Abstract graph of a SearchState cut into clusters of cluster_size * cluster_size cells.
+
+    On every border between two clusters, the pairs of facing passable cells make
+    "entrances" (runs of consecutive pairs). An entrance is crossed by one transition
+    in its middle, or by two transitions at its ends if it is long. The cells of the
+    transitions are the nodes of the graph. Their edges are the costs of the
+    transitions, and the least costs between the nodes of a same cluster without
+    leaving it (intra-cluster edges).
+
+    The graph can be saved next to the cost raster. When it is loaded, only the
+    clusters whose costs have changed (and their borders and neighbours) are computed
+    again."""
+
+    # Extension of the file in which the graph is saved, next to the cost raster.
+    CACHE_EXTENSION = '.clusters.npz'
+
+    # Length from which an entrance is crossed by two transitions instead of one.
+    LONG_ENTRANCE = 6
+
+    def __init__(self, state, cluster_size=64):
+        self.state = state
+        self.cluster_size = cluster_size
+        self.cluster_rows = (state.h + cluster_size - 1) // cluster_size
+        self.cluster_cols = (state.w + cluster_size - 1) // cluster_size
+        # Transitions of every border : border -> list of (key in the first cluster,
+        # key in the second cluster, cost). A border is (0, i, j) between the clusters
+        # (i, j) and (i, j + 1), or (1, i, j) between the clusters (i, j) and (i + 1, j).
+        self.borders = {}
+        # Intra-cluster edges : cluster -> dictionary (key, other key) -> cost.
+        self.intra_edges = {}
+        # Nodes of the graph in every cluster, and edges of every node (key -> list of
+        # (other key, cost)). They are made from the borders and intra-cluster edges.
+        self.cluster_nodes = {}
+        self.adjacency = {}
+        self.checksums = [self._cluster_checksum(cluster) for cluster in range(self.cluster_rows * self.cluster_cols)]
+
+    def cluster_of(self, key):
+        """Returns the cluster (as a number) containing the cell of the given flat index."""
+        row, col = divmod(key, self.state.w)
+        return (row // self.cluster_size) * self.cluster_cols + col // self.cluster_size
+
+    def cluster_bounds(self, cluster):
+        """Returns the rows and columns (row_min, row_max, col_min, col_max; maximums
+        excluded) of a cluster."""
+        i, j = divmod(cluster, self.cluster_cols)
+        size = self.cluster_size
+        return i * size, min((i + 1) * size, self.state.h), j * size, min((j + 1) * size, self.state.w)
+
+    def _cluster_checksum(self, cluster):
+        row_min, row_max, col_min, col_max = self.cluster_bounds(cluster)
+        costs = self.state.costs.reshape(self.state.h, self.state.w)[row_min:row_max, col_min:col_max]
+        passable = self.state.passable.reshape(self.state.h, self.state.w)[row_min:row_max, col_min:col_max]
+        return hashlib.sha1(np.where(passable, costs, -1.0).tobytes()).hexdigest()
+
+    def _borders_of(self, cluster):
+        """Returns the borders of a cluster."""
+        i, j = divmod(cluster, self.cluster_cols)
+        borders = []
+        if j + 1 < self.cluster_cols:
+            borders.append((0, i, j))
+        if j > 0:
+            borders.append((0, i, j - 1))
+        if i + 1 < self.cluster_rows:
+            borders.append((1, i, j))
+        if i > 0:
+            borders.append((1, i - 1, j))
+        return borders
+
+    def _neighbour_clusters(self, cluster):
+        i, j = divmod(cluster, self.cluster_cols)
+        return [ii * self.cluster_cols + jj for ii, jj in ((i, j + 1), (i, j - 1), (i + 1, j), (i - 1, j))
+                if 0 <= ii < self.cluster_rows and 0 <= jj < self.cluster_cols]
+
+    def _compute_border(self, border):
+        """Finds the transitions of a border."""
+        kind, i, j = border
+        size = self.cluster_size
+        w = self.state.w
+        if kind == 0:
+            col = (j + 1) * size - 1
+            pairs = [(row * w + col, row * w + col + 1) for row in range(i * size, min((i + 1) * size, self.state.h))]
+        else:
+            row = (i + 1) * size - 1
+            pairs = [(row * w + col, (row + 1) * w + col) for col in range(j * size, min((j + 1) * size, w))]
+
+        passable = self.state.passable
+        costs = self.state.costs
+        transitions = []
+        entrance = []
+        for pair in pairs + [None]:
+            if pair is not None and passable[pair[0]] and passable[pair[1]]:
+                entrance.append(pair)
+                continue
+            if entrance:
+                if len(entrance) >= self.LONG_ENTRANCE:
+                    chosen = [entrance[0], entrance[-1]]
+                else:
+                    chosen = [entrance[len(entrance) // 2]]
+                for key, other_key in chosen:
+                    transitions.append((key, other_key, float(costs[key] + costs[other_key]) / 2))
+                entrance = []
+        self.borders[border] = transitions
+
+    def _compute_intra_edges(self, cluster):
+        """Computes the least costs between the nodes of a cluster, inside the cluster."""
+        nodes = sorted(self._nodes_from_borders(cluster))
+        bounds = self.cluster_bounds(cluster)
+        edges = {}
+        for index, key in enumerate(nodes):
+            others = nodes[index + 1:]
+            if not others:
+                break
+            dist = _local_search(self.state, [key], bounds)[0]
+            for other_key in others:
+                if other_key in dist:
+                    edges[(key, other_key)] = dist[other_key]
+        self.intra_edges[cluster] = edges
+
+    def _nodes_from_borders(self, cluster):
+        nodes = set()
+        for border in self._borders_of(cluster):
+            for key, other_key, cost in self.borders.get(border, []):
+                if self.cluster_of(key) == cluster:
+                    nodes.add(key)
+                if self.cluster_of(other_key) == cluster:
+                    nodes.add(other_key)
+        return nodes
+
+    def build(self, clusters=None, feedback=None):
+        """Computes the borders and intra-cluster edges of the given clusters (all of
+        them if None), and the intra-cluster edges of their neighbours."""
+        number_of_clusters = self.cluster_rows * self.cluster_cols
+        if clusters is None:
+            clusters = set(range(number_of_clusters))
+        borders = set()
+        for cluster in clusters:
+            borders.update(self._borders_of(cluster))
+        for border in borders:
+            self._compute_border(border)
+        to_update = set(clusters)
+        for cluster in clusters:
+            to_update.update(self._neighbour_clusters(cluster))
+        for progress, cluster in enumerate(sorted(to_update)):
+            self._compute_intra_edges(cluster)
+            if feedback is not None:
+                feedback.setProgress(100 * (progress + 1) / len(to_update))
+                if feedback.isCanceled():
+                    break
+        self._make_adjacency()
+
+    def _make_adjacency(self):
+        self.cluster_nodes = {}
+        self.adjacency = {}
+        for cluster in range(self.cluster_rows * self.cluster_cols):
+            self.cluster_nodes[cluster] = self._nodes_from_borders(cluster)
+            for key in self.cluster_nodes[cluster]:
+                self.adjacency[key] = []
+        for transitions in self.borders.values():
+            for key, other_key, cost in transitions:
+                self.adjacency[key].append((other_key, cost))
+                self.adjacency[other_key].append((key, cost))
+        for edges in self.intra_edges.values():
+            for (key, other_key), cost in edges.items():
+                self.adjacency[key].append((other_key, cost))
+                self.adjacency[other_key].append((key, cost))
+
+    def save(self, path):
+        """Saves the graph in a .npz file."""
+        border_rows = [(border[0], border[1], border[2], key, other_key, cost)
+                       for border, transitions in self.borders.items() for key, other_key, cost in transitions]
+        intra_rows = [(cluster, key, other_key, cost)
+                      for cluster, edges in self.intra_edges.items() for (key, other_key), cost in edges.items()]
+        border_rows = np.array(border_rows, dtype=np.float64).reshape(-1, 6)
+        intra_rows = np.array(intra_rows, dtype=np.float64).reshape(-1, 4)
+        with open(path, 'wb') as cache_file:
+            np.savez(cache_file, shape=np.array([self.state.h, self.state.w, self.cluster_size]),
+                     checksums=np.array(self.checksums), border_rows=border_rows, intra_rows=intra_rows)
+
+    def _load(self, path):
+        """Loads a graph saved for a raster of the same size with the same clusters,
+        and returns the clusters whose costs have changed since, or None if the graph
+        cannot be used."""
+        try:
+            with np.load(path) as saved:
+                if list(saved['shape']) != [self.state.h, self.state.w, self.cluster_size]:
+                    return None
+                checksums = [str(checksum) for checksum in saved['checksums']]
+                border_rows = saved['border_rows']
+                intra_rows = saved['intra_rows']
+        except (OSError, ValueError, KeyError):
+            return None
+        # Keys are below 2 ** 53, so they are exactly kept as float64.
+        for kind, i, j, key, other_key, cost in border_rows.tolist():
+            self.borders.setdefault((int(kind), int(i), int(j)), []).append((int(key), int(other_key), cost))
+        for cluster, key, other_key, cost in intra_rows.tolist():
+            self.intra_edges.setdefault(int(cluster), {})[(int(key), int(other_key))] = cost
+        return set(cluster for cluster, checksum in enumerate(checksums) if checksum != self.checksums[cluster])
+
+    @classmethod
+    def load_or_build(cls, state, cluster_size=64, raster_path=None, feedback=None):
+        """Loads the graph saved next to the raster file (if any) and updates the
+        clusters that have changed, or builds the whole graph; then saves it there.
+        If raster_path is None, or is not a file, the graph is only built."""
+        graph = cls(state, cluster_size)
+        if raster_path is None or not os.path.isfile(raster_path):
+            graph.build(feedback=feedback)
+            return graph
+
+        cache_path = raster_path + cls.CACHE_EXTENSION
+        changed_clusters = graph._load(cache_path) if os.path.isfile(cache_path) else None
+        if changed_clusters is None:
+            graph.borders = {}
+            graph.intra_edges = {}
+            graph.build(feedback=feedback)
+        elif changed_clusters:
+            if feedback is not None:
+                feedback.pushInfo("Clusters loaded from " + cache_path + "; " + str(len(changed_clusters))
+                                  + " clusters have changed and are computed again.")
+            graph.build(changed_clusters, feedback)
+        else:
+            if feedback is not None:
+                feedback.pushInfo("Clusters loaded from " + cache_path)
+            graph._make_adjacency()
+            return graph
+
+        try:
+            graph.save(cache_path)
+            if feedback is not None:
+                feedback.pushInfo("Clusters saved in " + cache_path)
+        except OSError:
+            if feedback is not None:
+                feedback.pushInfo("WARNING : The clusters could not be saved in " + cache_path)
+        return graph
+
+
+class HierarchicalSearch:
+    """Searches paths towards the road network with a ClusterGraph.
+
+    The costs from the nodes of the graph to the closest road cell inside their
+    cluster are computed when they are needed, and kept until the roads of the
+    cluster change. The abstract paths are close to the least cost paths, but not
+    always the best ones : they have to cross the borders of the clusters at the
+    transitions, and only with horizontal or vertical moves. The path is then
+    refined by a search restricted to the clusters that the abstract path goes
+    through, and to the clusters within corridor_margin clusters of them : with
+    a margin of 1, the costs were within 1 % of the least costs on random rasters,
+    against 20 % without margin."""
+
+    def __init__(self, graph, network_row_cols, corridor_margin=1):
+        self.graph = graph
+        self.corridor_margin = corridor_margin
+        self.state = graph.state
+        self.network = set()
+        self.network_by_cluster = {}
+        # Cluster -> (distances, predecessors) of a search from the roads of the cluster.
+        self.goal_searches = {}
+        self.add_cells(network_row_cols)
+
+    def add_cells(self, row_cols):
+        """Adds new cells to the network (e.g. the cells of a new road). The road cells
+        that cannot be crossed (No Data, or in the last row) cannot be reached by the
+        refinement of a path, so they are not goals of the abstract search."""
+        passable = self.state.passable
+        for row_col in row_cols:
+            key = self.state.index(row_col)
+            if key is not None and key not in self.network:
+                self.network.add(key)
+                if not passable[key]:
+                    continue
+                cluster = self.graph.cluster_of(key)
+                self.network_by_cluster.setdefault(cluster, set()).add(key)
+                self.goal_searches.pop(cluster, None)
+
+    def _goal_search(self, cluster):
+        if cluster not in self.goal_searches:
+            dist, pred, reached = _local_search(self.state, self.network_by_cluster[cluster],
+                                                self.graph.cluster_bounds(cluster))
+            self.goal_searches[cluster] = (dist, pred)
+        return self.goal_searches[cluster]
+
+    def search(self, start_row_col, feedback=None):
+        """Returns the path, the accumulated costs along the path and the road cell
+        that was reached, or three None if no road cell can be reached."""
+        graph = self.graph
+        state = self.state
+        w = state.w
+        start_key = state.index(start_row_col)
+        # As with the other engines, we return nothing if the start is already on a road.
+        if start_key is None or not state.passable[start_key] or start_key in self.network:
+            return None, None, None
+
+        # We first search inside the cluster of the start : it gives the costs to the
+        # nodes of the cluster, and to the roads of the cluster if there are some.
+        start_cluster = graph.cluster_of(start_key)
+        start_dist, reached = _local_search(state, [start_key], graph.cluster_bounds(start_cluster),
+                                            self.network_by_cluster.get(start_cluster))[0::2]
+        best_cost = start_dist[reached] if reached is not None else math.inf
+        best_key = None
+
+        # Then, we search in the abstract graph. The parent of a node is None if it is
+        # reached from the start.
+        frontier = []
+        dist = {}
+        parent = {}
+        for key in graph.cluster_nodes[start_cluster]:
+            if key in start_dist:
+                dist[key] = start_dist[key]
+                parent[key] = None
+                frontier.append((start_dist[key], key))
+        heapq.heapify(frontier)
+        visited = set()
+        popped = 0
+        while frontier:
+            current_cost, current_key = heapq.heappop(frontier)
+            if current_key in visited:
+                continue
+            if current_cost >= best_cost:
+                break
+            visited.add(current_key)
+            popped += 1
+            if feedback is not None and popped % CANCEL_CHECK_INTERVAL == 0 and feedback.isCanceled():
+                return None, None, None
+            cluster = graph.cluster_of(current_key)
+            if cluster in self.network_by_cluster:
+                goal_dist = self._goal_search(cluster)[0]
+                if current_key in goal_dist and current_cost + goal_dist[current_key] < best_cost:
+                    best_cost = current_cost + goal_dist[current_key]
+                    best_key = current_key
+            for next_key, cost in graph.adjacency[current_key]:
+                new_cost = current_cost + cost
+                if next_key not in visited and new_cost < dist.get(next_key, math.inf):
+                    dist[next_key] = new_cost
+                    parent[next_key] = current_key
+                    heapq.heappush(frontier, (new_cost, next_key))
+
+        if best_cost == math.inf:
+            return None, None, None
+
+        # Finally, we refine the path inside the clusters. If the best road is in the cluster
+        # of the start, the abstract path is empty : the refinement can still find a
+        # cheaper road just across a border of the cluster.
+        abstract_path = []
+        if best_key is not None:
+            abstract_path.append(best_key)
+            while parent[abstract_path[-1]] is not None:
+                abstract_path.append(parent[abstract_path[-1]])
+            abstract_path.reverse()
+        # The least cost path inside the clusters of the abstract path (and the clusters
+        # around them) is at least as good as the abstract path, and does not have to
+        # cross the borders at the transitions.
+        margin = range(-self.corridor_margin, self.corridor_margin + 1)
+        corridor = set((row // graph.cluster_size + d_row, col // graph.cluster_size + d_col)
+                       for row, col in (divmod(key, w) for key in [start_key] + abstract_path)
+                       for d_row in margin for d_col in margin)
+        pred, reached = _local_search(state, [start_key], (0, state.h, 0, state.w), self.network,
+                                      graph.cluster_size, corridor)[1:]
+        # The abstract path only goes through cells that can be crossed, so the refinement
+        # should always reach a road; if it does not, there is no path to give.
+        if reached is None:
+            return None, None, None
+        keys = self._chain(pred, reached)
+
+        # The refined path can cross a road before its end : we stop it there.
+        for index, key in enumerate(keys):
+            if key in self.network:
+                keys = keys[:index + 1]
+                break
+
+        sqrt2 = sqrt(2)
+        costs = state.costs
+        path = [divmod(key, w) for key in keys]
+        costs_of_path = [0.0]
+        for (row, col), (next_row, next_col), key, next_key in zip(path, path[1:], keys, keys[1:]):
+            cost = (float(costs[key]) + float(costs[next_key])) / 2
+            if row != next_row and col != next_col:
+                cost = sqrt2 * (float(costs[key]) + float(costs[next_key])) / 2
+            costs_of_path.append(costs_of_path[-1] + cost)
+        return path, costs_of_path, path[-1]
+
+    @staticmethod
+    def _chain(pred, key):
+        """Returns the keys from the source of a local search to the given key."""
+        keys = []
+        while key != -1:
+            keys.append(key)
+            key = pred[key]
+        keys.reverse()
+        return keys
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ForestRoads
+                                 A QGIS plugin
+ Create a network of forest roads based on zones to access, roads to connect
+ them to, and a cost matrix.
+ The code of the plugin is based on the "LeastCostPath" plugin available on
+ https://github.com/Gooong/LeastCostPath. We thank their team for the template.
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 10-07-2019
+        copyright            : (C) 2019 by Clement Hardy
+        email                : clem.hardy@outlook.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ This script describes the preprocessing of the ALT algorithm (A*, Landmarks,
+ Triangle inequality) : the cost distances from a few landmark cells to every
+ cell of the cost raster are computed once, and give lower bounds of the cost
+ between any two cells to guide the "alt" engine of dijkstra_algorithm.py.
+"""
+
+
+import bisect
+import hashlib
+import math
+import os
+import numpy as np
+from .dijkstra_algorithm import cost_distances
+
+
+class Landmarks:
+    """Cost distances (float32) from some landmark cells to every cell of a
+    SearchState. As the cost to go from a cell to a neighbour is the same in both
+    directions, the triangle inequality gives, for any landmark L and cells x and t :
+    cost(x, t) >= |cost(L, x) - cost(L, t)|."""
+
+    # Extension of the file in which the landmarks are saved, next to the cost raster.
+    CACHE_EXTENSION = '.landmarks.npz'
+
+    def __init__(self, state, landmark_keys, distances):
+        self.state = state
+        self.landmark_keys = landmark_keys
+        # Array of shape (number of landmarks, number of cells).
+        self.distances = distances
+
+    @staticmethod
+    def checksum(state):
+        """Identifies the costs of a SearchState, to know if saved landmarks can be used with it."""
+        digest = hashlib.sha1()
+        digest.update(np.array([state.h, state.w], dtype=np.int64).tobytes())
+        digest.update(np.where(state.passable, state.costs, -1.0).tobytes())
+        return digest.hexdigest()
+
+    @classmethod
+    def compute(cls, state, number_of_landmarks, feedback=None):
+        """Chooses the landmarks with the "farthest" method : each new landmark is the
+        reachable cell that is the farthest (in cost) from the landmarks already chosen.
+        The first one is the farthest from the first passable cell of the raster.
+        This takes one full search of the raster per landmark, plus one."""
+        passable_keys = np.flatnonzero(state.passable)
+        if len(passable_keys) == 0:
+            return cls(state, [], np.zeros((0, state.h * state.w), dtype=np.float32))
+
+        distances_to_chosen = cost_distances(state, [int(passable_keys[0])], feedback)
+        landmark_keys = []
+        distances = []
+        for i in range(number_of_landmarks):
+            reachable = np.isfinite(distances_to_chosen)
+            if not reachable.any():
+                break
+            key = int(np.argmax(np.where(reachable, distances_to_chosen, -1.0)))
+            if key in landmark_keys:
+                break
+            if feedback is not None:
+                feedback.pushInfo("Computing the distances from landmark " + str(i + 1) + " of "
+                                  + str(number_of_landmarks) + "...")
+                if feedback.isCanceled():
+                    break
+            landmark_distances = cost_distances(state, [key], feedback)
+            landmark_keys.append(key)
+            distances.append(landmark_distances.astype(np.float32))
+            if i == 0:
+                distances_to_chosen = landmark_distances
+            else:
+                np.minimum(distances_to_chosen, landmark_distances, out=distances_to_chosen)
+
+        return cls(state, landmark_keys, np.array(distances, dtype=np.float32).reshape(-1, state.h * state.w))
+
+    @classmethod
+    def load_or_compute(cls, state, number_of_landmarks, raster_path=None, feedback=None):
+        """Loads the landmarks saved next to the raster file if they have been made from
+        the same costs, or computes them and saves them there. If raster_path is None,
+        or is not a file, the landmarks are only computed."""
+        if raster_path is None or not os.path.isfile(raster_path):
+            return cls.compute(state, number_of_landmarks, feedback)
+
+        cache_path = raster_path + cls.CACHE_EXTENSION
+        checksum = cls.checksum(state)
+        if os.path.isfile(cache_path):
+            try:
+                with np.load(cache_path) as saved:
+                    if str(saved['checksum']) == checksum and saved['number_of_landmarks'] == number_of_landmarks:
+                        if feedback is not None:
+                            feedback.pushInfo("Landmarks loaded from " + cache_path)
+                        return cls(state, [int(key) for key in saved['landmark_keys']], saved['distances'])
+            except (OSError, ValueError, KeyError):
+                pass
+
+        landmarks = cls.compute(state, number_of_landmarks, feedback)
+        try:
+            with open(cache_path, 'wb') as cache_file:
+                np.savez(cache_file, checksum=checksum, number_of_landmarks=number_of_landmarks,
+                         landmark_keys=np.array(landmarks.landmark_keys), distances=landmarks.distances)
+            if feedback is not None:
+                feedback.pushInfo("Landmarks saved in " + cache_path)
+        except OSError:
+            if feedback is not None:
+                feedback.pushInfo("WARNING : The landmarks could not be saved in " + cache_path)
+        return landmarks
+
+    def bounds_towards(self, network_row_cols, network_distance=None):
+        """Returns the LandmarkBounds towards the given cells of the network."""
+        return LandmarkBounds(self, network_row_cols, network_distance)
+
+
+class LandmarkBounds:
+    """Lower bounds of the cost to go from any cell to the closest cell of the network,
+    given by the landmarks : for each landmark, the smallest difference between the
+    distance of the cell and the distances of the cells of the network. To find it,
+    the distances of the network cells are kept sorted for every landmark.
+    If a NetworkDistanceTransform is given, its bound is used when it is higher.
+    The bounds are computed when the search needs them, and kept while the new cells
+    of the network do not lower them."""
+
+    # Relative rounding error of the distances saved as float32, taken off the bounds
+    # so that they stay lower than the true costs.
+    FLOAT32_ERROR = 1.2e-7
+
+    def __init__(self, landmarks, network_row_cols, network_distance=None):
+        self.landmarks = landmarks
+        self.state = landmarks.state
+        self.network_distance = network_distance
+        if network_distance is not None:
+            self.network_bounds = memoryview(network_distance.flat_bounds)
+        self.network = set()
+        self.sorted_distances = [[] for key in landmarks.landmark_keys]
+        # Views on the distances of every landmark, that return Python floats.
+        self.distance_views = [memoryview(distances) for distances in landmarks.distances]
+        # Bounds already computed (NaN if not computed yet), the flat indexes of the
+        # cells where they are known, and the landmark that gave each of them (-1 for
+        # the NetworkDistanceTransform, or for 0 when nothing gave a higher bound).
+        self.known_bounds = np.full(self.state.h * self.state.w, np.nan, dtype=np.float64)
+        self.known_bounds_view = memoryview(self.known_bounds)
+        self.known_keys = []
+        self.bound_landmarks = np.full(self.state.h * self.state.w, -1, dtype=np.int16)
+        self.bound_landmarks_view = memoryview(self.bound_landmarks)
+        self.add_cells(network_row_cols)
+
+    def add_cells(self, row_cols):
+        """Adds new cells to the network (e.g. the cells of a new road)."""
+        new_keys = []
+        for row_col in row_cols:
+            key = self.state.index(row_col)
+            if key is not None and key not in self.network:
+                self.network.add(key)
+                new_keys.append(key)
+        for sorted_distances, distances in zip(self.sorted_distances, self.distance_views):
+            for key in new_keys:
+                if distances[key] != math.inf:
+                    bisect.insort(sorted_distances, distances[key])
+        if self.network_distance is not None:
+            self.network_distance.add_cells(row_cols)
+        if new_keys and self.known_keys:
+            self.forget_lowered_bounds(new_keys)
+
+    def forget_lowered_bounds(self, new_keys):
+        """Forgets the known bounds that the new cells of the network can lower. A bound
+        given by a landmark stays the same if the distances of the new cells from this
+        landmark are not closer to the distance of the cell than the bound, as the other
+        landmarks gave lower bounds and can only give lower ones. A bound given by the
+        NetworkDistanceTransform stays the same if the transform did not lower it.
+        Only the cells where a bound is known are checked, not the whole raster."""
+        keys = np.array(self.known_keys, dtype=np.int64)
+        bounds = self.known_bounds[keys]
+        landmarks = self.bound_landmarks[keys]
+        lowered = np.zeros(len(keys), dtype=bool)
+        new_keys = np.array(new_keys, dtype=np.int64)
+        for i, distances in enumerate(self.landmarks.distances):
+            selected = np.flatnonzero(landmarks == i)
+            if len(selected) == 0:
+                continue
+            new_distances = distances[new_keys].astype(np.float64)
+            new_distances = np.sort(new_distances[np.isfinite(new_distances)])
+            if len(new_distances) == 0:
+                continue
+            cell_distances = distances[keys[selected]].astype(np.float64)
+            # Same gaps as in bound(), to the closest new distances above and below.
+            j = np.searchsorted(new_distances, cell_distances)
+            upper = new_distances[np.minimum(j, len(new_distances) - 1)]
+            lower = new_distances[np.maximum(j - 1, 0)]
+            gap = np.full(len(selected), np.inf)
+            above = j < len(new_distances)
+            gap[above] = (upper - cell_distances - self.FLOAT32_ERROR * (upper + cell_distances))[above]
+            below = j > 0
+            gap[below] = np.minimum(gap, cell_distances - lower
+                                    - self.FLOAT32_ERROR * (cell_distances + lower))[below]
+            lowered[selected] = gap < bounds[selected]
+        if self.network_distance is not None:
+            selected = np.flatnonzero(landmarks == -1)
+            lowered[selected] = self.network_distance.flat_bounds[keys[selected]] < bounds[selected]
+        self.known_bounds[keys[lowered]] = np.nan
+        self.known_keys = keys[~lowered].tolist()
+
+    def bound(self, key):
+        """Lower bound of the cost from the cell of flat index "key" to the network."""
+        best = self.known_bounds_view[key]
+        # (NaN is the only value that is not equal to itself)
+        if best == best:
+            return best
+        if self.network_distance is not None:
+            best = self.network_bounds[key]
+        else:
+            best = 0.0
+        best_landmark = -1
+        for landmark, (sorted_distances, distances) in enumerate(zip(self.sorted_distances,
+                                                                     self.distance_views)):
+            distance = distances[key]
+            # If the landmark cannot reach the cell, it tells nothing about it.
+            if distance == math.inf:
+                continue
+            i = bisect.bisect_left(sorted_distances, distance)
+            # If the landmark can reach the cell but no cell of the network, the
+            # network cannot be reached from the cell.
+            gap = math.inf
+            if i < len(sorted_distances):
+                upper = sorted_distances[i]
+                gap = upper - distance - self.FLOAT32_ERROR * (upper + distance)
+            if i > 0:
+                lower = sorted_distances[i - 1]
+                gap = min(gap, distance - lower - self.FLOAT32_ERROR * (distance + lower))
+            if gap > best:
+                best = gap
+                best_landmark = landmark
+        self.known_bounds_view[key] = best
+        self.bound_landmarks_view[key] = best_landmark
+        self.known_keys.append(key)
+        return best
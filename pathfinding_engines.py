@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ForestRoads
+                                 A QGIS plugin
+ Create a network of forest roads based on zones to access, roads to connect
+ them to, and a cost matrix.
+ The code of the plugin is based on the "LeastCostPath" plugin available on
+ https://github.com/Gooong/LeastCostPath. We thank their team for the template.
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 10-07-2019
+        copyright            : (C) 2019 by Clement Hardy
+        email                : clem.hardy@outlook.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ This script describes the pathfinding engines that can be chosen to build the
+ road network. Every engine has the same interface : it is made from the
+ SearchState of the cost raster and the cells of the road network, prepares
+ what it needs once (precompute), searches the roads (query), learns the cells
+ of every new road (commit), and frees what it holds (close). The engines are
+ kept in a registry, in the order of the options of the algorithm; a new
+ engine only needs to be registered to be chosen and benchmarked with the
+ others.
+"""
+
+
+from .dijkstra_algorithm import dijkstra, dijkstra_from_cells, NetworkDistanceTransform, SearchTargets
+from .landmarks_algorithm import Landmarks
+from .hierarchical_algorithm import ClusterGraph, HierarchicalSearch
+from .corridor_algorithm import CorridorSearch
+from .delta_stepping_algorithm import DeltaStepping
+from .sweep_algorithm import SweepField
+
+# Registered engine classes, by name, in the order in which they were registered.
+ENGINE_CLASSES = {}
+
+# Options of the engines, with their default values. An engine only reads the
+# ones it needs.
+DEFAULT_OPTIONS = {
+    "number_of_landmarks": 8,
+    "save_preprocessing": False,
+    "raster_path": None,
+    "bucket_width": None,
+    "cost_quantization": None,
+    "cluster_size": 64,
+    "corridor_buffer": 2,
+    "number_of_processes": None,
+}
+
+
+def register_engine(engine_class):
+    """Adds an engine class to the registry (to be used as a class decorator)."""
+    if engine_class.name in ENGINE_CLASSES:
+        raise ValueError("A pathfinding engine is already named " + str(engine_class.name))
+    ENGINE_CLASSES[engine_class.name] = engine_class
+    return engine_class
+
+
+def engine_names():
+    """Returns the names of the registered engines."""
+    return list(ENGINE_CLASSES)
+
+
+def engine_labels():
+    """Returns the labels of the registered engines, to be shown to the user."""
+    return [engine_class.label for engine_class in ENGINE_CLASSES.values()]
+
+
+def create_engine(name, state, network_row_cols, options=None):
+    """Returns a new engine of the given name, made from a SearchState and the cells
+    of the road network. Its precompute method must be called before the queries."""
+    if name not in ENGINE_CLASSES:
+        raise ValueError("Unknown pathfinding engine : " + str(name))
+    return ENGINE_CLASSES[name](state, network_row_cols, options)
+
+
+class PathfindingEngine:
+    """Base of the pathfinding engines : the searches are made by the engine of the
+    dijkstra function of the same name, with the SearchState of the raster. The
+    subclasses prepare the objects that their engine needs in precompute, and keep
+    them up to date in commit. The engines whose search can start from several cells
+    (multi_source) are also used for the searches from several cells; for the other
+    ones, these searches are made by the multi-source search of dijkstra_from_cells
+    (i.e. with the "array" engine), and a warning is shown the first time.
+
+    The cells of the road network are kept in a SearchTargets, made once and
+    updated by commit, to be given as the ending cells of the queries."""
+
+    name = None
+    label = None
+    multi_source = False
+
+    def __init__(self, state, network_row_cols, options=None):
+        self.state = state
+        self.network_row_cols = network_row_cols
+        self.targets = SearchTargets(state, network_row_cols)
+        self.options = dict(DEFAULT_OPTIONS)
+        if options:
+            self.options.update(options)
+        self.warned_multi_source = False
+
+    def precompute(self, feedback=None):
+        """Prepares what the searches need (e.g. the landmarks of the ALT algorithm)."""
+
+    def search_arguments(self):
+        """Returns the keyword arguments of the dijkstra function for this engine."""
+        return {}
+
+    def query(self, start_row_cols, end_row_cols, angle_considered, punisherAngleDictionnary, feedback=None,
+              max_cost=None, statistics=None):
+        """Returns the least cost path from one of the starting cells to the closest of
+        the ending cells (see the dijkstra function) : the path, the accumulated costs
+        along the path and the ending cell that was reached, or three None."""
+        if len(start_row_cols) == 1:
+            start = start_row_cols[0]
+        elif self.multi_source:
+            start = list(start_row_cols)
+        else:
+            if feedback is not None and not self.warned_multi_source:
+                feedback.pushInfo("WARNING : " + self.label + " cannot search from several cells at once; the "
+                                  "searches from several cells are made with Dijkstra.")
+            self.warned_multi_source = True
+            return dijkstra_from_cells(start_row_cols, end_row_cols, None, angle_considered,
+                                       punisherAngleDictionnary, feedback, state=self.state, max_cost=max_cost,
+                                       statistics=statistics)
+        return dijkstra(start, end_row_cols, None, angle_considered, punisherAngleDictionnary, feedback,
+                        engine=self.name, state=self.state, max_cost=max_cost, statistics=statistics,
+                        **self.search_arguments())
+
+    def commit(self, path):
+        """Adds the cells of a new road to the network."""
+        self.targets.add_cells(path)
+
+    def close(self):
+        """Frees what the engine holds (e.g. processes)."""
+
+
+# The "heap" and "queue" engines of the dijkstra function are not registered : they
+# give the same paths as the "array" engine, more slowly, and search the matrix of
+# the raster instead of the SearchState. They are kept for the benchmarks.
+@register_engine
+class ArrayEngine(PathfindingEngine):
+    name = "array"
+    label = "Dijkstra"
+    multi_source = True
+
+
+@register_engine
+class AStarEngine(PathfindingEngine):
+    """A* guided by a lower bound of the cost to reach the roads from every cell,
+    updated every time a road is added."""
+
+    name = "astar"
+    label = "A* (guided towards the closest road)"
+    multi_source = True
+
+    def precompute(self, feedback=None):
+        self.network_distance = NetworkDistanceTransform(self.state, self.network_row_cols)
+
+    def search_arguments(self):
+        return {"network_distance": self.network_distance}
+
+    def commit(self, path):
+        PathfindingEngine.commit(self, path)
+        self.network_distance.add_cells(path)
+
+
+@register_engine
+class ALTEngine(AStarEngine):
+    """A* guided by the distances from the landmarks to every cell, computed (or
+    loaded if they have been saved before with the same cost raster)."""
+
+    name = "alt"
+    label = "ALT (A* guided by landmarks)"
+
+    def precompute(self, feedback=None):
+        AStarEngine.precompute(self, feedback)
+        if feedback is not None:
+            feedback.pushInfo("Preparing the landmarks of the ALT algorithm...")
+        number_of_landmarks = self.options["number_of_landmarks"]
+        if self.options["save_preprocessing"]:
+            landmarks = Landmarks.load_or_compute(self.state, number_of_landmarks, self.options["raster_path"],
+                                                  feedback)
+        else:
+            landmarks = Landmarks.compute(self.state, number_of_landmarks, feedback)
+        self.landmark_bounds = landmarks.bounds_towards(self.network_row_cols, self.network_distance)
+
+    def search_arguments(self):
+        return {"network_distance": self.network_distance, "landmark_bounds": self.landmark_bounds}
+
+    def commit(self, path):
+        PathfindingEngine.commit(self, path)
+        # The bounds of the landmarks also update the NetworkDistanceTransform.
+        self.landmark_bounds.add_cells(path)
+
+
+@register_engine
+class BidirectionalEngine(PathfindingEngine):
+    name = "bidirectional"
+    label = "Bidirectional Dijkstra"
+
+
+@register_engine
+class BucketEngine(PathfindingEngine):
+    name = "bucket"
+    label = "Dijkstra with a bucket queue"
+    multi_source = True
+
+    def search_arguments(self):
+        return {"bucket_width": self.options["bucket_width"], "cost_quantization": self.options["cost_quantization"]}
+
+
+@register_engine
+class HierarchicalEngine(PathfindingEngine):
+    """HPA* on the graph of the clusters, computed (or loaded and updated if it has
+    been saved before with the same cost raster)."""
+
+    name = "hierarchical"
+    label = "Hierarchical (HPA*, for very big rasters)"
+
+    def precompute(self, feedback=None):
+        if feedback is not None:
+            feedback.pushInfo("Preparing the clusters of the hierarchical algorithm...")
+        cluster_size = self.options["cluster_size"]
+        if self.options["save_preprocessing"]:
+            cluster_graph = ClusterGraph.load_or_build(self.state, cluster_size, self.options["raster_path"],
+                                                       feedback)
+        else:
+            cluster_graph = ClusterGraph(self.state, cluster_size)
+            cluster_graph.build(feedback=feedback)
+        self.hierarchical_search = HierarchicalSearch(cluster_graph, self.network_row_cols)
+
+    def search_arguments(self):
+        return {"hierarchical_search": self.hierarchical_search}
+
+    def commit(self, path):
+        PathfindingEngine.commit(self, path)
+        self.hierarchical_search.add_cells(path)
+
+
+@register_engine
+class CorridorEngine(PathfindingEngine):
+    """Coarse-to-fine search in the matrix aggregated 2, 4 and 8 times."""
+
+    name = "corridor"
+    label = "Coarse-to-fine corridors (for very big rasters)"
+
+    def precompute(self, feedback=None):
+        self.corridor_search = CorridorSearch(self.state, self.network_row_cols, self.options["corridor_buffer"])
+
+    def search_arguments(self):
+        return {"corridor_search": self.corridor_search}
+
+    def commit(self, path):
+        PathfindingEngine.commit(self, path)
+        self.corridor_search.add_cells(path)
+
+
+@register_engine
+class JumpEngine(PathfindingEngine):
+    name = "jump"
+    label = "Dijkstra with jumps over uniform costs"
+
+
+@register_engine
+class DeltaEngine(PathfindingEngine):
+    """Delta-stepping, with processes started once and used by every search."""
+
+    name = "delta"
+    label = "Parallel delta-stepping (for big rasters and many processors)"
+
+    delta_stepping = None
+
+    def precompute(self, feedback=None):
+        self.delta_stepping = DeltaStepping(self.state, self.options["bucket_width"],
+                                            self.options["number_of_processes"] or None)
+        if feedback is not None:
+            feedback.pushInfo("Delta-stepping with buckets of width " + str(self.delta_stepping.delta) + " and "
+                              + str(max(self.delta_stepping.workers, 1)) + " processes")
+
+    def search_arguments(self):
+        return {"delta_stepping": self.delta_stepping}
+
+    def close(self):
+        if self.delta_stepping is not None:
+            self.delta_stepping.close()
+
+
+@register_engine
+class SweepEngine(PathfindingEngine):
+    """Cost-distance raster from the roads, computed by the first search and repaired
+    around the new roads by the next ones."""
+
+    name = "sweep"
+    label = "Cost-distance sweeps from the roads (for many cells to reach)"
+    multi_source = True
+
+    def precompute(self, feedback=None):
+        self.sweep_field = SweepField(self.state, self.network_row_cols)
+
+    def search_arguments(self):
+        return {"sweep_field": self.sweep_field}
+
+    def commit(self, path):
+        PathfindingEngine.commit(self, path)
+        self.sweep_field.add_cells(path)
+
+
+@register_engine
+class TurnsEngine(PathfindingEngine):
+    name = "turns"
+    label = "Dijkstra with exact punishment of the angles"
+    multi_source = True
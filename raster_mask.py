@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ForestRoads
+                                 A QGIS plugin
+ Create a network of forest roads based on zones to access, roads to connect
+ them to, and a cost matrix.
+ The code of the plugin is based on the "LeastCostPath" plugin available on
+ https://github.com/Gooong/LeastCostPath. We thank their team for the template.
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 10-07-2019
+        copyright            : (C) 2019 by Clement Hardy
+        email                : clem.hardy@outlook.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ This script describes the masks of the raster (e.g. the cells of the roads),
+ which only need one flag per cell : they are kept as one byte per cell, or as
+ one bit per cell for the very big rasters, instead of a float per cell.
+"""
+
+
+import os
+import numpy as np
+
+
+class RasterMask:
+    """Boolean flag of every (row, column) cell of the raster, with rows counted from
+    the bottom as in the rest of the algorithm. If packed is True, the flags are
+    kept as bits (8 cells per byte, along the rows); otherwise as one byte per cell,
+    which is faster to read. If a folder is given, the flags are a memory-mapped
+    file of the given name in it (for the rasters that do not fit in memory).
+
+    The cells are read and set all at once (get_cells, set_cells, or get and set
+    with arrays of rows and columns), and a rectangular window can be read as a 2D
+    boolean array, or combined with one (window, or_window)."""
+
+    def __init__(self, h, w, packed=False, directory=None, name='mask'):
+        self.h = h
+        self.w = w
+        self.packed = packed
+        if packed:
+            shape = (h, (w + 7) // 8)
+            dtype = np.uint8
+        else:
+            shape = (h, w)
+            dtype = np.bool_
+        if directory is not None:
+            self.data = np.memmap(os.path.join(directory, name + ('.bits' if packed else '.u8')), dtype=dtype,
+                                  mode='w+', shape=shape)
+        else:
+            self.data = np.zeros(shape, dtype=dtype)
+
+    def get(self, rows, cols):
+        """Returns the flags of the cells given by an array of rows and an array of
+        columns, as a boolean array."""
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        if self.packed:
+            return ((self.data[rows, cols >> 3] >> (7 - (cols & 7)).astype(np.uint8)) & 1).astype(np.bool_)
+        return np.asarray(self.data[rows, cols], dtype=np.bool_)
+
+    def set(self, rows, cols, value=True):
+        """Sets the flags of the cells given by an array of rows and an array of columns."""
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        if self.packed:
+            bits = (1 << (7 - (cols & 7))).astype(np.uint8)
+            if value:
+                np.bitwise_or.at(self.data, (rows, cols >> 3), bits)
+            else:
+                np.bitwise_and.at(self.data, (rows, cols >> 3), ~bits)
+        else:
+            self.data[rows, cols] = bool(value)
+
+    def get_cells(self, row_cols):
+        """Returns the flags of a list of (row, column) cells, as a boolean array."""
+        if not len(row_cols):
+            return np.zeros(0, dtype=np.bool_)
+        rows, cols = np.array(row_cols, dtype=np.int64).reshape(-1, 2).T
+        return self.get(rows, cols)
+
+    def set_cells(self, row_cols, value=True):
+        """Sets the flags of a list of (row, column) cells."""
+        if len(row_cols):
+            rows, cols = np.array(list(row_cols), dtype=np.int64).reshape(-1, 2).T
+            self.set(rows, cols, value)
+
+    def window(self, first_row, last_row, first_col, last_col):
+        """Returns the flags of the cells of the rows first_row to last_row - 1 and of the
+        columns first_col to last_col - 1, as a 2D boolean array."""
+        if self.packed:
+            first_byte = first_col >> 3
+            last_byte = (last_col + 7) >> 3
+            bits = np.unpackbits(np.asarray(self.data[first_row:last_row, first_byte:last_byte]), axis=1)
+            offset = first_col - 8 * first_byte
+            return bits[:, offset:offset + last_col - first_col].astype(np.bool_)
+        return np.array(self.data[first_row:last_row, first_col:last_col], dtype=np.bool_)
+
+    def or_window(self, first_row, first_col, values):
+        """Sets the flags of the cells of a window, starting at (first_row, first_col), where
+        a 2D boolean array is True (the other flags are kept)."""
+        last_row = first_row + values.shape[0]
+        last_col = first_col + values.shape[1]
+        if self.packed:
+            # The bytes at both ends of the window can hold cells out of it, so we combine
+            # the whole bytes.
+            first_byte = first_col >> 3
+            last_byte = (last_col + 7) >> 3
+            offset = first_col - 8 * first_byte
+            bits = np.zeros((values.shape[0], 8 * (last_byte - first_byte)), dtype=np.bool_)
+            bits[:, offset:offset + values.shape[1]] = values
+            self.data[first_row:last_row, first_byte:last_byte] |= np.packbits(bits, axis=1)
+        else:
+            self.data[first_row:last_row, first_col:last_col] |= values
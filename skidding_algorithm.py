@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ForestRoads
+                                 A QGIS plugin
+ Create a network of forest roads based on zones to access, roads to connect
+ them to, and a cost matrix.
+ The code of the plugin is based on the "LeastCostPath" plugin available on
+ https://github.com/Gooong/LeastCostPath. We thank their team for the template.
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 10-07-2019
+        copyright            : (C) 2019 by Clement Hardy
+        email                : clem.hardy@outlook.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ This script describes the mask of the cells that are at skidding distance of
+ a road, made from the euclidean distances from every cell to the closest road
+ cell : it is computed once from the existing roads, and then updated only
+ around the cells of each new road, so that the test is a single look-up
+ instead of a scan of every cell of the skidding neighborhood.
+"""
+
+
+from math import floor, sqrt
+import numpy as np
+from .dijkstra_algorithm import CHUNK_CELLS
+from .raster_mask import RasterMask
+
+# Number of consecutive cells of a new road whose distances are computed in the
+# same window (see SkiddingDistance.add_cells). The window around the cells of a
+# long road would be much bigger than the windows around its pieces.
+PIECE_CELLS = 64
+
+
+class SkiddingDistance:
+    """Cells covered by the roads : the cells whose euclidean distance (in the units
+    of the raster) to the closest road cell is at most the skidding distance. They
+    are kept in a RasterMask (one bit per cell if packed is True).
+
+    The neighborhood of a cell is made of the cells at offsets of (row, col) such
+    that sqrt((row * yres) ** 2 + (col * xres) ** 2) <= skidding distance, and the
+    distances are computed with this exact expression. As in the former scan of the
+    neighborhood of every cell, the road cells of the first row and of the first
+    column are ignored.
+
+    The distances are first computed in bands of rows : in each column, the number
+    of rows to the closest road cell is found by a pass upwards and a pass
+    downwards, and the distance is then the smallest one over the columns within
+    the skidding distance. When new road cells are added, the distances to them are
+    computed in the same way in the window around them, and the distances of the
+    window are lowered to them.
+
+    The distances are only computed a few rows at a time, and then compared to the
+    skidding distance : a cell is covered if it is by at least one band or window.
+    If a folder is given, the mask is a memory-mapped file in it (for the rasters
+    that do not fit in memory)."""
+
+    def __init__(self, roads, skidding_distance, xres, yres, directory=None, packed=True):
+        """The roads are the RasterMask of the road cells (e.g. the road matrix of the
+        algorithm)."""
+        self.h, self.w = roads.h, roads.w
+        self.skidding_distance = skidding_distance
+        # Number of rows and columns of the neighborhood on each side of a cell.
+        self.row_radius = floor(skidding_distance / yres) + 1
+        self.col_radius = floor(skidding_distance / xres) + 1
+        # Squares of the lengths of the offsets of 0, 1, 2... rows and columns.
+        self.row_squares = [(row * yres) ** 2 for row in range(self.row_radius + 1)]
+        self.col_squares = [(col * xres) ** 2 for col in range(self.col_radius + 1)]
+        # Number of cells of the neighborhood.
+        self.neighborhood_cells = sum(1 for row in range(-self.row_radius, self.row_radius + 1)
+                                      for col in range(-self.col_radius, self.col_radius + 1)
+                                      if sqrt(self.row_squares[abs(row)] + self.col_squares[abs(col)])
+                                      <= skidding_distance)
+
+        self.covered = RasterMask(self.h, self.w, packed, directory, 'skidding')
+        band = max(1, CHUNK_CELLS // max(1, self.w))
+        for first in range(0, self.h, band):
+            last = min(self.h, first + band)
+            # The rows of the band can be covered by road cells of the neighbouring bands.
+            lower = max(0, first - self.row_radius)
+            upper = min(self.h, last + self.row_radius)
+            road_cells = roads.window(lower, upper, 0, self.w)
+            if lower == 0:
+                road_cells[0] = False
+            road_cells[:, 0] = False
+            distances = self._distance_transform(road_cells)[first - lower:last - lower]
+            self.covered.or_window(first, 0, distances <= self.skidding_distance)
+
+    def neighborhood_size(self):
+        """Returns the number of cells of the neighborhood."""
+        return self.neighborhood_cells
+
+    def _distance_transform(self, road_cells):
+        """Returns the distances of the cells of a 2D boolean array of the road cells to
+        the closest road cell (inf beyond the skidding distance)."""
+        h, w = road_cells.shape
+        # Number of rows from every cell to the closest road cell of its column, up to
+        # row_radius + 1 (for the farther ones).
+        far = self.row_radius + 1
+        gaps = np.empty((h, w), dtype=np.int64)
+        current = np.full(w, far, dtype=np.int64)
+        for row in range(h):
+            current = np.where(road_cells[row], 0, np.minimum(current + 1, far))
+            gaps[row] = current
+        current = np.full(w, far, dtype=np.int64)
+        for row in range(h - 1, -1, -1):
+            current = np.where(road_cells[row], 0, np.minimum(current + 1, far))
+            np.minimum(gaps[row], current, out=gaps[row])
+        row_terms = np.array(self.row_squares + [np.inf], dtype=np.float64)[gaps]
+        # The squared distance is the smallest one over the columns of the neighborhood.
+        squares = np.full((h, w), np.inf)
+        for d_col in range(-self.col_radius, self.col_radius + 1):
+            if abs(d_col) >= w:
+                continue
+            target = squares[:, max(0, -d_col):w - max(0, d_col)]
+            source = row_terms[:, max(0, d_col):w - max(0, -d_col)]
+            np.minimum(target, source + self.col_squares[abs(d_col)], out=target)
+        distances = np.sqrt(squares)
+        distances[distances > self.skidding_distance] = np.inf
+        return distances
+
+    def add_cells(self, row_cols):
+        """Adds the cells covered by new road cells (e.g. the cells of a new road). The
+        cells are taken by pieces of consecutive cells, and the distances to the cells of
+        a piece are computed in the window around them only."""
+        cells = [(row, col) for row, col in row_cols if 0 < row < self.h and 0 < col < self.w]
+        for first in range(0, len(cells), PIECE_CELLS):
+            rows, cols = np.array(cells[first:first + PIECE_CELLS], dtype=np.int64).T
+            first_row = max(0, int(rows.min()) - self.row_radius)
+            last_row = min(self.h, int(rows.max()) + self.row_radius + 1)
+            first_col = max(0, int(cols.min()) - self.col_radius)
+            last_col = min(self.w, int(cols.max()) + self.col_radius + 1)
+            road_cells = np.zeros((last_row - first_row, last_col - first_col), dtype=np.bool_)
+            road_cells[rows - first_row, cols - first_col] = True
+            self.covered.or_window(first_row, first_col,
+                                   self._distance_transform(road_cells) <= self.skidding_distance)
+
+    def uncovered(self, row_cols, roads=None):
+        """Returns the (row, column) cells of a list that are not at skidding distance of a
+        road, in the same order, looking them all up at once. If the RasterMask of the
+        roads is given, the road cells are also removed."""
+        if not row_cols:
+            return []
+        rows, cols = np.array(row_cols, dtype=np.int64).T
+        kept = ~self.covered.get(rows, cols)
+        if roads is not None:
+            kept &= ~roads.get(rows, cols)
+        return [row_cols[index] for index in np.flatnonzero(kept)]
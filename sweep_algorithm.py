@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+
+"""
+/***************************************************************************
+ ForestRoads
+                                 A QGIS plugin
+ Create a network of forest roads based on zones to access, roads to connect
+ them to, and a cost matrix.
+ The code of the plugin is based on the "LeastCostPath" plugin available on
+ https://github.com/Gooong/LeastCostPath. We thank their team for the template.
+ Generated by Plugin Builder: http://g-sherman.github.io/Qgis-Plugin-Builder/
+                              -------------------
+        begin                : 10-07-2019
+        copyright            : (C) 2019 by Clement Hardy
+        email                : clem.hardy@outlook.fr
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+ This script describes the computation of a whole cost-distance raster from
+ some source cells (e.g. the road network) with NumPy sweeps : instead of
+ taking the cells one by one, the raster is swept column by column and row by
+ row in the four directions, each column or row being updated at once from
+ the previous one. The paths are then traced back from any cell with the
+ raster of the back-directions. When new sources are added (e.g. a new road),
+ the rasters are only repaired around them.
+"""
+
+
+import heapq
+from math import sqrt
+import numpy as np
+from .dijkstra_algorithm import NEIGHBOURS_OFFSETS, CANCEL_CHECK_INTERVAL
+
+# Value of the back-direction of the sources and of the cells that cannot reach them.
+NO_DIRECTION = 255
+
+# Index in NEIGHBOURS_OFFSETS of every (row, column) offset.
+DIRECTION_INDEXES = {(d_row, d_col): index for index, (d_row, d_col, diagonal) in enumerate(NEIGHBOURS_OFFSETS)}
+
+
+def _sweep_columns(dist, back, edges, columns, d_col, directions):
+    """Updates each column of the rasters from the previous one (at an offset of
+    -d_col), in the order of "columns". The edges are the costs of the moves between
+    neighbouring columns (see _column_edges), and directions the back-directions of
+    the moves from the same row, the row below and the row above."""
+    straight, diagonal_up, diagonal_down = edges
+    h = dist.shape[0]
+    candidates = np.full((3, h), np.inf)
+    rows = np.arange(h)
+    changed = False
+    for col in columns:
+        previous = col - d_col
+        # The moves between the columns col and previous are stored at the smallest of both.
+        edge = min(col, previous)
+        dist_previous = dist[:, previous]
+        np.add(dist_previous, straight[:, edge], out=candidates[0])
+        if d_col == 1:
+            # From (row - 1, previous) and (row + 1, previous).
+            np.add(dist_previous[:-1], diagonal_up[:, edge], out=candidates[1, 1:])
+            np.add(dist_previous[1:], diagonal_down[:, edge], out=candidates[2, :-1])
+        else:
+            np.add(dist_previous[:-1], diagonal_down[:, edge], out=candidates[1, 1:])
+            np.add(dist_previous[1:], diagonal_up[:, edge], out=candidates[2, :-1])
+        best = candidates.argmin(axis=0)
+        best_dist = candidates[best, rows]
+        better = best_dist < dist[:, col]
+        if better.any():
+            dist[better, col] = best_dist[better]
+            back[better, col] = directions[best[better]]
+            changed = True
+    return changed
+
+
+def _column_edges(costs):
+    """Returns the costs of the moves between the columns c and c + 1 of a cost raster
+    (with inf for the cells that cannot be crossed), stored in the column c : the
+    horizontal moves, the diagonal moves from (r, c) to (r + 1, c + 1) and the
+    diagonal moves from (r + 1, c) to (r, c + 1), stored in the row r. They are
+    computed as in the dijkstra function, so the distances are exactly the same."""
+    sqrt2 = sqrt(2)
+    straight = (costs[:, :-1] + costs[:, 1:]) / 2
+    diagonal_up = sqrt2 * (costs[:-1, :-1] + costs[1:, 1:]) / 2
+    diagonal_down = sqrt2 * (costs[1:, :-1] + costs[:-1, 1:]) / 2
+    return straight, diagonal_up, diagonal_down
+
+
+def sweep_cost_distance(state, source_keys, dist=None, back=None, max_rounds=None):
+    """Computes the least cost from the closest source cell (given by their flat
+    indexes) to every cell of a SearchState, without the angles, with the same
+    costs of moves as the dijkstra function.
+
+    A round sweeps the raster from left to right, right to left, bottom to top and
+    top to bottom; each column (or row) is updated from the previous one with a few
+    NumPy operations. The rounds go on until a round changes nothing : then no move
+    can make a distance smaller, so the distances are the least costs. The number of
+    rounds grows with the number of times the least cost paths change of general
+    direction, which is small on most cost rasters.
+
+    Returns the flat arrays of the distances (inf if the cell cannot reach a source)
+    and of the back-directions (index in NEIGHBOURS_OFFSETS of the offset to the next
+    cell towards the closest source, or NO_DIRECTION). If dist and back are given
+    (e.g. from a previous computation with fewer sources), they are updated in place,
+    which only works if the distances can only decrease."""
+    h, w = state.h, state.w
+    costs = np.where(state.passable, state.costs, np.inf).reshape(h, w)
+    if dist is None:
+        dist = np.full(h * w, np.inf)
+        back = np.full(h * w, NO_DIRECTION, dtype=np.uint8)
+    source_keys = np.asarray(list(source_keys), dtype=np.int64)
+    if len(source_keys):
+        source_keys = source_keys[state.passable[source_keys]]
+        dist[source_keys] = 0.0
+        back[source_keys] = NO_DIRECTION
+    dist2d = dist.reshape(h, w)
+    back2d = back.reshape(h, w)
+    # The rows are swept as the columns of the transposed rasters; an offset (row,
+    # column) in the transposed rasters is the offset (column, row) in the rasters.
+    sweeps = []
+    for transposed in (False, True):
+        if transposed:
+            views = (dist2d.T, back2d.T, _column_edges(costs.T))
+        else:
+            views = (dist2d, back2d, _column_edges(costs))
+        length = views[0].shape[1]
+        for d_col, columns in ((1, range(1, length)), (-1, range(length - 2, -1, -1))):
+            offsets = [(0, -d_col), (-1, -d_col), (1, -d_col)]
+            if transposed:
+                offsets = [(d_col, d_row) for d_row, d_col in offsets]
+            directions = np.array([DIRECTION_INDEXES[offset] for offset in offsets], dtype=np.uint8)
+            sweeps.append(views + (columns, d_col, directions))
+
+    rounds = 0
+    while max_rounds is None or rounds < max_rounds:
+        rounds += 1
+        changed = False
+        for sweep in sweeps:
+            if _sweep_columns(*sweep):
+                changed = True
+        if not changed:
+            break
+    return dist, back
+
+
+def trace_path(state, back, start_row_col):
+    """Follows the back-directions from a cell to a source. Returns the path, the
+    accumulated costs along the path and the source that was reached, as the
+    dijkstra function, or three None if the cell cannot reach a source (or is one)."""
+    sqrt2 = sqrt(2)
+    start_key = state.index(start_row_col)
+    if start_key is None or not state.passable[start_key] or back[start_key] == NO_DIRECTION:
+        return None, None, None
+    w = state.w
+    costs = memoryview(state.costs)
+    back = memoryview(back)
+    offsets = [d_row * w + d_col for d_row, d_col, diagonal in NEIGHBOURS_OFFSETS]
+    path = [divmod(start_key, w)]
+    costs_of_path = [0.0]
+    key = start_key
+    direction = back[key]
+    while direction != NO_DIRECTION:
+        next_key = key + offsets[direction]
+        if NEIGHBOURS_OFFSETS[direction][2]:
+            costs_of_path.append(costs_of_path[-1] + sqrt2 * (costs[key] + costs[next_key]) / 2)
+        else:
+            costs_of_path.append(costs_of_path[-1] + (costs[key] + costs[next_key]) / 2)
+        path.append(divmod(next_key, w))
+        key = next_key
+        direction = back[key]
+    return path, costs_of_path, path[-1]
+
+
+def repair_cost_distance(state, dist, back, new_source_keys, feedback=None):
+    """Updates in place the distances and back-directions computed by
+    sweep_cost_distance after new sources (flat indexes) have been added. Adding
+    sources can only make distances smaller, so a search is made from the new
+    sources only, and stops going further where it does not make the distances
+    smaller : it only visits the cells that are now closer to a new source than to
+    the old ones. The distances are then the same as if they were computed from all
+    the sources. Returns the number of cells that were updated (or None if the
+    search was cancelled; the rasters must then be computed again)."""
+    sqrt2 = sqrt(2)
+    h, w = state.h, state.w
+    costs = memoryview(state.costs)
+    passable = memoryview(state.passable)
+    dist_view = memoryview(dist)
+    back_view = memoryview(back)
+    # For each move : offset of the flat index, offset of the column, diagonal or not,
+    # and back-direction of the cell we move to.
+    moves = tuple((d_row * w + d_col, d_col, diagonal, DIRECTION_INDEXES[(-d_row, -d_col)])
+                  for d_row, d_col, diagonal in NEIGHBOURS_OFFSETS)
+    n = h * w
+
+    frontier = []
+    for key in new_source_keys:
+        if passable[key]:
+            # A source can already be at a distance of 0 (through cells of cost 0) : it
+            # only needs to become a source.
+            if dist_view[key] > 0.0:
+                frontier.append((0.0, key))
+            dist_view[key] = 0.0
+            back_view[key] = NO_DIRECTION
+    heapq.heapify(frontier)
+    updated = len(frontier)
+    popped = 0
+    while frontier:
+        current_cost, current_key = heapq.heappop(frontier)
+        # Entries whose distance has decreased since are stale.
+        if current_cost > dist_view[current_key]:
+            continue
+        popped += 1
+        if feedback is not None and popped % CANCEL_CHECK_INTERVAL == 0 and feedback.isCanceled():
+            return None
+        col = current_key % w
+        current_value = costs[current_key]
+        for d_key, d_col, diagonal, direction in moves:
+            next_key = current_key + d_key
+            if not (0 <= col + d_col < w and 0 <= next_key < n) or not passable[next_key]:
+                continue
+            if diagonal:
+                new_cost = current_cost + sqrt2 * (current_value + costs[next_key]) / 2
+            else:
+                new_cost = current_cost + (current_value + costs[next_key]) / 2
+            if new_cost < dist_view[next_key]:
+                dist_view[next_key] = new_cost
+                back_view[next_key] = direction
+                heapq.heappush(frontier, (new_cost, next_key))
+                updated += 1
+    return updated
+
+
+class SweepField:
+    """Cost-distance and back-direction rasters from the road network, used by the
+    "sweep" engine : a path is traced from the cell to reach to the closest road
+    cell by following the back-directions. The rasters are computed once with
+    sweep_cost_distance, and then repaired with repair_cost_distance around the new
+    cells of the network (if incremental is True; otherwise they are computed
+    again)."""
+
+    def __init__(self, state, network_row_cols, incremental=True):
+        self.state = state
+        self.incremental = incremental
+        self.network = set()
+        self.new_keys = []
+        self.dist = None
+        self.back = None
+        self.add_cells(network_row_cols)
+
+    def add_cells(self, row_cols):
+        """Adds new cells to the network (e.g. the cells of a new road)."""
+        for row_col in row_cols:
+            key = self.state.index(row_col)
+            if key is not None and key not in self.network:
+                self.network.add(key)
+                self.new_keys.append(key)
+
+    def search(self, start_row_col, feedback=None):
+        """Returns the path from a cell to the closest road cell, as the dijkstra function.
+        The start can also be a list of cells : the path is then traced from the one
+        that is the closest to the roads."""
+        if self.dist is not None and self.new_keys:
+            if not self.incremental or repair_cost_distance(self.state, self.dist, self.back, self.new_keys,
+                                                            feedback) is None:
+                self.dist = None
+        if self.dist is None:
+            self.dist, self.back = sweep_cost_distance(self.state, self.network)
+        self.new_keys = []
+        if isinstance(start_row_col, list):
+            # The cells that are roads are not starts (their distance is 0, but there is no path).
+            starts = [(self.dist[key], row_col) for row_col, key in
+                      ((row_col, self.state.index(row_col)) for row_col in start_row_col)
+                      if key is not None and key not in self.network]
+            if not starts:
+                return None, None, None
+            start_row_col = min(starts)[1]
+        return trace_path(self.state, self.back, start_row_col)